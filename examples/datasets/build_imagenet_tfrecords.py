@@ -83,6 +83,7 @@ import click
 
 import numpy as np
 import tensorflow as tf
+from tefla.dataset import shard_index
 from tefla.dataset.decoder import ImageCoder
 
 
@@ -270,7 +271,7 @@ def _process_image_files_batch(coder, thread_index, ranges, name, filenames,
         shard = thread_index * num_shards_per_batch + s
         output_filename = '%s-%.5d-of-%.5d' % (name, shard, num_shards)
         output_file = os.path.join(output_directory, output_filename)
-        writer = tf.python_io.TFRecordWriter(output_file)
+        writer = shard_index.IndexedTFRecordWriter(output_file)
 
         shard_counter = 0
         files_in_shard = np.arange(
@@ -287,7 +288,7 @@ def _process_image_files_batch(coder, thread_index, ranges, name, filenames,
             example = _convert_to_example(filename, image_buffer, label,
                                           synset, human, bbox,
                                           height, width)
-            writer.write(example.SerializeToString())
+            writer.write(example.SerializeToString(), name=os.path.splitext(os.path.basename(filename))[0], label=label)
             shard_counter += 1
             counter += 1
 
@@ -15,6 +15,7 @@ import numpy as np
 from six.moves import urllib
 import tensorflow as tf
 
+from tefla.dataset import shard_index
 from tefla.dataset.image_to_tfrecords import TFRecords
 
 # The URL where the CIFAR data can be downloaded.
@@ -77,7 +78,7 @@ def _add_to_tfrecord(filename, tfrecord_writer, split_name=None, offset=0):
                 jpg_string = sess.run(encoded_image, feed_dict={image_placeholder: image})
 
                 example = tfrecords.convert_to_example(filename_image, jpg_string, label, 'cifar100', _IMAGE_SIZE, _IMAGE_SIZE)
-                tfrecord_writer.write(example.SerializeToString())
+                tfrecord_writer.write(example.SerializeToString(), name=os.path.splitext(filename_image)[0], label=int(label))
 
         return offset + num_images
 
@@ -134,13 +135,13 @@ def main(dataset_dir):
         return
 
     # First, process the training data:
-    with tf.python_io.TFRecordWriter(training_filename) as tfrecord_writer:
+    with shard_index.IndexedTFRecordWriter(training_filename) as tfrecord_writer:
         offset = 0
         filename = os.path.join(dataset_dir, 'cifar-100-python', 'train')  # 1-indexed.
         offset = _add_to_tfrecord(filename, tfrecord_writer, offset=offset, split_name='train')
 
     # Next, process the testing data:
-    with tf.python_io.TFRecordWriter(testing_filename) as tfrecord_writer:
+    with shard_index.IndexedTFRecordWriter(testing_filename) as tfrecord_writer:
         filename = os.path.join(dataset_dir, 'cifar-100-python', 'test')
         _add_to_tfrecord(filename, tfrecord_writer, split_name='test')
 
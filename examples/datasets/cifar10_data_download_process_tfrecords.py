@@ -16,6 +16,7 @@ import numpy as np
 from six.moves import urllib
 import tensorflow as tf
 
+from tefla.dataset import shard_index
 from tefla.dataset.image_to_tfrecords import TFRecords
 
 # The URL where the CIFAR data can be downloaded.
@@ -81,7 +82,7 @@ def _add_to_tfrecord(filename, tfrecord_writer, split_name=None, offset=0):
                 jpg_string = sess.run(encoded_image, feed_dict={image_placeholder: image})
 
                 example = tfrecords.convert_to_example(filename_image, jpg_string, label, 'cifar', _IMAGE_SIZE, _IMAGE_SIZE)
-                tfrecord_writer.write(example.SerializeToString())
+                tfrecord_writer.write(example.SerializeToString(), name=os.path.splitext(filename_image)[0], label=int(label))
 
         return offset + num_images
 
@@ -138,14 +139,14 @@ def main(dataset_dir):
         return
 
     # First, process the training data:
-    with tf.python_io.TFRecordWriter(training_filename) as tfrecord_writer:
+    with shard_index.IndexedTFRecordWriter(training_filename) as tfrecord_writer:
         offset = 0
         for i in range(_NUM_TRAIN_FILES):
             filename = os.path.join(dataset_dir, 'cifar-10-batches-py', 'data_batch_%d' % (i + 1))  # 1-indexed.
             offset = _add_to_tfrecord(filename, tfrecord_writer, offset=offset, split_name='train')
 
     # Next, process the testing data:
-    with tf.python_io.TFRecordWriter(testing_filename) as tfrecord_writer:
+    with shard_index.IndexedTFRecordWriter(testing_filename) as tfrecord_writer:
         filename = os.path.join(dataset_dir, 'cifar-10-batches-py', 'test_batch')
         _add_to_tfrecord(filename, tfrecord_writer, split_name='test')
 
@@ -4,6 +4,7 @@ import scipy.io
 import os
 import sys
 import numpy as np
+from tefla.dataset import shard_index
 from tefla.dataset.image_to_tfrecords import TFRecords
 
 data_path = "/tmp/SVHN/"
@@ -114,7 +115,7 @@ def _add_to_tfrecord(images, labels, tfrecord_writer, split_name=None, offset=0)
                 jpg_string = sess.run(encoded_image, feed_dict={image_placeholder: image})
 
                 example = tfrecords.convert_to_example(filename_image, jpg_string, label, 'svhn', width, height)
-                tfrecord_writer.write(example.SerializeToString())
+                tfrecord_writer.write(example.SerializeToString(), name=filename_image, label=int(label))
 
         return offset + num_images
 
@@ -138,12 +139,12 @@ def main(dataset_dir):
     # First, process the training data:
     images, _, labels = load_training_data()
     # set_size, width, height, channels
-    with tf.python_io.TFRecordWriter(training_filename) as tfrecord_writer:
+    with shard_index.IndexedTFRecordWriter(training_filename) as tfrecord_writer:
         _add_to_tfrecord(images, labels, tfrecord_writer, offset=0, split_name='train')
 
     # Next, process the testing data:
     test_images, _, test_labels = load_test_data()
-    with tf.python_io.TFRecordWriter(testing_filename) as tfrecord_writer:
+    with shard_index.IndexedTFRecordWriter(testing_filename) as tfrecord_writer:
         _add_to_tfrecord(test_images, test_labels, tfrecord_writer, split_name='test')
 
     print('\nFinished converting the Cifar10 dataset!')
@@ -21,6 +21,7 @@ from __future__ import print_function
 import collections
 import tensorflow as tf
 from tefla.core.layers import dilated_conv2d as conv2d, max_pool
+from tefla.core.recompute import mark_checkpoint, BLOCK_CHECKPOINTS
 
 
 class Block(collections.namedtuple('Block', ['name', 'unit_fn', 'args'])):
@@ -134,6 +135,9 @@ def stack_blocks_dense(net, blocks, output_stride=None, **kwargs):
             is equivalent to output_stride=24).
         outputs_collections: Collection to add the ResNet block outputs.
 
+    The unit and block outputs are marked as checkpoint candidates of the activation
+    recomputation, see `tefla.core.recompute`.
+
     Returns:
         net: Output tensor with stride equal to the specified output_stride.
 
@@ -172,6 +176,8 @@ def stack_blocks_dense(net, blocks, output_stride=None, **kwargs):
                                             stride=unit_stride,
                                             rate=1, **kwargs)
                         current_stride *= unit_stride
+                    mark_checkpoint(net)
+            mark_checkpoint(net, BLOCK_CHECKPOINTS)
 
     if output_stride is not None and current_stride != output_stride:
         raise ValueError('The target output_stride cannot be reached.')
@@ -0,0 +1,49 @@
+from __future__ import division, print_function, absolute_import
+
+import click
+import tensorflow as tf
+
+from tefla.core import model_cost
+from tefla.utils import util
+
+
+@click.command()
+@click.option('--model', default=None, show_default=True,
+              help='Relative path to model.')
+@click.option('--model_fn', default='model', show_default=True,
+              help='Model function in the model file, e.g. resnet_v1_50 or vgg_16.')
+@click.option('--batch_size', default=32, show_default=True,
+              help='Batch size used for the activation memory and MACs.')
+@click.option('--crop_size', default=None, show_default=True,
+              help='Input width,height; defaults to the crop_size of the model file.')
+@click.option('--is_training', is_flag=True,
+              help='Analyze the training graph instead of the prediction graph.')
+@click.option('--sort_by', default='macs', show_default=True,
+              type=click.Choice(['macs', 'params', 'activation_bytes']),
+              help='Table sort key.')
+@click.option('--top', default=None, type=int,
+              help='Number of layers in the table, all if not given.')
+@click.option('--output', default=None, show_default=True,
+              help='Json report file.')
+def analyze(model, model_fn, batch_size, crop_size, is_training, sort_by, top, output):
+    """Prints the per layer params, MACs and activation memory of a model"""
+    model_def = util.load_module(model)
+    if crop_size:
+        crop_size = tuple(int(s) for s in crop_size.split(','))
+    elif getattr(model_def, 'crop_size', None) is not None:
+        crop_size = tuple(model_def.crop_size)
+    else:
+        raise click.UsageError('%s has no crop_size, set --crop_size' % model)
+    graph = tf.Graph()
+    with graph.as_default():
+        model_cost.build_model(model_def, model_fn, batch_size, crop_size, is_training=is_training)
+    costs = model_cost.layer_costs(graph, batch_size)
+    print(model_cost.format_cost_table(costs, sort_by, top))
+    if output:
+        model_cost.write_cost_report(output, costs, model=model, model_fn=model_fn, batch_size=batch_size,
+                                     crop_size=list(crop_size), is_training=is_training)
+        print('Report written to %s' % output)
+
+
+if __name__ == '__main__':
+    analyze()
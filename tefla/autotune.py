@@ -0,0 +1,190 @@
+from __future__ import division, print_function, absolute_import
+
+import itertools
+import threading
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import session_config
+from tefla.core.data_load_ops import get_image_files
+from tefla.da import data
+from tefla.da.iterator import ParallelDAIterator
+from tefla.utils import util
+
+
+def _parse_counts(counts, default):
+    if not counts:
+        return default
+    return [int(c) for c in counts.split(',')]
+
+
+def _thread_counts(num_cpus):
+    counts = [1]
+    while counts[-1] * 2 < num_cpus:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != num_cpus:
+        counts.append(num_cpus)
+    return counts
+
+
+def measure_images_per_sec(graph, inputs, predictions, batch, config, num_batches, warmup):
+    """Measures the forward pass throughput of a model with a session config
+
+    Args:
+        graph: the model graph
+        inputs: model input tensor
+        predictions: model output tensor
+        batch: a numpy array, input batch
+        config: a `tf.ConfigProto`
+        num_batches: number of timed batches
+        warmup: number of untimed batches run first
+
+    Returns:
+        a float, images per second
+    """
+    with tf.Session(graph=graph, config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+        for _ in range(warmup):
+            sess.run(predictions, feed_dict={inputs: batch})
+        tic = time.time()
+        for _ in range(num_batches):
+            sess.run(predictions, feed_dict={inputs: batch})
+        return num_batches * len(batch) / (time.time() - tic)
+
+
+class DALoad(object):
+    """Runs the data augmentation of training batches in a background thread, pinned to the da cpus
+
+    The batches are augmented by a `ParallelDAIterator` pool, as in a training, and thrown
+    away, so the tf threads are timed while the da workers load their cpus.
+
+    Args:
+        files: a numpy array of image files
+        batch_size: a int, batch size
+        crop_size: a tuple, crop size of the model
+        aug_params: a dict, augmentation params
+        num_workers: a int, number of da worker processes
+        cpu_affinity: a list of cpu ids of the da workers
+    """
+
+    def __init__(self, files, batch_size, crop_size, aug_params, num_workers, cpu_affinity):
+        if len(files) < batch_size:
+            raise ValueError('The da load needs at least %d images, got %d' % (batch_size, len(files)))
+        self.iterator = ParallelDAIterator(batch_size, True, None, crop_size, True, aug_params=aug_params,
+                                           num_workers=num_workers, cpu_affinity=cpu_affinity)
+        self.iterator(files)
+        self.num_images = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._tic = time.time()
+        self._thread.start()
+
+    def _run(self):
+        X = self.iterator.X
+        bs = self.iterator.batch_size
+        while not self._stop.is_set():
+            for start in range(0, len(X) - bs + 1, bs):
+                if self._stop.is_set():
+                    break
+                self.iterator.transform(X[start:start + bs], None)
+                self.num_images += bs
+
+    def stop(self):
+        """Stops the load, returns the augmented images per second"""
+        self._stop.set()
+        self._thread.join()
+        images_per_sec = self.num_images / (time.time() - self._tic)
+        self.iterator.pool.terminate()
+        return images_per_sec
+
+
+@click.command()
+@click.option('--model', default=None, show_default=True,
+              help='Relative path to model.')
+@click.option('--batch_size', default=32, show_default=True,
+              help='Batch size to tune for.')
+@click.option('--intra_op_threads', default=None, show_default=True,
+              help='Comma separated intra op thread counts, powers of two up to the cpu count if not given.')
+@click.option('--inter_op_threads', default=None, show_default=True,
+              help='Comma separated inter op thread counts, powers of two up to the cpu count if not given.')
+@click.option('--num_cpu_devices', default=None, show_default=True,
+              help='Comma separated numbers of cpu devices exposed to tf, the tf default if not given.')
+@click.option('--da_workers', default='0', show_default=True,
+              help='Comma separated numbers of cpus reserved for da workers, tf is pinned to the other cpus. '
+                   'The da workers augment the --da_dir images while the model is timed.')
+@click.option('--da_dir', default=None, show_default=True,
+              help='Directory of training images for the da load, required with da workers.')
+@click.option('--training_cnf', default=None, show_default=True,
+              help='Relative path to the training config, its aug_params are used by the da load.')
+@click.option('--num_batches', default=10, show_default=True,
+              help='Number of timed batches per setting.')
+@click.option('--warmup', default=2, show_default=True,
+              help='Number of untimed batches per setting.')
+@click.option('--tuning_file', default=session_config.DEFAULT_TUNING_FILE, show_default=True,
+              help='Json file with the best settings per host.')
+def autotune(model, batch_size, intra_op_threads, inter_op_threads, num_cpu_devices, da_workers, da_dir,
+             training_cnf, num_batches, warmup, tuning_file):
+    """Sweeps the session thread pools, cpu devices and cpu pinning and records the best setting for this host
+
+    With da workers, the da pool augments training images on its pinned cpus while the forward
+    pass is timed on the other ones, and a setting scores the slower of the model and da
+    throughputs, the throughput of a training input pipeline. The trainings and predictions use
+    the record if their cnf sets `session_tuning_file`.
+    """
+    model_def = util.load_module(model)
+    cpus = session_config.process_cpus()
+    graph = tf.Graph()
+    with graph.as_default():
+        end_points = model_def.model(is_training=False, reuse=None)
+        inputs = end_points['inputs']
+        predictions = end_points['predictions']
+    input_shape = [batch_size] + inputs.get_shape().as_list()[1:]
+    batch = np.random.rand(*input_shape).astype(np.float32)
+
+    intra_counts = _parse_counts(intra_op_threads, _thread_counts(len(cpus)))
+    inter_counts = _parse_counts(inter_op_threads, _thread_counts(len(cpus)))
+    device_counts = _parse_counts(num_cpu_devices, [None])
+    da_counts = _parse_counts(da_workers, [0])
+    if any(da_counts) and not da_dir:
+        raise click.UsageError('--da_dir is required to sweep da workers')
+    files = get_image_files(da_dir) if da_dir else None
+    aug_params = util.load_module(training_cnf).cnf['aug_params'] if training_cnf else data.no_augmentation_params
+    results = []
+    try:
+        for da, devices, intra, inter in itertools.product(da_counts, device_counts, intra_counts, inter_counts):
+            da_cpus, tf_cpus = session_config.cpu_split(da, cpus)
+            if da and intra > len(tf_cpus):
+                continue
+            settings = {'intra_op_threads': intra, 'inter_op_threads': inter, 'num_cpu_devices': devices,
+                        'da_workers': da or None, 'pin_cpus': bool(da)}
+            config = session_config.create_session_config(settings)
+            da_load = DALoad(files, batch_size, model_def.crop_size, aug_params, da, da_cpus) if da else None
+            try:
+                images_per_sec = measure_images_per_sec(graph, inputs, predictions, batch, config, num_batches,
+                                                        warmup)
+            finally:
+                da_images_per_sec = da_load.stop() if da_load is not None else None
+                session_config.set_cpu_affinity(cpus)
+            if da_images_per_sec is None:
+                print('devices: %4s intra: %2d inter: %2d -> %8.1f images/sec' % (
+                    devices, intra, inter, images_per_sec))
+            else:
+                print('devices: %4s intra: %2d inter: %2d da_workers: %2d -> %8.1f images/sec, '
+                      'da %8.1f images/sec' % (devices, intra, inter, da, images_per_sec, da_images_per_sec))
+                images_per_sec = min(images_per_sec, da_images_per_sec)
+            results.append((images_per_sec, settings))
+    finally:
+        session_config.set_cpu_affinity(cpus)
+
+    best_images_per_sec, best_settings = max(results, key=lambda r: r[0])
+    print('Best for %s: %s, %.1f images/sec' % (session_config.host_name(), best_settings, best_images_per_sec))
+    session_config.save_tuned_settings(best_settings, best_images_per_sec, model, batch_size, tuning_file)
+    print('Saved to %s, set `session_tuning_file` in the cnf to use it' % tuning_file)
+
+
+if __name__ == '__main__':
+    autotune()
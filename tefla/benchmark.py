@@ -0,0 +1,261 @@
+from __future__ import division, print_function, absolute_import
+
+import json
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import layers
+from tefla.core import model_cost
+from tefla.core import session_config
+from tefla.core import towers
+from tefla.utils import util
+
+# the resnet modules have no crop_size and no classifier by default
+_RESNET_ARGS = {'crop_size': (224, 224), 'num_classes': 1000}
+
+# model file, model function, `model_cost.build_model` args
+MODEL_ZOO = [
+    ('models/alexnet.py', 'alexnet_v2', {}),
+    ('models/vgg.py', 'vgg_16', {}),
+    ('models/resnet_v1.py', 'resnet_v1_50', _RESNET_ARGS),
+    ('models/resnet_v2.py', 'resnet_v2_50', _RESNET_ARGS),
+    ('models/squeezenet_v1.py', 'model', {}),
+    ('models/squeezenet_v2.py', 'model', {}),
+]
+
+
+def _predictions(end_points):
+    if 'predictions' in end_points:
+        return end_points['predictions']
+    return tf.nn.softmax(end_points['logits'])
+
+
+def _build(model_def, model_fn, is_training, build_args=None):
+    graph = tf.Graph()
+    tic = time.time()
+    with graph.as_default():
+        end_points = model_cost.build_model(model_def, model_fn, is_training=is_training, **(build_args or {}))
+        inputs = end_points['inputs']
+        predictions = _predictions(end_points)
+        if is_training:
+            loss = -tf.reduce_mean(tf.log(predictions + 1e-7))
+            grads = tf.gradients(loss, tf.trainable_variables())
+            target = tf.group(*[g for g in grads if g is not None])
+        else:
+            target = predictions
+        init = tf.global_variables_initializer()
+    return graph, inputs, target, init, time.time() - tic
+
+
+def benchmark_model(model_def, model_fn, batch_sizes, num_batches, warmup, repeats, config, build_args=None):
+    """Benchmarks the forward and forward+backward passes of a model
+
+    Args:
+        model_def: the model module
+        model_fn: name of the model function in the module
+        batch_sizes: a list of batch sizes
+        num_batches: number of timed batches per repeat
+        warmup: number of untimed batches run before timing a batch size
+        repeats: number of timed repeats, the median throughput is reported
+        config: a `tf.ConfigProto`
+        build_args: a dict, extra `model_cost.build_model` args, e.g. crop_size and num_classes
+
+    Returns:
+        a dict with the build and session init times and, per pass and batch size,
+        the median and min/max images per second of the repeats
+    """
+    result = {}
+    for mode, is_training in (('forward', False), ('forward_backward', True)):
+        graph, inputs, target, init, build_seconds = _build(model_def, model_fn, is_training, build_args)
+        tic = time.time()
+        sess = tf.Session(graph=graph, config=config)
+        sess.run(init)
+        init_seconds = time.time() - tic
+        throughput = {}
+        input_shape = inputs.get_shape().as_list()[1:]
+        for batch_size in batch_sizes:
+            batch = np.random.rand(batch_size, *input_shape).astype(np.float32)
+            for _ in range(warmup):
+                sess.run(target, feed_dict={inputs: batch})
+            images_per_sec = []
+            for _ in range(repeats):
+                tic = time.time()
+                for _ in range(num_batches):
+                    sess.run(target, feed_dict={inputs: batch})
+                images_per_sec.append(num_batches * batch_size / (time.time() - tic))
+            throughput[str(batch_size)] = {'images_per_sec': float(np.median(images_per_sec)),
+                                           'min': float(np.min(images_per_sec)),
+                                           'max': float(np.max(images_per_sec))}
+            print('%-35s %-16s batch %4d: %8.1f images/sec' % (
+                model_def.__name__ + '.' + model_fn, mode, batch_size, np.median(images_per_sec)))
+        sess.close()
+        result[mode] = {'build_seconds': build_seconds, 'session_init_seconds': init_seconds,
+                        'throughput': throughput}
+    return result
+
+
+def _build_towers(model_def, model_fn, num_towers, build_args=None):
+    build_args = dict(build_args or {})
+    graph = tf.Graph()
+    with graph.as_default():
+        crop_size = build_args.pop('crop_size', None) or model_def.crop_size
+        inputs = tf.placeholder(tf.float32, shape=(None, crop_size[1], crop_size[0], 3), name='inputs')
+        tower_grads = []
+        for i, (device, tower_inputs) in enumerate(zip(towers.tower_devices(num_towers, 'cpu'),
+                                                       towers.split_batch(inputs, num_towers))):
+            with tf.device(device), tf.name_scope('tower_%d' % i), layers.input_default(tower_inputs):
+                end_points = model_cost.build_model(model_def, model_fn, crop_size=crop_size, is_training=True,
+                                                    reuse=True if i else None, **build_args)
+                loss = -tf.reduce_mean(tf.log(_predictions(end_points) + 1e-7))
+                variables = tf.trainable_variables()
+                tower_grads.append(list(zip(tf.gradients(loss, variables), variables)))
+        grads = [g for g, _ in towers.average_gradients(tower_grads) if g is not None]
+        target = tf.group(*grads)
+        init = tf.global_variables_initializer()
+    return graph, inputs, target, init
+
+
+def benchmark_towers(model_def, model_fn, batch_size, tower_counts, num_batches, warmup, repeats, cnf=None,
+                     build_args=None):
+    """Benchmarks the forward+backward pass of data parallel towers on logical cpu devices
+
+    The batch is split between the towers and the tower gradients are averaged, as in
+    `SupervisedTrainer` with `tower_device = 'cpu'`; each tower count runs in a session with
+    as many cpu devices, the cpus being shared between the towers.
+
+    Args:
+        model_def: the model module
+        model_fn: name of the model function in the module
+        batch_size: the total batch size, a multiple of the tower counts
+        tower_counts: a list of tower counts
+        num_batches: number of timed batches per repeat
+        warmup: number of untimed batches
+        repeats: number of timed repeats, the median throughput is reported
+        cnf: a dict, session settings of `create_session_config`
+        build_args: a dict, extra `model_cost.build_model` args, e.g. crop_size and num_classes
+
+    Returns:
+        a dict, per tower count, of the median images per second and the speedup against a
+        single tower
+    """
+    if any(batch_size % t for t in tower_counts):
+        raise ValueError('Batch size %d is not a multiple of the tower counts %s' % (batch_size, tower_counts))
+    result = {}
+    for num_towers in sorted(tower_counts):
+        graph, inputs, target, init = _build_towers(model_def, model_fn, num_towers, build_args)
+        config = session_config.create_session_config(
+            cnf, allow_soft_placement=True, **towers.tower_session_settings(num_towers, 'cpu'))
+        with tf.Session(graph=graph, config=config) as sess:
+            sess.run(init)
+            batch = np.random.rand(batch_size, *inputs.get_shape().as_list()[1:]).astype(np.float32)
+            for _ in range(warmup):
+                sess.run(target, feed_dict={inputs: batch})
+            images_per_sec = []
+            for _ in range(repeats):
+                tic = time.time()
+                for _ in range(num_batches):
+                    sess.run(target, feed_dict={inputs: batch})
+                images_per_sec.append(num_batches * batch_size / (time.time() - tic))
+        result[str(num_towers)] = {'images_per_sec': float(np.median(images_per_sec))}
+    base = result[str(min(tower_counts))]['images_per_sec']
+    for num_towers in sorted(tower_counts):
+        stats = result[str(num_towers)]
+        stats['speedup'] = stats['images_per_sec'] / base if base > 0 else 0.0
+        print('%-35s %2d cpu towers batch %4d: %8.1f images/sec, %.2fx' % (
+            model_def.__name__ + '.' + model_fn, num_towers, batch_size, stats['images_per_sec'], stats['speedup']))
+    return result
+
+
+def compare_benchmarks(baseline, current, tolerance=0.1):
+    """Compares two benchmark reports
+
+    Args:
+        baseline: baseline report dict
+        current: current report dict
+        tolerance: a float, relative throughput drop that counts as a regression
+
+    Returns:
+        a list of (model, pass, batch size, baseline images/sec, current images/sec) regressions,
+        a pass or batch size of the baseline that failed or is missing in the current report is
+        a regression with 0 images/sec
+    """
+    regressions = []
+    for name, result in current['models'].items():
+        base_result = baseline['models'].get(name, {})
+        for mode in ('forward', 'forward_backward'):
+            if mode not in base_result:
+                continue
+            throughput = result.get(mode, {}).get('throughput', {})
+            for batch_size, base_stats in base_result[mode]['throughput'].items():
+                images_per_sec = throughput.get(batch_size, {}).get('images_per_sec', 0.0)
+                if images_per_sec < (1 - tolerance) * base_stats['images_per_sec']:
+                    regressions.append((name, mode, int(batch_size), base_stats['images_per_sec'],
+                                        images_per_sec))
+    return regressions
+
+
+@click.command()
+@click.option('--models', default=None, show_default=True,
+              help='Comma separated model_file:model_fn list, the bundled model zoo if not given.')
+@click.option('--batch_sizes', default='1,8,32', show_default=True,
+              help='Comma separated batch sizes.')
+@click.option('--num_batches', default=10, show_default=True,
+              help='Number of timed batches per repeat.')
+@click.option('--warmup', default=3, show_default=True,
+              help='Number of untimed batches per batch size.')
+@click.option('--repeats', default=3, show_default=True,
+              help='Number of timed repeats, the median is reported.')
+@click.option('--output', default='benchmark.json', show_default=True,
+              help='Json results file.')
+@click.option('--baseline', default=None, show_default=True,
+              help='Json results file to compare with, exits with 1 on a regression.')
+@click.option('--tolerance', default=0.1, show_default=True,
+              help='Relative throughput drop reported as a regression.')
+@click.option('--cpu_towers', default=None, show_default=True,
+              help='Comma separated tower counts, compares the forward+backward throughput of data '
+                   'parallel towers on logical cpu devices at the largest batch size.')
+def benchmark(models, batch_sizes, num_batches, warmup, repeats, output, baseline, tolerance, cpu_towers):
+    """Benchmarks the model zoo on cpu"""
+    if models:
+        zoo_args = dict(((f, fn), args) for f, fn, args in MODEL_ZOO)
+        models = [tuple(m.split(':')) for m in models.split(',')]
+        models = [(f, fn, zoo_args.get((f, fn), {})) for f, fn in models]
+    else:
+        models = MODEL_ZOO
+    batch_sizes = [int(b) for b in batch_sizes.split(',')]
+    config = session_config.create_session_config({'num_gpu_devices': 0})
+    report = {'commit': util.get_commit_sha(), 'host': session_config.host_name(),
+              'tf_version': tf.__version__, 'batch_sizes': batch_sizes, 'num_batches': num_batches,
+              'warmup': warmup, 'repeats': repeats, 'models': {}}
+    for model_file, model_fn, build_args in models:
+        name = '%s:%s' % (model_file, model_fn)
+        try:
+            model_def = util.load_module(model_file)
+            report['models'][name] = benchmark_model(model_def, model_fn, batch_sizes, num_batches, warmup,
+                                                     repeats, config, build_args)
+            if cpu_towers:
+                report['models'][name]['cpu_towers'] = benchmark_towers(
+                    model_def, model_fn, max(batch_sizes), [int(t) for t in cpu_towers.split(',')], num_batches,
+                    warmup, repeats, {'num_gpu_devices': 0}, build_args)
+        except Exception as e:
+            print('%s failed: %s' % (name, e))
+            report['models'][name] = {'error': str(e)}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Results written to %s' % output)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare_benchmarks(json.load(f), report, tolerance)
+        for name, mode, batch_size, base, current in regressions:
+            print('Regression %s %s batch %d: %.1f -> %.1f images/sec' % (name, mode, batch_size, base, current))
+        if regressions:
+            raise SystemExit(1)
+        print('No regressions against %s' % baseline)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,93 @@
+from __future__ import division, print_function, absolute_import
+
+import time
+
+import click
+import tensorflow as tf
+
+from tefla.core import session_config
+from tefla.dataset.base import Dataset
+from tefla.dataset.dataflow import Dataflow
+from tefla.dataset.decoder import Decoder
+
+
+def _feature_keys():
+    return {
+        'image/encoded/image': tf.FixedLenFeature((), tf.string, default_value=''),
+        'image/format': tf.FixedLenFeature((), tf.string, default_value='jpg'),
+        'image/class/label': tf.FixedLenFeature([], tf.int64, default_value=tf.zeros([], dtype=tf.int64)),
+    }
+
+
+def benchmark_input(data_dir, file_pattern, image_size, batch_size, num_batches, warmup, num_readers,
+                    num_preprocess_threads, batched, config):
+    """Measures the records per second of the TFRecord input pipeline
+
+    Args:
+        data_dir: TFRecord shards directory
+        file_pattern: glob pattern of the shards in `data_dir`
+        image_size: a list, [height, width, channels] of the encoded images
+        batch_size: a int, batch size
+        num_batches: number of timed batches
+        warmup: number of untimed batches
+        num_readers: number of TFRecord readers
+        num_preprocess_threads: number of threads, or parallel iterations of the batched path
+        batched: bool, use `Dataflow.batched_inputs` instead of `Dataflow.batch_inputs`
+        config: a `tf.ConfigProto`
+
+    Returns:
+        a float, records per second
+    """
+    with tf.Graph().as_default():
+        dataset = Dataset('benchmark', Decoder(_feature_keys()), data_dir, file_pattern=file_pattern)
+        dataflow = Dataflow(dataset, num_readers=num_readers, shuffle=True, min_queue_examples=4 * batch_size,
+                            capacity=16 * batch_size)
+        if batched:
+            images, labels = dataflow.batched_inputs(batch_size, True, image_size, image_size[:2],
+                                                     num_preprocess_threads=num_preprocess_threads)
+        else:
+            images, labels = dataflow.batch_inputs(batch_size, True, image_size, image_size[:2],
+                                                   num_preprocess_threads=num_preprocess_threads)
+        with tf.Session(config=config) as sess:
+            sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+            try:
+                for _ in range(warmup):
+                    sess.run([images, labels])
+                tic = time.time()
+                for _ in range(num_batches):
+                    sess.run([images, labels])
+                records_per_sec = num_batches * batch_size / (time.time() - tic)
+            finally:
+                coord.request_stop()
+                coord.join(threads, stop_grace_period_secs=5)
+    return records_per_sec
+
+
+@click.command()
+@click.option('--data_dir', help='TFRecord shards directory.')
+@click.option('--file_pattern', default='*', show_default=True, help='Glob pattern of the shards.')
+@click.option('--image_size', default='256,256,3', show_default=True,
+              help='Comma separated height, width, channels of the encoded images.')
+@click.option('--batch_size', default=32, show_default=True, help='Batch size.')
+@click.option('--num_batches', default=50, show_default=True, help='Number of timed batches.')
+@click.option('--warmup', default=10, show_default=True, help='Number of untimed batches.')
+@click.option('--num_readers', default=4, show_default=True, help='Number of TFRecord readers.')
+@click.option('--num_preprocess_threads', default=8, show_default=True,
+              help='Preprocessing threads, a multiple of 4.')
+def main(data_dir, file_pattern, image_size, batch_size, num_batches, warmup, num_readers, num_preprocess_threads):
+    """Compares the per example and the batched parsing input pipelines"""
+    image_size = [int(s) for s in image_size.split(',')]
+    config = session_config.create_session_config()
+    results = []
+    for name, batched in (('per example', False), ('batched', True)):
+        records_per_sec = benchmark_input(data_dir, file_pattern, image_size, batch_size, num_batches, warmup,
+                                          num_readers, num_preprocess_threads, batched, config)
+        results.append(records_per_sec)
+        print('%-12s %8.1f records/sec' % (name, records_per_sec))
+    print('Speedup: %.2fx' % (results[1] / results[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Computes the `AggregateStandardizer` parameters of a training image directory in one pass."""
+from __future__ import division, print_function, absolute_import
+
+import time
+
+import click
+import numpy as np
+
+from tefla.core import data_load_ops as data
+from tefla.da import dataset_stats
+
+
+@click.command()
+@click.option('--directory', default='data/train', show_default=True,
+              help='Directory with the training images, e.g. the training_<size> directory of a dir_dataset.')
+@click.option('--output', default='data/standardizer.npz', show_default=True,
+              help='Standardizer parameter file, load it with AggregateStandardizer.from_file.')
+@click.option('--subset', default=None, type=int, show_default=True,
+              help='Compute the statistics on a random subset of that many images.')
+@click.option('--seed', default=None, type=int, show_default=True,
+              help='Seed of the subset selection.')
+@click.option('--num_workers', default=None, type=int, show_default=True,
+              help='Number of worker processes, the number of cpus if not given.')
+@click.option('--chunksize', default=8, show_default=True,
+              help='Number of images sent to a worker at a time.')
+def main(directory, output, subset, seed, num_workers, chunksize):
+    filenames = data.get_image_files(directory)
+    print('Computing the statistics of %d images from %s' % (subset or len(filenames), directory))
+    tic = time.time()
+    stats, failures = dataset_stats.compute_channel_stats(filenames, num_workers=num_workers, chunksize=chunksize,
+                                                          subset=subset, seed=seed)
+    for fname, error in failures:
+        print('Failed %s: %s' % (fname, error))
+    params = dataset_stats.standardizer_params(stats)
+    dataset_stats.save_standardizer_params(output, params, num_pixels=np.int64(stats.count))
+    print('mean: %s' % params['mean'])
+    print('std: %s' % params['std'])
+    print('u: %s' % params['u'].tolist())
+    print('ev: %s' % params['ev'])
+    print('Done in %.1f s, parameters saved to %s' % (time.time() - tic, output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 """Resize and crop images to square, save as tiff."""
 from __future__ import division, print_function
 
+import json
+import io
 import os
+import threading
+import time
+import traceback
 from PIL import Image, ImageFilter
 from multiprocessing import cpu_count
 from multiprocessing.pool import Pool
@@ -10,14 +15,53 @@ import click
 import numpy as np
 
 from tefla.da import data
+from tefla.dataset import shard_index
 
 N_PROC = cpu_count()
+THUMBNAIL_SIZE = 512
+MANIFEST_NAME = 'convert_manifest.jsonl'
+FAILURES_NAME = 'convert_failures.txt'
 
 
 def convert(fname, target_size):
     img = Image.open(fname)
+    bbox = foreground_bbox(img, fname)
+    if bbox is None:
+        bbox = square_bbox(img, fname)
+
+    cropped = img.crop(bbox)
+    resized = cropped.resize([target_size, target_size])
+    return resized
+
+
+def convert_thumbnail(fname, target_size, thumbnail_size=THUMBNAIL_SIZE):
+    """Same as `convert`, but detects the bbox on a thumbnail of the image
+
+    The bbox detection blurs and scans the whole image, on large sources it costs much more than the
+    crop and resize. Here it runs on a thumbnail (decoded at reduced scale for jpeg), the bbox is mapped
+    back to the source image which is then cropped and resized once.
+
+    Args:
+        fname: image file name
+        target_size: size of the converted image
+        thumbnail_size: max size of the thumbnail used for the bbox detection
 
-    blurred = img.filter(ImageFilter.BLUR)
+    Returns:
+        the converted PIL image
+    """
+    img = Image.open(fname)
+    bbox = thumbnail_bbox(fname, img.size, thumbnail_size)
+    if bbox is None:
+        bbox = square_bbox(img, fname)
+
+    cropped = img.crop(bbox)
+    resized = cropped.resize([target_size, target_size])
+    return resized
+
+
+def foreground_bbox(img, fname, blur=True):
+    """Returns the bbox of the fundus in a wide image, None if it is not wide or the bbox is not found"""
+    blurred = img.filter(ImageFilter.BLUR) if blur else img
     ba = np.array(blurred)
     h, w, _ = ba.shape
 
@@ -40,13 +84,73 @@ def convert(fname, target_size):
                 bbox = None
     else:
         bbox = None
-
+    return bbox
+
+
+def thumbnail_bbox(fname, size, thumbnail_size=THUMBNAIL_SIZE):
+    """Detects the foreground bbox on a thumbnail and maps it to the source image coordinates
+
+    Args:
+        fname: image file name
+        size: (width, height) of the source image
+        thumbnail_size: max size of the thumbnail
+
+    Returns:
+        a tuple, (left, upper, right, lower) in source coordinates, None if not found
+    """
+    thumb = Image.open(fname)
+    # for jpeg the decoder downscales by 1/2, 1/4 or 1/8 while decoding
+    thumb.draft(thumb.mode, (thumbnail_size, thumbnail_size))
+    thumb.thumbnail((thumbnail_size, thumbnail_size), Image.BILINEAR)
+    # downscaling already smooths the noise, a blur would grow the bbox by a few thumbnail pixels
+    bbox = foreground_bbox(thumb, fname, blur=False)
     if bbox is None:
-        bbox = square_bbox(img, fname)
-
-    cropped = img.crop(bbox)
-    resized = cropped.resize([target_size, target_size])
-    return resized
+        return None
+    sx = size[0] / thumb.size[0]
+    sy = size[1] / thumb.size[1]
+    left, upper, right, lower = bbox
+    return (max(int(left * sx), 0), max(int(upper * sy), 0),
+            min(int(np.ceil(right * sx)), size[0]), min(int(np.ceil(lower * sy)), size[1]))
+
+
+def bbox_iou(a, b):
+    iw = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 1.0
+
+
+def check_thumbnail_bbox(filenames, target_size, thumbnail_size=THUMBNAIL_SIZE):
+    """Compares the thumbnail bbox detection with the full resolution one
+
+    Args:
+        filenames: list of image files
+        target_size: size of the converted images, used for the throughput
+        thumbnail_size: max size of the thumbnail
+
+    Returns:
+        a dict with the bbox ious (mean, min), the number of files where only one
+        method found a bbox and the images/sec of `convert` and `convert_thumbnail`
+    """
+    ious = []
+    mismatches = 0
+    for fname in filenames:
+        img = Image.open(fname)
+        full = foreground_bbox(img, fname)
+        thumb = thumbnail_bbox(fname, img.size, thumbnail_size)
+        if (full is None) != (thumb is None):
+            mismatches += 1
+        ious.append(bbox_iou(full or square_bbox(img, fname), thumb or square_bbox(img, fname)))
+
+    speeds = {}
+    for name, fun in (('convert', convert), ('convert_thumbnail', convert_thumbnail)):
+        tic = time.time()
+        for fname in filenames:
+            fun(fname, target_size)
+        speeds[name] = len(filenames) / (time.time() - tic)
+    return {'mean_iou': float(np.mean(ious)), 'min_iou': float(np.min(ious)), 'mismatches': mismatches,
+            'images_per_sec': speeds}
 
 
 def full_bbox(img, fname):
@@ -98,13 +202,216 @@ def get_convert_fname(fname, extension, directory, convert_directory):
 
 
 def process(args):
+    """Converts one file, returns (fname, convert_fname, error), error is None on success"""
     fun, arg = args
     directory, convert_directory, fname, crop_size, extension = arg
     convert_fname = get_convert_fname(fname, extension, directory,
                                       convert_directory)
-    if not os.path.exists(convert_fname):
-        img = fun(fname, crop_size)
-        save(img, convert_fname)
+    try:
+        if not os.path.exists(convert_fname):
+            convert_dir = os.path.dirname(convert_fname)
+            if convert_dir and not os.path.exists(convert_dir):
+                try:
+                    os.makedirs(convert_dir)
+                except OSError:
+                    pass
+            img = fun(fname, crop_size)
+            save(img, convert_fname)
+    except Exception:
+        return fname, convert_fname, traceback.format_exc().strip().split('\n')[-1]
+    return fname, convert_fname, None
+
+
+class ConvertManifest(object):
+    """Append only record of the converted files, used to skip them on the next runs
+
+    Every line is a json object with the source file name, its mtime and size and the
+    converted file name; the last line of a source file wins.
+
+    Args:
+        fname: manifest file name
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.entries = {}
+        if os.path.exists(fname):
+            with open(fname) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut by an interrupted run
+                        continue
+                    self.entries[entry['source']] = entry
+        self._f = open(fname, 'a')
+
+    def is_current(self, source, stat):
+        entry = self.entries.get(source)
+        return entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size \
+            and os.path.exists(entry['output'])
+
+    def add(self, source, stat, output):
+        entry = {'source': source, 'mtime': stat.st_mtime, 'size': stat.st_size, 'output': output}
+        self.entries[source] = entry
+        self._f.write(json.dumps(entry) + '\n')
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def _bounded(tasks, semaphore):
+    for task in tasks:
+        semaphore.acquire()
+        yield task
+
+
+def convert_files(tasks, manifest, num_workers=N_PROC, chunksize=8, max_in_flight=None, report_every=10.0):
+    """Converts files with a process pool, streaming the results as they complete
+
+    The tasks are dispatched in chunks to the workers in completion order, at most
+    `max_in_flight` of them are queued or running at a time. A file which fails to
+    convert does not stop the others, the failures are returned.
+
+    Args:
+        tasks: list of `process` args, (convert function, (directory, convert_directory, fname,
+            crop_size, extension))
+        manifest: a `ConvertManifest`, the converted files are added to it
+        num_workers: number of worker processes
+        chunksize: number of tasks sent to a worker at once
+        max_in_flight: max number of dispatched and not finished tasks, defaults to 4 chunks per worker
+        report_every: seconds between progress reports
+
+    Returns:
+        a list of (fname, error) of the failed files
+    """
+    max_in_flight = max(max_in_flight or 4 * chunksize * num_workers, 2 * chunksize * num_workers)
+    semaphore = threading.BoundedSemaphore(max_in_flight)
+    stats = dict((task[1][2], os.stat(task[1][2])) for task in tasks)
+    failures = []
+    n = len(tasks)
+    pool = Pool(num_workers)
+    tic = last_report = time.time()
+    try:
+        for done, (fname, convert_fname, error) in enumerate(
+                pool.imap_unordered(process, _bounded(tasks, semaphore), chunksize), start=1):
+            semaphore.release()
+            if error is None:
+                manifest.add(fname, stats[fname], convert_fname)
+            else:
+                failures.append((fname, error))
+            now = time.time()
+            if now - last_report >= report_every or done == n:
+                last_report = now
+                speed = done / (now - tic)
+                print("{}/{} images, {:.1f} images/sec, {} failed, eta {:.0f}s".format(
+                    done, n, speed, len(failures), (n - done) / speed))
+    finally:
+        pool.close()
+        pool.join()
+    return failures
+
+
+def process_shard(args):
+    """Converts the files of one shard and writes them as a `array` or `tfrecord` shard
+
+    A `array` shard is a npy file of uint8 images of shape [num_examples, crop_size, crop_size, 3],
+    a `tfrecord` shard holds `TFRecords.convert_to_example` examples with the image encoded as
+    `image_format`. Both get an index sidecar, see `tefla.dataset.shard_index`.
+
+    Returns:
+        a tuple, (shard file, number of files, list of (fname, error) of the failed files)
+    """
+    fun, shard_format, shard_file, fnames, labels, crop_size, image_format = args
+    names = []
+    shard_labels = []
+    failures = []
+    if shard_format == 'array':
+        array = np.lib.format.open_memmap(shard_file, mode='w+', dtype=np.uint8,
+                                          shape=(len(fnames), crop_size, crop_size, 3))
+    else:
+        from tefla.dataset.image_to_tfrecords import TFRecords
+        encoder = TFRecords()
+        writer = shard_index.IndexedTFRecordWriter(shard_file)
+    for fname, label in zip(fnames, labels):
+        try:
+            img = fun(fname, crop_size).convert('RGB')
+            if shard_format == 'array':
+                array[len(names)] = np.asarray(img, dtype=np.uint8)
+            else:
+                buf = io.BytesIO()
+                img.save(buf, format='PNG' if image_format == 'png' else 'JPEG', quality=97)
+                example = encoder.convert_to_example(fname, buf.getvalue(), -1 if label is None else label,
+                                                     '' if label is None else str(label), crop_size, crop_size,
+                                                     image_format=image_format)
+                writer.write(example.SerializeToString(), name=data.get_names([fname])[0], label=label)
+            names.append(data.get_names([fname])[0])
+            shard_labels.append(label)
+        except Exception:
+            failures.append((fname, traceback.format_exc().strip().split('\n')[-1]))
+
+    if shard_format == 'array':
+        del array
+        if failures:
+            # drop the rows of the failed files
+            np.save(shard_file, np.load(shard_file)[:len(names)])
+        shard_index.write_index(shard_file, shard_format, names, shard_labels, shape=(crop_size, crop_size, 3))
+    else:
+        writer.close()
+    return shard_file, len(fnames), failures
+
+
+def convert_to_shards(fun, filenames, labels, convert_directory, name, shard_format, shard_size, crop_size,
+                      image_format='jpg', num_workers=N_PROC, report_every=10.0):
+    """Converts files straight into shards, every shard is written by one worker process
+
+    Args:
+        fun: convert function, `convert` or `convert_thumbnail`
+        filenames: list of image files, in shard order
+        labels: list of labels, None for unknown labels
+        convert_directory: output directory
+        name: shard name prefix, e.g. `train`
+        shard_format: `array` or `tfrecord`
+        shard_size: number of images per shard
+        crop_size: size of the converted images
+        image_format: encoding of the images in the tfrecord shards, `jpg` or `png`
+        num_workers: number of worker processes
+        report_every: seconds between progress reports
+
+    Returns:
+        a list of (fname, error) of the failed files
+    """
+    if labels is None:
+        labels = [None] * len(filenames)
+    num_shards = max(int(np.ceil(len(filenames) / shard_size)), 1)
+    spacing = np.linspace(0, len(filenames), num_shards + 1).astype(int)
+    extension = '.npy' if shard_format == 'array' else ''
+    tasks = []
+    for shard in range(num_shards):
+        sl = slice(spacing[shard], spacing[shard + 1])
+        shard_file = os.path.join(convert_directory, shard_index.shard_filename(name, shard, num_shards, extension))
+        tasks.append((fun, shard_format, shard_file, filenames[sl], labels[sl], crop_size, image_format))
+
+    failures = []
+    n = len(filenames)
+    done = 0
+    pool = Pool(num_workers)
+    tic = last_report = time.time()
+    try:
+        for shard_file, num_files, shard_failures in pool.imap_unordered(process_shard, tasks):
+            done += num_files
+            failures.extend(shard_failures)
+            now = time.time()
+            if now - last_report >= report_every or done == n:
+                last_report = now
+                speed = done / (now - tic)
+                print("{}/{} images, {:.1f} images/sec, {} failed, eta {:.0f}s, wrote {}".format(
+                    done, n, speed, len(failures), (n - done) / speed, shard_file))
+    finally:
+        pool.close()
+        pool.join()
+    return failures
 
 
 def save(img, fname):
@@ -122,7 +429,26 @@ def save(img, fname):
               help="Size of converted images.")
 @click.option('--extension', default='tiff', show_default=True,
               help="Filetype of converted images.")
-def main(directory, convert_directory, test, crop_size, extension):
+@click.option('--bbox_method', default='full', show_default=True, type=click.Choice(['full', 'thumbnail']),
+              help="Detect the crop bbox on the full image or on a thumbnail.")
+@click.option('--check_bbox', default=0, show_default=True,
+              help="Compare the thumbnail and full bbox detection on this many images and exit.")
+@click.option('--num_workers', default=N_PROC, show_default=True,
+              help="Number of conversion processes.")
+@click.option('--chunksize', default=8, show_default=True,
+              help="Number of files sent to a conversion process at once.")
+@click.option('--max_in_flight', default=None, type=int,
+              help="Max number of dispatched, not finished files; 4 chunks per process if not given.")
+@click.option('--shard_format', default='none', show_default=True, type=click.Choice(['none', 'array', 'tfrecord']),
+              help="Write the converted images into array or tfrecord shards instead of one file per image.")
+@click.option('--shard_size', default=1000, show_default=True,
+              help="Number of images per shard.")
+@click.option('--shard_name', default='train', show_default=True,
+              help="Shard file name prefix.")
+@click.option('--labels_file', default=None, show_default=True,
+              help="Csv file with image,level rows, stores the labels in the shards.")
+def main(directory, convert_directory, test, crop_size, extension, bbox_method, check_bbox, num_workers,
+         chunksize, max_in_flight, shard_format, shard_size, shard_name, labels_file):
     try:
         os.mkdir(convert_directory)
     except OSError:
@@ -133,6 +459,16 @@ def main(directory, convert_directory, test, crop_size, extension):
     filenames = [os.path.join(dp, f) for dp, dn, fn in os.walk(directory)
                  for f in fn if f.split('.')[-1].lower() in supported_extensions]
     filenames = sorted(filenames)
+    convert_fn = convert_thumbnail if bbox_method == 'thumbnail' else convert
+
+    if check_bbox:
+        sample = [filenames[i] for i in np.random.permutation(len(filenames))[:check_bbox]]
+        result = check_thumbnail_bbox(sample, crop_size)
+        print("bbox iou mean: {:.4f}, min: {:.4f}, found/not found mismatches: {}".format(
+            result['mean_iou'], result['min_iou'], result['mismatches']))
+        print("images/sec convert: {:.2f}, convert_thumbnail: {:.2f}".format(
+            result['images_per_sec']['convert'], result['images_per_sec']['convert_thumbnail']))
+        return
 
     if test:
         names = data.get_names(filenames)
@@ -140,7 +476,7 @@ def main(directory, convert_directory, test, crop_size, extension):
         for f, level in zip(filenames, y):
             if level == 1:
                 try:
-                    img = convert(f, crop_size)
+                    img = convert_fn(f, crop_size)
                     img.show()
                     Image.open(f).show()
                     real_raw_input = vars(__builtins__).get('raw_input', input)
@@ -151,23 +487,43 @@ def main(directory, convert_directory, test, crop_size, extension):
     print("Resizing images in {} to {}, this takes a while."
           "".format(directory, convert_directory))
 
-    n = len(filenames)
-    # process in batches, sometimes weird things happen with Pool on my machine
-    batchsize = 500
-    batches = n // batchsize + 1
-    pool = Pool(N_PROC)
-
-    args = []
-
-    for f in filenames:
-        args.append((convert, (directory, convert_directory, f, crop_size,
-                               extension)))
-
-    for i in range(batches):
-        print("batch {:>2} / {}".format(i + 1, batches))
-        pool.map(process, args[i * batchsize: (i + 1) * batchsize])
-
-    pool.close()
+    if shard_format != 'none':
+        # shuffle so that the shards mix the classes, repeatable
+        filenames = [filenames[i] for i in np.random.RandomState(12345).permutation(len(filenames))]
+        labels = None
+        if labels_file:
+            labels = list(data.get_labels(data.get_names(filenames), label_file=labels_file))
+        image_format = 'png' if extension == 'png' else 'jpg'
+        failures = convert_to_shards(convert_fn, filenames, labels, convert_directory, shard_name, shard_format,
+                                     shard_size, crop_size, image_format, num_workers)
+    else:
+        manifest = ConvertManifest(os.path.join(convert_directory, MANIFEST_NAME))
+        args = []
+        skipped = 0
+        for f in filenames:
+            if manifest.is_current(f, os.stat(f)):
+                skipped += 1
+                continue
+            if f in manifest.entries and os.path.exists(manifest.entries[f]['output']):
+                # the source changed since it was converted
+                os.remove(manifest.entries[f]['output'])
+            args.append((convert_fn, (directory, convert_directory, f, crop_size,
+                                      extension)))
+        print("{} files up to date, converting {}".format(skipped, len(args)))
+
+        try:
+            failures = convert_files(args, manifest, num_workers, chunksize, max_in_flight)
+        finally:
+            manifest.close()
+
+    failures_fname = os.path.join(convert_directory, FAILURES_NAME)
+    if os.path.exists(failures_fname):
+        os.remove(failures_fname)
+    if failures:
+        with open(failures_fname, 'w') as f:
+            for fname, error in failures:
+                f.write("{}\t{}\n".format(fname, error))
+        print("{} files failed, see {}".format(len(failures), failures_fname))
 
     print('done')
 
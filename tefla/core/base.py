@@ -12,6 +12,7 @@ import numpy as np
 from tefla.da.iterator import BatchIterator
 from tefla.core.lr_policy import NoDecayPolicy
 import tefla.core.summary as summary
+from tefla.core.summary_scheduler import SummaryScheduler
 import tefla.core.logger as log
 
 
@@ -42,6 +43,7 @@ class Base(object):
         self.is_summary = is_summary
         self.loss_type = loss_type
         self.weights_dir = weights_dir
+        self.summary_scheduler = SummaryScheduler.from_cnf(cnf)
         log.setFileHandler(log_file_name)
         log.setVerbosity(str(verbosity))
 
@@ -63,19 +65,20 @@ class Base(object):
             if len(self.inputs.get_shape()) == 4:
                 summary.summary_image(self.inputs, 'inputs', max_images=10, collections=[
                                       TRAINING_BATCH_SUMMARIES])
-            for key, val in self.training_end_points.iteritems():
+            sample_layers = self.summary_scheduler.sample_layers
+            for key, val in sample_layers(self.training_end_points.items()):
                 summary.summary_activation(val, name=key, collections=[
                                            TRAINING_BATCH_SUMMARIES])
             summary.summary_trainable_params(['scalar', 'histogram', 'norm'], collections=[
-                                             TRAINING_BATCH_SUMMARIES])
-            summary.summary_gradients(d_grads_and_var, [
+                                             TRAINING_BATCH_SUMMARIES], params=sample_layers(tf.trainable_variables()))
+            summary.summary_gradients(sample_layers(d_grads_and_var), [
                                       'scalar', 'histogram', 'norm'], collections=[TRAINING_BATCH_SUMMARIES])
             if g_grads_and_var is not None:
-                summary.summary_gradients(g_grads_and_var, [
+                summary.summary_gradients(sample_layers(g_grads_and_var), [
                                           'scalar', 'histogram', 'norm'], collections=[TRAINING_BATCH_SUMMARIES])
 
             # Validation summaries
-            for key, val in self.validation_end_points.iteritems():
+            for key, val in sample_layers(self.validation_end_points.items()):
                 summary.summary_activation(val, name=key, collections=[
                                            VALIDATION_BATCH_SUMMARIES])
 
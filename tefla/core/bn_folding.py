@@ -0,0 +1,234 @@
+"""Folds the inference batch normalization of tefla layers into the layer weights.
+
+At inference `batch_norm_tf` and `batch_norm_lasagne` are affine per channel
+transforms of the `conv2d` / `fully_connected` output, built from constants
+once the graph is frozen:
+
+    y = conv(x, W) + b
+    y = y * inv + (beta - mean * inv)
+
+so they can be folded into the weights and biases of the layer:
+
+    y = conv(x, W * inv) + (b * inv + beta - mean * inv)
+
+The rewrite works on a frozen `GraphDef`. It follows the chain of constant
+per-channel Mul/Add/Sub/BiasAdd/FusedBatchNorm ops after every Conv2D,
+DepthwiseConv2dNative and MatMul op, and replaces the last op of the chain by a
+BiasAdd op of the same name. The layer names therefore do not change, e.g.
+`model/predictions/Softmax:0` still resolves in `prediction_v3`.
+"""
+from __future__ import division, print_function, absolute_import
+
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import attr_value_pb2
+from tensorflow.core.framework import graph_pb2
+from tensorflow.core.framework import node_def_pb2
+from tensorflow.python.framework import graph_util
+from tensorflow.python.framework import tensor_util
+
+_LINEAR_OPS = ('Conv2D', 'DepthwiseConv2dNative', 'MatMul')
+_AFFINE_OPS = ('Mul', 'Add', 'Sub', 'BiasAdd', 'FusedBatchNorm')
+_NON_CONSTANT_OPS = ('Placeholder', 'Variable', 'VariableV2', 'RandomUniform', 'RandomStandardNormal')
+
+
+def _node_name(input_name):
+    return input_name.lstrip('^').split(':')[0]
+
+
+class _GraphInfo(object):
+
+    def __init__(self, graph_def):
+        self.graph_def = graph_def
+        self.nodes = dict((n.name, n) for n in graph_def.node)
+        self.consumers = dict((n.name, []) for n in graph_def.node)
+        for n in graph_def.node:
+            for i in n.input:
+                self.consumers[_node_name(i)].append(n.name)
+        self._constant = {}
+        self._graph = None
+        self._sess = None
+
+    def is_constant(self, name):
+        if name not in self._constant:
+            node = self.nodes[name]
+            if node.op == 'Const':
+                self._constant[name] = True
+            elif node.op in _NON_CONSTANT_OPS or not node.input:
+                self._constant[name] = False
+            else:
+                self._constant[name] = all(self.is_constant(_node_name(i)) for i in node.input)
+        return self._constant[name]
+
+    def value(self, input_name):
+        name = _node_name(input_name)
+        node = self.nodes[name]
+        if node.op == 'Const':
+            return tensor_util.MakeNdarray(node.attr['value'].tensor)
+        if self._sess is None:
+            self._graph = tf.Graph()
+            with self._graph.as_default():
+                tf.import_graph_def(self.graph_def, name='')
+            self._sess = tf.Session(graph=self._graph)
+        tensor_name = input_name if ':' in input_name else input_name + ':0'
+        return self._sess.run(self._graph.get_tensor_by_name(tensor_name))
+
+    def close(self):
+        if self._sess is not None:
+            self._sess.close()
+
+
+def _per_channel(value, num_channels):
+    value = np.asarray(value, dtype=np.float32)
+    if value.size == 1:
+        return np.full(num_channels, value.reshape(()), dtype=np.float32)
+    if value.size == num_channels and value.shape[-1] == num_channels:
+        return value.reshape(num_channels)
+    return None
+
+
+def _affine_step(info, node, data_input, num_channels):
+    """Returns the (scale, shift) of an affine per channel op, None if it is not one"""
+    if node.op == 'FusedBatchNorm':
+        if _node_name(node.input[0]) != data_input or node.attr['is_training'].b:
+            return None
+        if not all(info.is_constant(_node_name(i)) for i in node.input[1:5]):
+            return None
+        gamma, beta, mean, variance = [_per_channel(info.value(i), num_channels) for i in node.input[1:5]]
+        scale = gamma / np.sqrt(variance + node.attr['epsilon'].f)
+        return scale, beta - mean * scale
+    data_inputs = [i for i in node.input if _node_name(i) == data_input]
+    others = [i for i in node.input if _node_name(i) != data_input]
+    if len(node.input) != 2 or len(data_inputs) != 1 or not info.is_constant(_node_name(others[0])):
+        return None
+    if node.op in ('Sub', 'BiasAdd') and _node_name(node.input[0]) != data_input:
+        return None
+    k = _per_channel(info.value(others[0]), num_channels)
+    if k is None:
+        return None
+    if node.op == 'Mul':
+        return k, np.zeros(num_channels, dtype=np.float32)
+    if node.op == 'Sub':
+        return np.ones(num_channels, dtype=np.float32), -k
+    return np.ones(num_channels, dtype=np.float32), k
+
+
+def _const_node(name, value):
+    node = node_def_pb2.NodeDef()
+    node.op = 'Const'
+    node.name = name
+    node.attr['dtype'].CopyFrom(attr_value_pb2.AttrValue(type=tf.float32.as_datatype_enum))
+    node.attr['value'].CopyFrom(attr_value_pb2.AttrValue(
+        tensor=tensor_util.make_tensor_proto(value.astype(np.float32), dtype=tf.float32, shape=value.shape)))
+    return node
+
+
+def _scale_weights(op, weights, scale):
+    if op == 'DepthwiseConv2dNative':
+        return weights * scale.reshape(weights.shape[2], weights.shape[3])
+    return weights * scale
+
+
+def fold_batch_norms(graph_def, output_names):
+    """Folds the constant per channel affine ops (inference batch norms) into the preceding layers
+
+    Args:
+        graph_def: a frozen `GraphDef`
+        output_names: list of output node names, they are kept and used to strip the unused nodes
+
+    Returns:
+        a tuple, (folded `GraphDef`, list of (layer op name, folded op name))
+    """
+    info = _GraphInfo(graph_def)
+    protected = set(output_names)
+    replaced = {}
+    new_nodes = []
+    folded = []
+    try:
+        for node in graph_def.node:
+            if node.op not in _LINEAR_OPS or node.name in protected:
+                continue
+            if node.op == 'MatMul' and node.attr['transpose_b'].b:
+                continue
+            weights_name = _node_name(node.input[1])
+            if not info.is_constant(weights_name):
+                continue
+            weights = info.value(node.input[1])
+            if node.op == 'DepthwiseConv2dNative':
+                num_channels = weights.shape[2] * weights.shape[3]
+            else:
+                num_channels = weights.shape[-1]
+            scale = np.ones(num_channels, dtype=np.float32)
+            shift = np.zeros(num_channels, dtype=np.float32)
+            has_scale = False
+            chain = []
+            current = node.name
+            while current not in protected and len(info.consumers[current]) == 1:
+                consumer = info.nodes[info.consumers[current][0]]
+                if consumer.op not in _AFFINE_OPS:
+                    break
+                step = _affine_step(info, consumer, current, num_channels)
+                if step is None:
+                    break
+                scale, shift = scale * step[0], shift * step[0] + step[1]
+                has_scale = has_scale or consumer.op in ('Mul', 'FusedBatchNorm')
+                chain.append(consumer.name)
+                current = consumer.name
+            if not has_scale:
+                continue
+
+            weights_node = _const_node(node.name + '/bn_folded_W', _scale_weights(node.op, weights, scale))
+            bias_node = _const_node(node.name + '/bn_folded_b', shift)
+            layer_node = node_def_pb2.NodeDef()
+            layer_node.CopyFrom(node)
+            layer_node.input[1] = weights_node.name
+            bias_add = node_def_pb2.NodeDef()
+            bias_add.op = 'BiasAdd'
+            bias_add.name = chain[-1]
+            bias_add.input.extend([node.name, bias_node.name])
+            bias_add.attr['T'].CopyFrom(attr_value_pb2.AttrValue(type=tf.float32.as_datatype_enum))
+            replaced[node.name] = layer_node
+            replaced[chain[-1]] = bias_add
+            new_nodes.extend([weights_node, bias_node])
+            folded.append((node.name, chain[-1]))
+    finally:
+        info.close()
+
+    output_graph_def = graph_pb2.GraphDef()
+    output_graph_def.node.extend(new_nodes)
+    for node in graph_def.node:
+        output_graph_def.node.extend([replaced.get(node.name, node)])
+    output_graph_def = graph_util.extract_sub_graph(output_graph_def, list(output_names))
+    return output_graph_def, folded
+
+
+def compare_graphs(graph_def, other_graph_def, input_name, output_name, batch, num_runs=20):
+    """Runs two graphs on the same batch, returns the max abs output difference and latencies
+
+    Args:
+        graph_def: a `GraphDef`
+        other_graph_def: a `GraphDef` with the same input and output names
+        input_name: input tensor name, e.g. `inputs/input:0`
+        output_name: output tensor name, e.g. `predictions/Softmax:0`
+        batch: a numpy array, input batch
+        num_runs: number of timed runs
+
+    Returns:
+        a tuple, (max abs difference, seconds per run of `graph_def`, seconds per run of `other_graph_def`)
+    """
+    outputs = []
+    latencies = []
+    for gd in (graph_def, other_graph_def):
+        with tf.Graph().as_default() as graph:
+            tf.import_graph_def(gd, name='')
+            with tf.Session(graph=graph) as sess:
+                inputs = graph.get_tensor_by_name(input_name)
+                predictions = graph.get_tensor_by_name(output_name)
+                outputs.append(sess.run(predictions, feed_dict={inputs: batch}))
+                tic = time.time()
+                for _ in range(num_runs):
+                    sess.run(predictions, feed_dict={inputs: batch})
+                latencies.append((time.time() - tic) / num_runs)
+    return float(np.abs(outputs[0] - outputs[1]).max()), latencies[0], latencies[1]
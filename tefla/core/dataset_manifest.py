@@ -0,0 +1,117 @@
+"""Cached listing of an image directory with its labels.
+
+Globbing a directory of millions of files and looking their labels up in the labels csv takes
+minutes on a network file system. The manifest caches the file names, labels and sizes in a
+npz file next to the directory, `<parent>/.<directory>.manifest.npz`. It is reused as long as
+the directory and the labels file mtimes are unchanged, which costs two stats. Otherwise it is
+updated incrementally: only the added files are stat'ed and looked up in the labels file,
+unless the labels file itself changed.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import os
+import time
+
+import numpy as np
+
+from tefla.core import data_load_ops as data
+
+logger = logging.getLogger('tefla')
+
+MANIFEST_VERSION = 1
+
+
+def manifest_filename(images_dir):
+    images_dir = os.path.normpath(images_dir)
+    return os.path.join(os.path.dirname(images_dir), '.%s.manifest.npz' % os.path.basename(images_dir))
+
+
+def _mtime(fname):
+    return os.stat(fname).st_mtime if fname is not None and os.path.exists(fname) else -1.0
+
+
+def _load(fname):
+    try:
+        with np.load(fname) as manifest:
+            manifest = dict((k, manifest[k]) for k in manifest.files)
+        if int(manifest['version']) != MANIFEST_VERSION:
+            return None
+        return manifest
+    except Exception:
+        return None
+
+
+def _save(fname, manifest):
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'wb') as f:
+        np.savez(f, **manifest)
+    os.rename(tmp_fname, fname)
+
+
+def _is_current(manifest, dir_mtime, labels_mtime):
+    # a directory modified in the second the manifest was built may have changed after the listing
+    return (manifest is not None and float(manifest['dir_mtime']) == dir_mtime and
+            float(manifest['labels_mtime']) == labels_mtime and dir_mtime < float(manifest['build_time']) - 1)
+
+
+def load_manifest(images_dir, labels_file=None, use_cache=True):
+    """Returns the image files of a directory and their labels, using the cached manifest
+
+    Args:
+        images_dir: images directory
+        labels_file: labels csv file, indexed by image name, None for unlabeled images
+        use_cache: if False, the manifest is rebuilt from scratch
+
+    Returns:
+        a dict with the sorted image file paths `files`, their `sizes` and, with a labels file,
+        their `labels`
+    """
+    fname = manifest_filename(images_dir)
+    dir_mtime = _mtime(images_dir)
+    labels_mtime = _mtime(labels_file)
+    manifest = _load(fname) if use_cache else None
+    if _is_current(manifest, dir_mtime, labels_mtime) and ('labels' in manifest) == (labels_file is not None):
+        logger.debug('Using manifest %s' % fname)
+        names = manifest['names']
+    else:
+        build_time = time.time()
+        names = np.array(sorted(n for n in os.listdir(images_dir) if not n.startswith('.')))
+        old_names = manifest['names'] if manifest is not None else np.array([], dtype=names.dtype)
+        old_positions = dict((n, i) for i, n in enumerate(old_names))
+        known = np.array([n in old_positions for n in names], dtype=bool)
+        old_index = np.array([old_positions[n] for n in names[known]], dtype=np.int64)
+        added = names[~known]
+        logger.info('Updating manifest %s: %d files, %d added' % (fname, len(names), len(added)))
+
+        sizes = np.zeros(len(names), dtype=np.int64)
+        sizes[known] = manifest['sizes'][old_index] if manifest is not None else []
+        sizes[~known] = [os.path.getsize(os.path.join(images_dir, n)) for n in added]
+        new_manifest = {'version': np.int64(MANIFEST_VERSION), 'names': names, 'sizes': sizes,
+                        'dir_mtime': np.float64(dir_mtime), 'labels_mtime': np.float64(labels_mtime),
+                        'build_time': np.float64(build_time)}
+        if labels_file is not None:
+            image_names = np.array(data.get_names(names))
+            if manifest is not None and 'labels' in manifest and float(manifest['labels_mtime']) == labels_mtime:
+                labels = np.zeros(len(names), dtype=manifest['labels'].dtype)
+                labels[known] = manifest['labels'][old_index]
+                if len(added):
+                    labels[~known] = data.get_labels(list(image_names[~known]), label_file=labels_file)
+            else:
+                labels = np.asarray(data.get_labels(list(image_names), label_file=labels_file))
+            new_manifest['labels'] = labels
+        manifest = new_manifest
+        try:
+            _save(fname, manifest)
+        except (IOError, OSError) as e:
+            logger.warning('Could not save manifest %s: %s' % (fname, e))
+
+    result = {'files': np.array([os.path.join(images_dir, n) for n in names]), 'sizes': manifest['sizes']}
+    if labels_file is not None:
+        result['labels'] = manifest['labels']
+    return result
+
+
+def image_files(images_dir, use_cache=True):
+    """Same as `data_load_ops.get_image_files`, using the cached manifest"""
+    return load_manifest(images_dir, use_cache=use_cache)['files']
@@ -5,13 +5,24 @@ import logging
 
 import numpy as np
 
-from tefla.core import data_load_ops as data
+from tefla.core import dataset_manifest
 
 logger = logging.getLogger('tefla')
 
 
 class DataSet(object):
-    def __init__(self, data_dir, img_size):
+    """Training and validation images of `data_dir`
+
+    The file listings and labels are read from a cached manifest, see `tefla.core.dataset_manifest`.
+
+    Args:
+        data_dir: data directory, with the `training_<img_size>` and `validation_<img_size>`
+            image directories and the `training_labels.csv` and `validation_labels.csv` files
+        img_size: a int, image size
+        use_manifest: if False, the manifests are rebuilt from scratch
+    """
+
+    def __init__(self, data_dir, img_size, use_manifest=True):
         self.data_dir = data_dir
         training_images_dir = "%s/training_%d" % (data_dir, img_size)
         training_labels_file = "%s/training_labels.csv" % data_dir
@@ -19,13 +30,13 @@ class DataSet(object):
         validation_images_dir = "%s/validation_%d" % (data_dir, img_size)
         validation_labels_file = "%s/validation_labels.csv" % data_dir
 
-        self._training_files = data.get_image_files(training_images_dir)
-        names = data.get_names(self._training_files)
-        self._training_labels = data.get_labels(names, label_file=training_labels_file).astype(np.int32)
+        manifest = dataset_manifest.load_manifest(training_images_dir, training_labels_file, use_cache=use_manifest)
+        self._training_files = manifest['files']
+        self._training_labels = manifest['labels'].astype(np.int32)
 
-        self._validation_files = data.get_image_files(validation_images_dir)
-        names = data.get_names(self._validation_files)
-        self._validation_labels = data.get_labels(names, label_file=validation_labels_file).astype(np.int32)
+        manifest = dataset_manifest.load_manifest(validation_images_dir, validation_labels_file, use_cache=use_manifest)
+        self._validation_files = manifest['files']
+        self._validation_labels = manifest['labels'].astype(np.int32)
 
     @property
     def training_X(self):
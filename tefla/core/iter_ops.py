@@ -4,6 +4,7 @@ import functools
 import logging
 
 from tefla import convert
+from tefla.core import session_config
 from tefla.da import iterator
 
 logger = logging.getLogger('tefla')
@@ -21,7 +22,13 @@ def create_training_iters(cnf, data_set, standardizer, crop_size, epoch, paralle
         epoch: the current epoch number; used for data balancing
         parallel: iterator type; either parallel or queued
     """
-    if parallel:
+    pool_args = session_config.da_pool_args(cnf)
+    if cnf.get('importance_sampling'):
+        training_iterator_maker = iterator.ImportanceSamplingDAIterator
+        validation_iterator_maker = iterator.ParallelDAIterator
+        parallel = True
+        logger.info('Using loss importance sampling iterators')
+    elif parallel:
         training_iterator_maker = iterator.BalancingDAIterator
         validation_iterator_maker = iterator.ParallelDAIterator
         logger.info('Using parallel iterators')
@@ -32,6 +39,18 @@ def create_training_iters(cnf, data_set, standardizer, crop_size, epoch, paralle
         logger.info('Using queued iterators')
 
     preprocessor = None
+    if cnf.get('importance_sampling'):
+        sampling_args = dict(
+            sampling_power=cnf.get('sampling_power', 1.0),
+            sampling_floor=cnf.get('sampling_floor', 0.2),
+            loss_momentum=cnf.get('loss_momentum', 0.0),
+            epoch_fraction=cnf.get('epoch_fraction', 1.0))
+    else:
+        sampling_args = dict(
+            balance_weights=data_set.balance_weights(),
+            final_balance_weights=cnf['final_balance_weights'],
+            balance_ratio=cnf['balance_ratio'],
+            balance_epoch_count=epoch - 1)
     training_iterator = training_iterator_maker(
         batch_size=cnf['batch_size_train'],
         shuffle=True,
@@ -39,13 +58,10 @@ def create_training_iters(cnf, data_set, standardizer, crop_size, epoch, paralle
         crop_size=crop_size,
         is_training=True,
         aug_params=cnf['aug_params'],
-        balance_weights=data_set.balance_weights(),
-        final_balance_weights=cnf['final_balance_weights'],
-        balance_ratio=cnf['balance_ratio'],
-        balance_epoch_count=epoch - 1,
         standardizer=standardizer,
-        fill_mode='constant'
+        fill_mode='constant',
         # save_to_dir=da_training_preview_dir
+        **dict(sampling_args, **(pool_args if parallel else {}))
     )
 
     validation_iterator = validation_iterator_maker(
@@ -55,7 +71,8 @@ def create_training_iters(cnf, data_set, standardizer, crop_size, epoch, paralle
         crop_size=crop_size,
         is_training=False,
         standardizer=standardizer,
-        fill_mode='constant'
+        fill_mode='constant',
+        **pool_args
     )
 
     return training_iterator, validation_iterator
@@ -78,8 +95,10 @@ def create_prediction_iter(cnf, standardizer, crop_size, preprocessor=None, sync
     """
     if sync:
         prediction_iterator_maker = iterator.DAIterator
+        pool_args = {}
     else:
         prediction_iterator_maker = iterator.ParallelDAIterator
+        pool_args = session_config.da_pool_args(cnf)
 
     prediction_iterator = prediction_iterator_maker(
         batch_size=cnf['batch_size_test'],
@@ -88,7 +107,8 @@ def create_prediction_iter(cnf, standardizer, crop_size, preprocessor=None, sync
         crop_size=crop_size,
         is_training=False,
         standardizer=standardizer,
-        fill_mode='constant'
+        fill_mode='constant',
+        **pool_args
     )
 
     return prediction_iterator
@@ -1,5 +1,6 @@
 from __future__ import division, print_function, absolute_import
 
+import contextlib
 from collections import namedtuple
 
 import numpy as np
@@ -13,6 +14,9 @@ from tensorflow.python.training import moving_averages
 rng = np.random.RandomState([2016, 6, 1])
 NamedOutputs = namedtuple('NamedOutputs', ['name', 'outputs'])
 
+_input_defaults = []
+_variable_spatial_input = []
+
 
 def input(shape, name='inputs', outputs_collections=None, **unused):
     """
@@ -25,14 +29,49 @@ def input(shape, name='inputs', outputs_collections=None, **unused):
         outputs_collections: The collections to which the outputs are added.
 
     Returns:
-        A placeholder for the input
+        A placeholder for the input, defaulting to the tensor of the enclosing `input_default`
     """
     _check_unused(unused, name)
+    if _variable_spatial_input and len(shape) == 4:
+        shape = (shape[0], None, None, shape[3])
     with tf.name_scope(name):
-        inputs = tf.placeholder(tf.float32, shape=shape, name="input")
+        if _input_defaults:
+            inputs = tf.placeholder_with_default(_input_defaults[-1], shape=shape, name="input")
+        else:
+            inputs = tf.placeholder(tf.float32, shape=shape, name="input")
     return _collect_named_outputs(outputs_collections, name, inputs)
 
 
+@contextlib.contextmanager
+def input_default(tensor):
+    """Makes the `input` layers built in the context read `tensor` when they are not fed
+
+    e.g. the dequeued batch of a `tefla.core.prefetch.PrefetchQueue`, feeding the input
+    placeholder still works and bypasses `tensor`.
+
+    Args:
+        tensor: a float32 `Tensor`, default value of the inputs
+    """
+    _input_defaults.append(tensor)
+    try:
+        yield
+    finally:
+        _input_defaults.pop()
+
+
+@contextlib.contextmanager
+def variable_spatial_input():
+    """Makes the 4-D `input` layers built in the context accept any height and width
+
+    e.g. to train a fully convolutional model, ending in `global_avg_pool`, at several crop sizes.
+    """
+    _variable_spatial_input.append(True)
+    try:
+        yield
+    finally:
+        _variable_spatial_input.pop()
+
+
 def fully_connected(x, n_output, is_training, reuse, trainable=True, w_init=initz.he_normal(), b_init=0.0,
                     w_regularizer=tf.nn.l2_loss, w_normalized=False, name='fc', batch_norm=None, batch_norm_args=None, activation=None,
                     params=None, outputs_collections=None, use_bias=True):
@@ -9,7 +9,12 @@ import numpy as np
 import tensorflow as tf
 
 from tefla.core.base import Base
+from tefla.core.session_config import create_session_config
 import tefla.core.summary as summary
+from tefla.core.step_profiler import StepProfiler
+from tefla.core.resolution_schedule import ResolutionSchedule
+from tefla.core import recompute
+from tefla.core import towers
 import tefla.core.logger as log
 from tefla.utils import util
 
@@ -39,10 +44,31 @@ class SupervisedTrainer(Base):
             e.g: total_training_samples/batch_size
         gpu_memory_fraction: amount of gpu memory to use
         is_summary: bool, to write summary or not
+
+    The global steps in `cnf['profile_steps']` are traced into `cnf['profile_dir']`, see
+    `StepProfiler`.
+
+    The batches are split in `cnf['num_towers']` towers (`num_gpus` for the older configs),
+    placed on the gpus or, with `cnf['tower_device'] = 'cpu'`, on as many logical cpu devices,
+    see `tefla.core.towers`.
+
+    With a training iterator that samples by loss, e.g. `ImportanceSamplingDAIterator`, the per
+    sample training losses are reported back to it after each batch and the sample losses are
+    weighted by its importance weights.
+
+    With a `cnf['resolution_schedule']` the training epochs run at the crop sizes of a
+    `ResolutionSchedule`, the training inputs accept any height and width.
+
+    With a `cnf['recompute_checkpoints']` policy, e.g. `sqrt`, only the activations of the
+    checkpoints it selects are kept for the backprop, the other ones are recomputed, see
+    `tefla.core.recompute`; with `clip_by_global_norm` the recomputed gradients are clipped.
     """
 
     def __init__(self, model, cnf, clip_by_global_norm=False, **kwargs):
         self.clip_by_global_norm = clip_by_global_norm
+        self.num_towers = cnf.get('num_towers', cnf.get('num_gpus', 1))
+        self.tower_device = cnf.get('tower_device', 'gpu')
+        self.resolution_schedule = ResolutionSchedule.from_cnf(cnf)
         super(SupervisedTrainer, self).__init__(
             model, cnf, **kwargs)
 
@@ -119,9 +145,17 @@ class SupervisedTrainer(Base):
             validation_epoch_summary_op = tf.merge_all_summaries(
                 key=VALIDATION_EPOCH_SUMMARIES)
 
-        gpu_options = tf.GPUOptions(
-            per_process_gpu_memory_fraction=self.gpu_memory_fraction)
-        with tf.Session(config=tf.ConfigProto(gpu_options=gpu_options)) as sess:
+        tower_settings = towers.tower_session_settings(self.num_towers, self.tower_device,
+                                                       self.cnf.get('threads_per_tower'))
+        # the thread pools set in the cnf are kept
+        for key in ('intra_op_threads', 'inter_op_threads'):
+            if key in self.cnf:
+                tower_settings.pop(key, None)
+        if tower_settings:
+            log.info('Tower session settings: %s' % tower_settings)
+        sess_config = create_session_config(
+            self.cnf, self.gpu_memory_fraction, allow_soft_placement=True, **tower_settings)
+        with tf.Session(config=sess_config) as sess:
             if start_epoch > 1:
                 weights_from = "weights/model-epoch-%d.ckpt" % (start_epoch - 1)
 
@@ -131,6 +165,7 @@ class SupervisedTrainer(Base):
 
             learning_rate_value = self.lr_policy.initial_lr
             log.info("Initial learning rate: %f " % learning_rate_value)
+            profiler = StepProfiler.from_cnf(self.cnf, end_points=self.training_end_points, name='training')
             if self.is_summary:
                 train_writer, validation_writer = summary.create_summary_writer(
                     self.cnf.get('summary_dir', '/tmp/tefla-summary'), sess)
@@ -138,8 +173,11 @@ class SupervisedTrainer(Base):
             seed_delta = 100
             training_history = []
             batch_iter_idx = 1
-            n_iters_per_epoch = len(
-                data_set.training_X) // self.training_iterator.batch_size
+            importance_sampling = hasattr(self.training_iterator, 'update_losses')
+            n_training_samples = len(data_set.training_X)
+            if importance_sampling:
+                n_training_samples = self.training_iterator.epoch_size(n_training_samples)
+            n_iters_per_epoch = n_training_samples // self.training_iterator.batch_size
             self.lr_policy.n_iters_per_epoch = n_iters_per_epoch
             for epoch in xrange(start_epoch, self.num_epochs + 1):
                 np.random.seed(epoch + seed_delta)
@@ -147,20 +185,35 @@ class SupervisedTrainer(Base):
                 tic = time.time()
                 training_losses = []
                 batch_train_sizes = []
+                if self.resolution_schedule is not None:
+                    self.resolution_schedule.apply(self.training_iterator, epoch)
 
                 for batch_num, (Xb, yb) in enumerate(self.training_iterator(training_X, training_y)):
+                    Xb, yb, n_train = towers.pad_batch(Xb, yb, self.num_towers)
                     feed_dict_train = {self.inputs: Xb, self.labels: self._adjust_ground_truth(yb),
                                        self.learning_rate: learning_rate_value}
+                    # the padding samples get a zero weight
+                    weights_b = np.zeros(len(Xb), dtype=np.float32)
+                    weights_b[:n_train] = 1.0
+                    sample_losses_fetch = []
+                    if importance_sampling:
+                        weights_b[:n_train] = self.training_iterator.batch_weights(batch_num)
+                        sample_losses_fetch = [self.training_sample_losses]
+                    feed_dict_train[self.sample_weights] = weights_b
+                    feed_dict_train.update(self._training_feed(batch_num, n_train, len(Xb)))
 
                     log.debug('1. Loading batch %d data done.' % batch_num)
-                    if epoch % summary_every == 0 and self.is_summary:
+                    step_tic = time.time()
+                    with_summary = (epoch % summary_every == 0 and self.is_summary and
+                                    self.summary_scheduler.should_run(batch_iter_idx))
+                    if with_summary:
                         log.debug('2. Running training steps with summary...')
-                        training_predictions_e, training_loss_e, summary_str_train, _ = sess.run(
-                            [self.training_predictions, self.regularized_training_loss, training_batch_summary_op,
-                             self.train_op],
-                            feed_dict=feed_dict_train)
-                        train_writer.add_summary(summary_str_train, epoch)
-                        train_writer.flush()
+                        results = profiler.run(
+                            sess, [self.training_predictions, self.regularized_training_loss,
+                                   training_batch_summary_op, self.train_op] + sample_losses_fetch,
+                            feed_dict=feed_dict_train, step=batch_iter_idx)
+                        training_predictions_e, training_loss_e, summary_str_train = results[:3]
+                        train_writer.add_summary(summary_str_train, batch_iter_idx)
                         log.debug(
                             '2. Running training steps with summary done.')
                         log.debug("Epoch %d, Batch %d training loss: %s" %
@@ -170,13 +223,17 @@ class SupervisedTrainer(Base):
                     else:
                         log.debug(
                             '2. Running training steps without summary...')
-                        training_loss_e, _ = sess.run([self.regularized_training_loss, self.train_op],
-                                                      feed_dict=feed_dict_train)
+                        results = profiler.run(sess, [self.regularized_training_loss, self.train_op] +
+                                               sample_losses_fetch, feed_dict=feed_dict_train, step=batch_iter_idx)
+                        training_loss_e = results[0]
                         log.debug(
                             '2. Running training steps without summary done.')
+                    self.summary_scheduler.record_step(time.time() - step_tic, with_summary)
+                    if importance_sampling:
+                        self.training_iterator.update_losses(batch_num, results[-1][:n_train])
 
                     training_losses.append(training_loss_e)
-                    batch_train_sizes.append(len(Xb))
+                    batch_train_sizes.append(n_train)
 
                     if self.update_ops is not None:
                         log.debug('3. Running update ops...')
@@ -190,6 +247,12 @@ class SupervisedTrainer(Base):
 
                 epoch_training_loss = np.average(
                     training_losses, weights=batch_train_sizes)
+                log.info("Epoch %d training: %.1f images/sec on %d %s towers" % (
+                    epoch, np.sum(batch_train_sizes) / (time.time() - tic), self.num_towers, self.tower_device))
+                summary_overhead = self.summary_scheduler.overhead()
+                if summary_overhead is not None:
+                    log.info("Epoch %d summary overhead: %.1f%% of the step time" % (epoch, summary_overhead))
+                self.summary_scheduler.reset()
 
                 # Plot training loss every epoch
                 log.debug('5. Writing epoch summary...')
@@ -208,8 +271,13 @@ class SupervisedTrainer(Base):
                 batch_validation_sizes = []
                 for batch_num, (validation_Xb, validation_yb) in enumerate(
                         self.validation_iterator(validation_X, validation_y)):
+                    validation_Xb, validation_yb, n_validation = towers.pad_batch(
+                        validation_Xb, validation_yb, self.num_towers)
+                    validation_weights_b = np.zeros(len(validation_Xb), dtype=np.float32)
+                    validation_weights_b[:n_validation] = 1.0
                     feed_dict_validation = {self.validation_inputs: validation_Xb,
-                                            self.validation_labels: self._adjust_ground_truth(validation_yb)}
+                                            self.validation_labels: self._adjust_ground_truth(validation_yb),
+                                            self.validation_weights: validation_weights_b}
                     log.debug(
                         '6. Loading batch %d validation data done.' % batch_num)
 
@@ -221,7 +289,6 @@ class SupervisedTrainer(Base):
                             feed_dict=feed_dict_validation)
                         validation_writer.add_summary(
                             summary_str_validate, epoch)
-                        validation_writer.flush()
                         log.debug(
                             '7. Running validation steps with summary done.')
                         log.debug(
@@ -236,6 +303,8 @@ class SupervisedTrainer(Base):
                             feed_dict=feed_dict_validation)
                         log.debug(
                             '7. Running validation steps without summary done.')
+                    validation_Xb, validation_yb = validation_Xb[:n_validation], validation_yb[:n_validation]
+                    validation_predictions_e = validation_predictions_e[:n_validation]
                     validation_losses.append(validation_loss_e)
                     batch_validation_sizes.append(len(validation_Xb))
 
@@ -284,14 +353,30 @@ class SupervisedTrainer(Base):
                 training_history.append(epoch_info)
 
                 log.debug('10. Epoch done. [%d]' % epoch)
+            profiler.close()
             if self.is_summary:
                 train_writer.close()
                 validation_writer.close()
 
-    def _loss_regression(self, logits, labels, is_training):
+    def _weighted_mean(self, sample_losses, weights, name, is_training=True):
+        """Mean of the weighted sample losses of a tower over the real samples of the batch
+
+        The padding samples of `towers.pad_batch` have a zero weight and are not counted. The
+        tower losses and gradients are averaged over the towers, so the sum of a tower is scaled
+        by the number of towers.
+        """
+        batch_weights = self.sample_weights if is_training else self.validation_weights
+        num_real = tf.reduce_sum(tf.cast(tf.not_equal(batch_weights, 0), tf.float32))
+        return tf.div(tf.reduce_sum(sample_losses * weights) * self.num_towers, tf.maximum(num_real, 1.0),
+                      name=name)
+
+    def _loss_regression(self, logits, labels, is_training, weights=None):
         labels = tf.cast(labels, tf.int64)
         sq_loss = tf.square(tf.sub(logits, labels), name='regression loss')
-        sq_loss_mean = tf.reduce_mean(sq_loss, name='regression')
+        if weights is not None:
+            sq_loss_mean = self._weighted_mean(sq_loss, weights, name='regression', is_training=is_training)
+        else:
+            sq_loss_mean = tf.reduce_mean(sq_loss, name='regression')
         if is_training:
             tf.add_to_collection('losses', sq_loss_mean)
 
@@ -304,11 +389,16 @@ class SupervisedTrainer(Base):
         else:
             return sq_loss_mean
 
-    def _loss_softmax(self, logits, labels, is_training):
+    def _loss_softmax(self, logits, labels, is_training, weights=None):
         labels = tf.cast(labels, tf.int64)
         ce_loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
             logits, labels, name='cross_entropy_loss')
-        ce_loss_mean = tf.reduce_mean(ce_loss, name='cross_entropy')
+        if is_training:
+            tf.add_to_collection('sample_losses', ce_loss)
+        if weights is not None:
+            ce_loss_mean = self._weighted_mean(ce_loss, weights, name='cross_entropy', is_training=is_training)
+        else:
+            ce_loss_mean = tf.reduce_mean(ce_loss, name='cross_entropy')
         if is_training:
             tf.add_to_collection('losses', ce_loss_mean)
 
@@ -321,84 +411,108 @@ class SupervisedTrainer(Base):
         else:
             return ce_loss_mean
 
-    def _tower_loss(self, scope, model, images, labels, is_training, reuse, is_classification=True):
+    def _tower_loss(self, scope, model, images, labels, is_training, reuse, is_classification=True, weights=None):
         if is_training:
             self.training_end_points = model(
                 images, is_training=is_training, reuse=reuse)
             if is_classification:
-                _, = self._loss_softmax(self.training_end_points[
-                                        'logits'], labels, is_training)
+                self._loss_softmax(self.training_end_points[
+                                   'logits'], labels, is_training, weights=weights)
             else:
-                _, = self._loss_regression(self.training_end_points[
-                                           'logits'], labels, is_training)
+                self._loss_regression(self.training_end_points[
+                                      'logits'], labels, is_training, weights=weights)
             losses = tf.get_collection('losses', scope)
             total_loss = tf.add_n(losses, name='total_loss')
             for l in losses + [total_loss]:
                 loss_name = re.sub('%s_[0-9]*/' %
-                                   self.cnf['TOWER_NAME'], '', l.op.name)
+                                   self.cnf.get('TOWER_NAME', 'tower'), '', l.op.name)
                 tf.scalar_summary(loss_name, l)
         else:
             self.validation_end_points = model(
                 images, is_training=is_training, reuse=reuse)
             if is_classification:
                 total_loss = self._loss_softmax(self.validation_end_points[
-                                                'logits'], labels, is_training)
+                                                'logits'], labels, is_training, weights=weights)
             else:
                 total_loss = self._loss_regression(self.validation_end_points[
-                                                   'logits'], labels, is_training)
+                                                   'logits'], labels, is_training, weights=weights)
 
         return total_loss
 
     def _average_gradients(self, tower_grads):
-        average_grads = []
-        for grad_and_vars in zip(*tower_grads):
-            grads = []
-            for g, _ in grad_and_vars:
-                expanded_g = tf.expand_dims(g, 0)
-                grads.append(expanded_g)
-            grad = tf.concat(0, grads)
-            grad = tf.reduce_mean(grad, 0)
-
-            v = grad_and_vars[0][1]
-            grad_and_var = (grad, v)
-            average_grads.append(grad_and_var)
-        return average_grads
+        return towers.average_gradients(tower_grads)
 
     def _process_towers_grads(self, opt, model, is_training=True, reuse=None, is_classification=True):
         tower_grads = []
-        images_gpus = tf.split(0, self.cnf['num_gpus'], self.inputs)
-        labels_gpus = tf.split(0, self.cnf['num_gpus'], self.labels)
-        for i in xrange(self.cnf['num_gpus']):
-            with tf.device('/gpu:%d' % i):
-                with tf.name_scope('%s_%d' % (self.cnf['TOWER_NAME'], i)) as scope:
-                    loss = self._tower_loss(scope, model, images_gpus[i], labels_gpus[
-                                            i], is_training=is_training, reuse=reuse, is_classification=is_classification)
+        tower_losses = []
+        tower_predictions = []
+        tower_sample_losses = []
+        images_towers = towers.split_batch(self.inputs, self.num_towers)
+        labels_towers = towers.split_batch(self.labels, self.num_towers)
+        weights_towers = towers.split_batch(self.sample_weights, self.num_towers)
+        for i, device in enumerate(towers.tower_devices(self.num_towers, self.tower_device)):
+            with tf.device(device):
+                with tf.name_scope('%s_%d' % (self.cnf.get('TOWER_NAME', 'tower'), i)) as scope:
+                    loss = self._tower_loss(scope, model, images_towers[i], labels_towers[
+                                            i], is_training=is_training, reuse=reuse, is_classification=is_classification,
+                                            weights=weights_towers[i])
+                    tower_sample_losses.extend(tf.get_collection('sample_losses', scope))
 
                     tf.get_variable_scope().reuse_variables()
                     reuse = True
-                    if self.clip_by_global_norm:
+                    if self.cnf.get('recompute_checkpoints'):
+                        grads_and_vars = recompute.compute_gradients(
+                            loss, policy=self.cnf['recompute_checkpoints'])
+                        if self.clip_by_global_norm:
+                            grads, tvars = zip(*grads_and_vars)
+                            grads, _ = tf.clip_by_global_norm(list(grads), self.norm_threshold)
+                            grads_and_vars = list(zip(grads, tvars))
+                    elif self.clip_by_global_norm:
                         grads_and_vars = self._clip_grad_global_norms(tf.trainable_variables(
                         ), loss, opt, global_norm=self.norm_threshold, gradient_noise_scale=0.0)
                     else:
                         grads_and_vars = opt.compute_gradients(loss)
                     tower_grads.append(grads_and_vars)
+                    tower_losses.append(loss)
+                    tower_predictions.append(self.training_end_points['predictions'])
 
         grads_and_vars = self._average_gradients(tower_grads)
+        self.training_predictions = tf.concat(0, tower_predictions) if len(
+            tower_predictions) > 1 else tower_predictions[0]
+        self.training_sample_losses = tf.concat(0, tower_sample_losses) if len(
+            tower_sample_losses) > 1 else (tower_sample_losses or [None])[0]
 
-        return grads_and_vars, loss
+        return grads_and_vars, tf.add_n(tower_losses) / len(tower_losses)
 
     def _process_towers_loss(self, opt, model, is_training=False, reuse=True, is_classification=True):
         tower_loss = []
-        images_gpus = tf.split(0, self.cnf['num_gpus'], self.validation_inputs)
-        labels_gpus = tf.split(0, self.cnf['num_gpus'], self.validation_labels)
-        for i in xrange(self.cnf['num_gpus']):
-            with tf.device('/gpu:%d' % i):
-                with tf.name_scope('%s_%d' % (self.cnf['TOWER_NAME'], i)) as scope:
-                    loss = self._tower_loss(scope, model, images_gpus[i], labels_gpus[
-                                            i], is_training=is_training, reuse=reuse, is_classification=is_classification)
+        tower_predictions = []
+        images_towers = towers.split_batch(self.validation_inputs, self.num_towers)
+        labels_towers = towers.split_batch(self.validation_labels, self.num_towers)
+        weights_towers = towers.split_batch(self.validation_weights, self.num_towers)
+        for i, device in enumerate(towers.tower_devices(self.num_towers, self.tower_device)):
+            with tf.device(device):
+                with tf.name_scope('%s_%d' % (self.cnf.get('TOWER_NAME', 'tower'), i)) as scope:
+                    loss = self._tower_loss(scope, model, images_towers[i], labels_towers[
+                                            i], is_training=is_training, reuse=reuse, is_classification=is_classification,
+                                            weights=weights_towers[i])
                     tower_loss.append(loss)
+                    tower_predictions.append(self.validation_end_points['predictions'])
+
+        self.validation_predictions = tf.concat(0, tower_predictions) if len(
+            tower_predictions) > 1 else tower_predictions[0]
+        return tf.add_n(tower_loss) / len(tower_loss)
 
-        return sum(tower_loss)
+    def _training_feed(self, batch_num, num_examples, batch_size):
+        """Returns the extra feeds of a training batch, for the subclasses
+
+        Args:
+            batch_num: index of the batch in the epoch, see `BatchIterator.batch_index`
+            num_examples: number of examples of the batch
+            batch_size: number of examples after the padding to a multiple of the towers, the
+                padding repeats the first examples
+        """
+        return {}
 
     def _adjust_ground_truth(self, y):
         return y if self.classification else y.reshape(-1, 1).astype(np.float32)
@@ -411,14 +525,25 @@ class SupervisedTrainer(Base):
             1.0, trainable=False, name="learning_rate")
         optimizer = self._optimizer(self.learning_rate, optname=self.cnf.get(
             'optname', 'momentum'), **self.cnf.get('opt_kwargs', {'decay': 0.9}))
-        self.inputs = tf.placeholder(tf.float32, shape=(None, self.model.crop_size[
-                                     0], self.model.crop_size[1], 3), name="input")
+        if self.resolution_schedule is None:
+            self.inputs = tf.placeholder(tf.float32, shape=(None, self.model.crop_size[
+                                         0], self.model.crop_size[1], 3), name="input")
+        else:
+            self.inputs = tf.placeholder(tf.float32, shape=(None, None, None, 3), name="input")
         self.labels = tf.placeholder(tf.int32, shape=(None,))
+        # weights of the sample losses, zero for the tower padding, importance weights of the
+        # loss sampling iterators
+        self.sample_weights = tf.placeholder_with_default(
+            tf.ones_like(self.labels, dtype=tf.float32), shape=(None,), name='sample_weights')
         self.validation_inputs = tf.placeholder(tf.float32, shape=(
             None, self.model.crop_size[0], self.model.crop_size[1], 3), name="validation_input")
         self.validation_labels = tf.placeholder(tf.int32, shape=(None,))
+        # zero for the tower padding of the validation batches
+        self.validation_weights = tf.placeholder_with_default(
+            tf.ones_like(self.validation_labels, dtype=tf.float32), shape=(None,), name='validation_weights')
         self.grads_and_vars, self.training_loss = self._process_towers_grads(
             optimizer, self.model, is_classification=self.classification)
+        self.regularized_training_loss = self.training_loss
         self.validation_loss = self._process_towers_loss(
             optimizer, self.model, is_classification=self.classification)
 
@@ -0,0 +1,75 @@
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import towers
+from tefla.core.learning import SupervisedTrainer
+from tefla.core.losses import distillation_loss
+
+
+class DistillationTrainer(SupervisedTrainer):
+    """
+    Distillation Trainer, trains a student model against the soft targets of a teacher ensemble
+
+    The training loss of an example mixes the temperature scaled KL divergence from the teacher
+    softmax with the hard label cross entropy,
+    `alpha * T^2 * KL(softmax(teacher / T) || softmax(student / T)) + (1 - alpha) * CE(label)`,
+    the validation loss is the hard label one. The teacher logits are precomputed once for the
+    training files, see `tefla.core.teacher_logits`, and looked up by file name for every batch,
+    so the training iterator must be a `BatchIterator` over the file names.
+
+    Args:
+        model: student model definition
+        cnf: dict, training configs, `distill_temperature` (T, default 4.0) and `distill_alpha`
+            (alpha, default 0.9) set the loss
+        teacher_logits: a `TeacherLogits` of the training files
+        kwargs: the `SupervisedTrainer` args
+    """
+
+    def __init__(self, model, cnf, teacher_logits, **kwargs):
+        self.teacher = teacher_logits
+        self.temperature = cnf.get('distill_temperature', 4.0)
+        self.alpha = cnf.get('distill_alpha', 0.9)
+        super(DistillationTrainer, self).__init__(model, cnf, **kwargs)
+
+    def fit(self, data_set, weights_from=None, start_epoch=1, summary_every=10, keep_moving_averages=False):
+        self.teacher.check_files(data_set.training_X)
+        super(DistillationTrainer, self).fit(data_set, weights_from, start_epoch, summary_every,
+                                             keep_moving_averages)
+
+    def _process_towers_grads(self, opt, model, is_training=True, reuse=None, is_classification=True):
+        self.teacher_logits = tf.placeholder(tf.float32, shape=(None, self.teacher.num_classes),
+                                             name='teacher_logits')
+        # consumed in tower order by the training losses
+        self._tower_teacher_logits = towers.split_batch(self.teacher_logits, self.num_towers)
+        return super(DistillationTrainer, self)._process_towers_grads(opt, model, is_training, reuse,
+                                                                      is_classification)
+
+    def _loss_softmax(self, logits, labels, is_training, weights=None):
+        if not is_training:
+            return super(DistillationTrainer, self)._loss_softmax(logits, labels, is_training, weights)
+        teacher_logits = self._tower_teacher_logits.pop(0)
+        labels = tf.cast(labels, tf.int64)
+        ce_loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+            logits, labels, name='cross_entropy_loss')
+        kd_loss = distillation_loss(logits, teacher_logits, self.temperature)
+        loss = tf.add(self.alpha * kd_loss, (1 - self.alpha) * ce_loss, name='distillation_total')
+        tf.add_to_collection('sample_losses', loss)
+        if weights is not None:
+            loss_mean = self._weighted_mean(loss, weights, name='distillation')
+        else:
+            loss_mean = tf.reduce_mean(loss, name='distillation')
+        tf.add_to_collection('losses', loss_mean)
+
+        l2_loss = tf.add_n(tf.get_collection(
+            tf.GraphKeys.REGULARIZATION_LOSSES))
+        l2_loss = l2_loss * self.cnf.get('l2_reg', 0.0)
+        tf.add_to_collection('losses', l2_loss)
+
+        return tf.add_n(tf.get_collection('losses'), name='total_loss')
+
+    def _training_feed(self, batch_num, num_examples, batch_size):
+        iterator = self.training_iterator
+        logits = self.teacher.lookup(iterator.X[iterator.batch_index(batch_num)])
+        return {self.teacher_logits: logits[np.arange(batch_size) % num_examples]}
@@ -8,8 +8,10 @@ from datetime import datetime
 
 import numpy as np
 import tensorflow as tf
+from tensorflow.python.ops import control_flow_ops
 
 from tefla.core.base import Base
+from tefla.core.session_config import create_session_config
 # import tefla.core.summary as summary
 import tefla.core.logger as log
 from tefla.utils import util
@@ -52,6 +54,8 @@ class DistSupervisedTrainer(Base):
     """
 
     def __init__(self, model, cnf, clip_by_global_norm=False, gradient_noise_scale=None, gradient_multipliers=None, aggregation_method=None, colocate_gradients_with_ops=False, **kwargs):
+        super(DistSupervisedTrainer, self).__init__(
+            model, cnf, **kwargs)
         self.clip_by_global_norm = clip_by_global_norm
         self.gradient_noise_scale = gradient_noise_scale
         self.gradient_multipliers = gradient_multipliers
@@ -62,10 +66,8 @@ class DistSupervisedTrainer(Base):
         self.min_queue_examples = self.cnf.get('min_queue_examples', 1000)
         self.capacity = self.cnf.get('capacity', 2000)
         self.feature_keys = self.cnf.get('feature_keys')
-        super(DistSupervisedTrainer, self).__init__(
-            model, cnf, **kwargs)
 
-    def fit(self, task_id, target, dataset, datadir, cluster_spec, is_training=True, start_epoch=1, reuse=None, num_replicas_to_aggregate=-1, variables_to_train=None):
+    def fit(self, task_id, target, dataset, datadir, cluster_spec, is_training=True, start_epoch=1, reuse=None, num_replicas_to_aggregate=-1, variables_to_train=None, weights_from=None):
         """
         Train the model on the specified dataset
 
@@ -85,30 +87,32 @@ class DistSupervisedTrainer(Base):
             variables_to_train: an optional list of variables to train. If None, it will
                   default to all tf.trainable_variables()
             keep_moving_averages: a bool, keep moving averages of trainable variables
+
+        Returns:
+            the training statistics of this worker, see `train`
         """
-        if self.is_summary:
-            self._setup_summaries()
         dataflow = self._setup_data_ops(datadir, dataset_name=self.dataset_name, feature_keys=self.feature_keys,
-                                        num_readers=self.num_readers, min_queue_examples=self.min_queue_examples, capacity=self.capacity)
-        self._setup_misc()
-        self._print_info(dataset)
-        self.train(task_id, target, dataset, dataflow, cluster_spec, is_training,
-                   start_epoch=1, reuse=None, num_replicas_to_aggregate=-1, variables_to_train=None)
+                                        num_readers=self.num_readers, min_queue_examples=self.min_queue_examples, capacity=self.capacity,
+                                        num_workers=len(cluster_spec.as_dict()['worker']), worker_index=task_id)
+        return self.train(task_id, target, dataset, dataflow, cluster_spec, is_training, weights_from=weights_from,
+                          start_epoch=start_epoch, reuse=reuse, num_replicas_to_aggregate=num_replicas_to_aggregate,
+                          variables_to_train=variables_to_train)
 
-    def _setup_data_ops(self, datadir, dataset_name='imagenet', feature_keys=None, num_readers=8, min_queue_examples=1000, capacity=2000):
+    def _setup_data_ops(self, datadir, dataset_name='imagenet', feature_keys=None, num_readers=8, min_queue_examples=1000, capacity=2000, num_workers=1, worker_index=0):
         if feature_keys is None:
-            features_keys = {
+            feature_keys = {
                 'image/encoded/image': tf.FixedLenFeature((), tf.string, default_value=''),
                 'image/format': tf.FixedLenFeature((), tf.string, default_value='jpg'),
                 'image/class/label': tf.FixedLenFeature([], tf.int64, default_value=tf.zeros([], dtype=tf.int64)),
             }
 
-        decoder = Decoder(features_keys)
+        decoder = Decoder(feature_keys)
 
-        dataset = Dataset(dataset_name, decoder, datadir)
+        dataset = Dataset(dataset_name, decoder, datadir, file_pattern=self.cnf.get('data_file_pattern', '*'))
 
         dataflow = Dataflow(dataset, num_readers=num_readers, shuffle=True,
-                            min_queue_examples=min_queue_examples, capacity=capacity)
+                            min_queue_examples=min_queue_examples, capacity=capacity,
+                            num_workers=num_workers, worker_index=worker_index, seed=self.cnf.get('seed'))
         return dataflow
 
     def _setup_misc(self):
@@ -122,7 +126,8 @@ class DistSupervisedTrainer(Base):
     def _print_info(self, data_set):
         log.info('Config:')
         log.info(pprint.pformat(self.cnf))
-        data_set.print_info()
+        if data_set is not None:
+            data_set.print_info()
         log.info('Max epochs: %d' % self.num_epochs)
         all_vars = set(tf.all_variables())
         trainable_vars = set(tf.trainable_variables())
@@ -146,42 +151,53 @@ class DistSupervisedTrainer(Base):
 
         self._print_layer_shapes(self.training_end_points, log)
 
-    def train(self, task_id, target, dataset, dataflow, cluster_spec, is_training, start_epoch=1, reuse=None, num_replicas_to_aggregate=-1, variables_to_train=None):
+    def train(self, task_id, target, dataset, dataflow, cluster_spec, is_training, weights_from=None, start_epoch=1, reuse=None, num_replicas_to_aggregate=-1, variables_to_train=None):
+        """Runs the sync replica training loop of a worker task
+
+        The loop stops after `cnf['max_steps']` global steps, or when the supervisor stops.
+
+        Returns:
+            a dict with the number of `global_steps` of the timed window, i.e. after the first
+            `cnf['warmup_steps']` steps of this worker, its `seconds` and the cluster
+            `examples_per_sec`, computed from the global step increments, so the chief reports
+            the throughput of all the workers
+        """
         num_workers = len(cluster_spec.as_dict()['worker'])
         num_parameter_servers = len(cluster_spec.as_dict()['ps'])
         if num_replicas_to_aggregate == -1:
             num_replicas_to_aggregate = num_workers
-        else:
-            num_replicas_to_aggregate = num_replicas_to_aggregate
 
         assert num_workers > 0 and num_parameter_servers > 0, (
             ' num_workers and num_parameter_servers must be > 0.')
 
         is_chief = (task_id == 0)
+        batch_size = self.cnf.get('batch_size', 32)
+        max_steps = self.cnf.get('max_steps', 10000000)
+        warmup_steps = self.cnf.get('warmup_steps', 10)
 
         # Ops are assigned to worker by default.
         with tf.device('/job:worker/task:%d' % task_id) as scope:
             with tf.device(tf.replica_device_setter(cluster=cluster_spec)):
-                # with
-                # tf.device(tf.replica_device_setter(ps_device='/job:ps/task:%d'
-                # % task_id)):
                 global_step = tf.get_variable('global_step', shape=[
                 ], dtype=tf.int64, initializer=tf.zeros_initializer, trainable=False)
                 learning_rate = self.lr_policy.initial_lr
-                n_iters_per_epoch = dataset.n_iters_per_epoch
-                n_val_iters_per_epoch = dataset.n_val_iters_per_epoch
+                self.learning_rate = tf.placeholder(tf.float32, shape=[], name="learning_rate_placeholder")
+                n_iters_per_epoch = max(dataflow.num_examples_per_epoch // batch_size, 1)
+                n_val_iters_per_epoch = self.cnf.get('n_val_iters_per_epoch', 0)
                 self.lr_policy.n_iters_per_epoch = n_iters_per_epoch
-                images, labels = dataflow.batch_inputs(self.cnf.get('batch_size', 32), True, self.cnf.get('tfrecords_image_size'), self.cnf.get(
-                    'crop_size'), im_size=None, bbox=None, image_preprocessing=None, num_preprocess_threads=self.cnf.get('num_preprocess_threads', 8), input_queue_memory_factor=1)
-                labels = self._adjust_ground_truth(labels)
-                val_images, val_labels = dataflow.batch_inputs(self.cnf.get('batch_size_test', 32), False, self.cnf.get('tfrecords_image_size'), self.cnf.get(
-                    'crop_size'), im_size=None, bbox=None, image_preprocessing=None, num_preprocess_threads=self.cnf.get('num_preprocess_threads', 8), input_queue_memory_factor=1)
-                val_labels = self._adjust_ground_truth(val_labels)
+                images, labels = dataflow.batch_inputs(batch_size, True, self.cnf.get('tfrecords_image_size'), self.cnf.get(
+                    'crop_size'), im_size=None, bbox=None, image_preprocessing=None, num_preprocess_threads=self.cnf.get('num_preprocess_threads', 8))
+                val_images, val_labels = None, None
+                if n_val_iters_per_epoch > 0:
+                    val_images, val_labels = dataflow.batch_inputs(self.cnf.get('batch_size_test', 32), False, self.cnf.get('tfrecords_image_size'), self.cnf.get(
+                        'crop_size'), im_size=None, bbox=None, image_preprocessing=None, num_preprocess_threads=self.cnf.get('num_preprocess_threads', 8))
 
                 total_loss, opt, val_total_loss = self._setup_model_loss(images, labels, val_images, val_labels,
-                                                                         is_chief, task_id, num_workers, is_training, scope, initial_lr=learning_rate, reuse=None, global_step=None, num_replicas_to_aggregate=-1)
-                train_op = self.create_train_op(total_loss, opt, global_step=global_step, update_ops=None, variables_to_train=None, clip_grad_global_norm=self.clip_grad_global_norm, gradient_noise_scale=self.gradient_noise_scale,
+                                                                         is_chief, task_id, num_workers, is_training, scope, reuse=reuse, global_step=global_step, num_replicas_to_aggregate=num_replicas_to_aggregate)
+                train_op = self.create_train_op(total_loss, opt, global_step=global_step, update_ops=None, variables_to_train=variables_to_train, clip_grad_global_norm=self.clip_by_global_norm, gradient_noise_scale=self.gradient_noise_scale,
                                                 gradient_multipliers=self.gradient_multipliers, gate_gradients=tf.Optimizer.GATE_OP, aggregation_method=self.aggregation_method, colocate_gradients_with_ops=self.colocate_gradients_with_ops)
+                self._setup_misc()
+                self._print_info(dataset)
 
                 chief_queue_runners = [opt.get_chief_queue_runner()]
                 init_tokens_op = opt.get_init_tokens_op()
@@ -195,17 +211,15 @@ class DistSupervisedTrainer(Base):
 
                 log.info('%s Supervisor' % datetime.now())
 
-                sess_config = tf.ConfigProto(
-                    allow_soft_placement=True, log_device_placement=self.cnf('log_device_placement', False))
+                sess_config = create_session_config(
+                    self.cnf, allow_soft_placement=True, log_device_placement=self.cnf.get('log_device_placement', False))
 
                 sess = sv.prepare_or_wait_for_session(
                     target, config=sess_config)
 
-                coord = tf.train.Coordinator()
                 queue_runners = tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS)
-                sv.start_queue_runners(sess, queue_runners, coord=coord)
-                tf.logging.info(
-                    'Started %d queues for processing input data.', len(queue_runners))
+                sv.start_queue_runners(sess, queue_runners)
+                log.info('Started %d queues for processing input data.' % len(queue_runners))
 
                 if is_chief:
                     sv.start_queue_runners(sess, chief_queue_runners)
@@ -215,13 +229,14 @@ class DistSupervisedTrainer(Base):
                             start_epoch - 1)
 
                     if weights_from:
-                        self._load_weights(sess, saver, weights_from)
+                        self._load_weights(sess, weights_from)
 
-                next_summary_time = time.time() + self.cnf.get('save_summaries_secs', 180000000)
                 batch_iter_idx = 1
                 epoch = 1
+                step = 0
+                timed_start = None
                 training_history = []
-                while not sv.should_stop():
+                while not sv.should_stop() and step < max_steps:
                     try:
                         training_losses = []
                         batch_train_sizes = []
@@ -232,40 +247,29 @@ class DistSupervisedTrainer(Base):
                             start_time = time.time()
                             loss_value, step = sess.run(
                                 [train_op, global_step], feed_dict=feed_dict_train)
+                            duration = time.time() - start_time
                             assert not np.isnan(
                                 loss_value), 'Model diverged with loss = NaN'
-                            if step > self.cnf.get('max_steps', 10000000):
-                                break
-                            duration = time.time() - start_time
+                            if batch_iter_idx == warmup_steps:
+                                timed_start = (time.time(), step)
 
                             if step % 30 == 0:
-                                examples_per_sec = self.cnf.get(
-                                    'batch_size', 32) / float(duration)
+                                examples_per_sec = batch_size / float(duration)
                                 format_str = (
                                     'Worker %d: %s: step %d, loss = %.2f (%.1f examples/sec; %.3f  sec/batch)')
-                            log.info(format_str % (task_id, datetime.now(
-                            ), step, loss_value, examples_per_sec, duration))
-
-                            if is_chief and next_summary_time < time.time():
-                                log.info(
-                                    'Running Summary operation on the chief.')
-                                # summary_str = sess.run(summary_op)
-                                # sv.summary_computed(sess, summary_str)
-                                log.info('Finished running Summary operation.')
-
-                            # Determine the next time for running the summary.
-                            next_summary_time += self.cnf.get(
-                                'save_summaries_secs', 180)
+                                log.info(format_str % (task_id, datetime.now(
+                                ), step, loss_value, examples_per_sec, duration))
 
                             training_losses.append(loss_value)
-                            batch_train_sizes.append(len(images))
+                            batch_train_sizes.append(batch_size)
                             learning_rate = self.lr_policy.batch_update(
                                 learning_rate, batch_iter_idx)
                             batch_iter_idx += 1
                             log.debug('4. Training batch %d done.' % iteration)
+                            if step >= max_steps:
+                                break
                         epoch_training_loss = np.average(
                             training_losses, weights=batch_train_sizes)
-                        # epoch_duration = time.time() - epoch_start_time
                         # Validation prediction and metrics
                         validation_losses = []
                         batch_validation_metrics = [
@@ -273,32 +277,28 @@ class DistSupervisedTrainer(Base):
                         epoch_validation_metrics = []
                         batch_validation_sizes = []
                         for iteration in range(n_val_iters_per_epoch):
-                            feed_dict_val = {self.learning_rate: learning_rate}
-                            log.debug(
-                                '6. Loading batch %d validation data done.' % iteration)
                             log.debug(
                                 '7. Running validation steps without summary...')
-                            validation_predictions_e, validation_loss_e = sess.run(
-                                [self.validation_predictions, val_total_loss],
-                                feed_dict=feed_dict_val)
+                            validation_predictions_e, validation_loss_e, validation_labels_e = sess.run(
+                                [self.validation_predictions, val_total_loss, val_labels])
                             log.debug(
                                 '7. Running validation steps without summary done.')
                             validation_losses.append(validation_loss_e)
-                            batch_validation_sizes.append(len(val_images))
+                            batch_validation_sizes.append(len(validation_labels_e))
 
                             for i, (_, metric_function) in enumerate(self.validation_metrics_def):
                                 metric_score = metric_function(
-                                    val_labels, validation_predictions_e)
+                                    validation_labels_e, validation_predictions_e)
                                 batch_validation_metrics[
                                     i].append(metric_score)
                             log.debug('8. Validation batch %d done' %
                                       iteration)
 
                         epoch_validation_loss = np.average(
-                            validation_losses, weights=batch_validation_sizes)
+                            validation_losses, weights=batch_validation_sizes) if validation_losses else float('nan')
                         for i, (_, _) in enumerate(self.validation_metrics_def):
                             epoch_validation_metrics.append(
-                                np.average(batch_validation_metrics[i], weights=batch_validation_sizes))
+                                np.average(batch_validation_metrics[i], weights=batch_validation_sizes) if validation_losses else float('nan'))
 
                         custom_metrics_string = [', %s: %.3f' % (name, epoch_validation_metrics[i]) for i, (name, _) in
                                                  enumerate(self.validation_metrics_def)]
@@ -327,21 +327,28 @@ class DistSupervisedTrainer(Base):
                         log.debug('10. Epoch done. [%d]' % epoch)
                         epoch += 1
                     except Exception as e:
-                        print(e.message)
+                        log.error('Worker %d: %s' % (task_id, e))
                         if is_chief:
                             log.info('About to execute sync_clean_up_op!')
-                        sess.run(clean_up_op)
+                            sess.run(clean_up_op)
                         raise
 
-                sv.stop()
-                coord.request_stop()
-                coord.join(stop_grace_period_secs=0.05)
+                stats = {'global_steps': 0, 'seconds': 0.0, 'examples_per_sec': 0.0}
+                if timed_start is not None:
+                    stats['seconds'] = time.time() - timed_start[0]
+                    stats['global_steps'] = int(step - timed_start[1])
+                    stats['examples_per_sec'] = (stats['global_steps'] * num_replicas_to_aggregate * batch_size /
+                                                 max(stats['seconds'], 1e-9))
+                    log.info('Worker %d: %d global steps in %.1fs, %.1f examples/sec' % (
+                        task_id, stats['global_steps'], stats['seconds'], stats['examples_per_sec']))
 
                 if is_chief:
                     if not os.path.exists(self.weights_dir):
                         os.mkdir(self.weights_dir)
                     saver.save(sess, os.path.join(self.weights_dir,
                                                   'model.ckpt'), global_step=global_step)
+                sv.stop()
+                return stats
 
     def _loss_regression(self, logits, labels, is_training):
         labels = tf.cast(labels, tf.int64)
@@ -381,16 +388,16 @@ class DistSupervisedTrainer(Base):
             self.training_end_points = model(
                 images, is_training=is_training, reuse=resue)
             if is_classification:
-                _, = self._loss_softmax(self.training_end_points[
-                                        'logits'], labels, is_training)
+                self._loss_softmax(self.training_end_points[
+                                   'logits'], labels, is_training)
             else:
-                _, = self._loss_regression(self.training_end_points[
-                                           'logits'], labels, is_training)
+                self._loss_regression(self.training_end_points[
+                                      'logits'], labels, is_training)
             losses = tf.get_collection('losses', scope)
             total_loss = tf.add_n(losses, name='total_loss')
             for l in losses + [total_loss]:
                 loss_name = re.sub('%s_[0-9]*/' %
-                                   self.cnf['TOWER_NAME'], '', l.op.name)
+                                   self.cnf.get('TOWER_NAME', 'tower'), '', l.op.name)
                 tf.scalar_summary(loss_name, l)
             return losses, total_loss
         else:
@@ -407,12 +414,16 @@ class DistSupervisedTrainer(Base):
 
             return total_loss
 
-    def _setup_model_loss(self, inputs, labels, validation_inputs, validation_labels, is_chief, task_id, num_workers, is_training, scope, initial_lr=0.1, reuse=None, global_step=None, num_replicas_to_aggregate=-1):
+    def _setup_model_loss(self, inputs, labels, validation_inputs, validation_labels, is_chief, task_id, num_workers, is_training, scope, reuse=None, global_step=None, num_replicas_to_aggregate=-1):
+        if num_replicas_to_aggregate == -1:
+            num_replicas_to_aggregate = num_workers
 
         losses, total_loss = self._tower_loss(
             scope, self.model, inputs, labels, is_training, reuse, is_classification=True)
-        val_total_loss = self._tower_loss(
-            scope, self.model, validation_inputs, validation_labels, is_training=False, reuse=True, is_classification=True)
+        val_total_loss = None
+        if validation_inputs is not None:
+            val_total_loss = self._tower_loss(
+                scope, self.model, validation_inputs, validation_labels, is_training=False, reuse=True, is_classification=True)
 
         if is_chief:
             loss_averages = tf.train.ExponentialMovingAverage(0.9, name='avg')
@@ -428,8 +439,7 @@ class DistSupervisedTrainer(Base):
             tf.trainable_variables() + tf.moving_average_variables())
 
         # Create synchronous replica optimizer.
-        learning_rate = self.lr_policy.batch_update(initial_lr, global_step)
-        opt = self._optimizer(learning_rate, optname=self.cnf.get(
+        opt = self._optimizer(self.learning_rate, optname=self.cnf.get(
             'optname', 'momentum'), **self.cnf.get('opt_kwargs', {'decay': 0.9}))
         opt = tf.train.SyncReplicasOptimizer(opt, replicas_to_aggregate=num_replicas_to_aggregate, replica_id=task_id,
                                              total_num_replicas=num_workers, variable_averages=exp_moving_averager, variables_to_average=variables_to_average)
@@ -480,7 +490,7 @@ class DistSupervisedTrainer(Base):
         if update_ops:
             with tf.control_dependencies(update_ops):
                 barrier = tf.no_op(name='update_barrier')
-                total_loss = tf.with_dependencies([barrier], total_loss)
+                total_loss = control_flow_ops.with_dependencies([barrier], total_loss)
 
         if variables_to_train is None:
             variables_to_train = tf.trainable_variables()
@@ -510,4 +520,4 @@ class DistSupervisedTrainer(Base):
                 total_loss, 'LossTensor is inf or nan')
 
         # Ensure the train_tensor computes grad_updates.
-        return tf.with_dependencies([grad_updates], total_loss)
+        return control_flow_ops.with_dependencies([grad_updates], total_loss)
@@ -16,6 +16,7 @@ from tensorflow.python.ops import control_flow_ops
 from tefla.core import logger as log
 from tefla.core import summary as summary
 from tefla.core.base import Base
+from tefla.core.session_config import create_session_config
 from tefla.utils import util
 
 
@@ -44,10 +45,18 @@ class SemiSupervisedTrainer(Base):
             e.g: total_training_samples/batch_size
         gpu_memory_fraction: amount of gpu memory to use
         is_summary: bool, to write summary or not
+
+    With `cnf['fused_gan_step']` the discriminator and generator updates run in a single session
+    call: both gradients are computed from the same forward pass, then the discriminator and
+    the generator updates are applied in that order. The default alternating step runs the
+    generator update on a new forward pass through the updated discriminator.
+    The generator has a fixed batch size, a short last training batch is padded, or dropped with
+    `cnf['last_batch'] = 'drop'`, by the training iterator.
     """
 
     def __init__(self, model, cnf, clip_by_global_norm=False, **kwargs):
         self.clip_by_global_norm = clip_by_global_norm
+        self.fused_gan_step = cnf.get('fused_gan_step', False)
         super(SemiSupervisedTrainer, self).__init__(model, cnf, **kwargs)
 
     def fit(self, data_set, num_classes=6, weights_from=None, start_epoch=1, summary_every=199, model_name='multiclass_ss', weights_dir='weights'):
@@ -96,10 +105,8 @@ class SemiSupervisedTrainer(Base):
         # Build an initialization operation to run below.
         init = tf.global_variables_initializer()
 
-        gpu_options = tf.GPUOptions(
-            per_process_gpu_memory_fraction=self.cnf.get('gpu_memory_fraction', 0.9))
-        sess = tf.Session(config=tf.ConfigProto(
-            allow_soft_placement=True, gpu_options=gpu_options))
+        sess = tf.Session(config=create_session_config(
+            self.cnf, self.cnf.get('gpu_memory_fraction', 0.9), allow_soft_placement=True))
         sess.run(init)
         if start_epoch > 1:
             weights_from = "weights/model-epoch-%d" % (
@@ -116,6 +123,7 @@ class SemiSupervisedTrainer(Base):
                 self.cnf.get('summary_dir', '/tmp/tefla-summary'), sess)
         # keep track of maximum accuracy and auroc and save corresponding
         # weights
+        self.training_iterator.set_last_batch(self.cnf.get('last_batch', 'pad'))
         training_history = []
         seed_delta = 100
         batch_iter_idx = 1
@@ -130,21 +138,30 @@ class SemiSupervisedTrainer(Base):
             g_train_losses = []
             batch_train_sizes = []
             for batch_num, (Xb, yb) in enumerate(self.training_iterator(training_X, training_y)):
-                if Xb.shape[0] != self.cnf['batch_size_train']:
-                    batch_pad = - Xb.shape[0] + self.cnf['batch_size_train']
-                    Xb = np.vstack((Xb, Xb[0:batch_pad, :, :, :]))
-                    yb = np.hstack((yb, yb[0:batch_pad]))
                 feed_dict_train = {self.inputs: Xb,
                                    self.labels: yb, self.learning_rate_d: learning_rate_value, self.learning_rate_g: learning_rate_value}
                 log.debug('1. Loading batch %d data done.' % batch_num)
-                if epoch % summary_every == 0 and self.is_summary:
+                step_tic = time.time()
+                with_summary = (epoch % summary_every == 0 and self.is_summary and
+                                self.summary_scheduler.should_run(batch_iter_idx))
+                if self.fused_gan_step:
+                    log.debug('2. Running fused training step...')
+                    fetches = [self.train_op, self.d_loss_real, self.d_loss_fake, self.d_loss_class, self.g_losses[0]]
+                    if with_summary:
+                        _, _d_loss_real, _d_loss_fake, _d_loss_class, _g_loss, summary_str_train = sess.run(
+                            fetches + [training_batch_summary_op], feed_dict=feed_dict_train)
+                        train_writer.add_summary(summary_str_train, batch_iter_idx)
+                    else:
+                        _, _d_loss_real, _d_loss_fake, _d_loss_class, _g_loss = sess.run(
+                            fetches, feed_dict=feed_dict_train)
+                    log.debug('2. Running fused training step done.')
+                elif with_summary:
                     log.debug('2. Running training steps with summary...')
                     _, _d_loss_real, _d_loss_fake, _d_loss_class, summary_str_train = sess.run(
                         [self.train_op_d, self.d_loss_real, self.d_loss_fake, self.d_loss_class, training_batch_summary_op], feed_dict=feed_dict_train)
                     _, _g_loss = sess.run([self.train_op_g, self.g_losses[
                                           0]], feed_dict=feed_dict_train)
-                    train_writer.add_summary(summary_str_train, epoch)
-                    train_writer.flush()
+                    train_writer.add_summary(summary_str_train, batch_iter_idx)
                     log.debug(
                         '2. Running training steps with summary done.')
                     log.debug("Epoch %d, Batch %d D_loss_real: %s, D_loss_fake: %s,D_loss_class: %s, G_loss: %s" % (
@@ -158,6 +175,7 @@ class SemiSupervisedTrainer(Base):
                                           0]], feed_dict=feed_dict_train)
                     log.debug(
                         '2. Running training steps without summary done.')
+                self.summary_scheduler.record_step(time.time() - step_tic, with_summary)
 
                 d_train_losses.append(
                     _d_loss_real + _d_loss_fake + _d_loss_class)
@@ -167,6 +185,12 @@ class SemiSupervisedTrainer(Base):
                     learning_rate_value, batch_iter_idx)
                 batch_iter_idx += 1
                 log.debug('4. Training batch %d done.' % batch_num)
+            log.info("Epoch %d: %d training steps, %.2f steps/sec" % (
+                epoch, len(batch_train_sizes), len(batch_train_sizes) / (time.time() - tic)))
+            summary_overhead = self.summary_scheduler.overhead()
+            if summary_overhead is not None:
+                log.info("Epoch %d summary overhead: %.1f%% of the step time" % (epoch, summary_overhead))
+            self.summary_scheduler.reset()
             d_avg_loss = np.average(
                 d_train_losses, weights=batch_train_sizes)
             g_avg_loss = np.average(
@@ -202,7 +226,6 @@ class SemiSupervisedTrainer(Base):
 
                     validation_writer.add_summary(
                         summary_str_validation, epoch)
-                    validation_writer.flush()
                     log.debug(
                         '7. Running validation steps with summary done.')
                     log.debug(
@@ -478,14 +501,26 @@ class SemiSupervisedTrainer(Base):
             with tf.name_scope('multiply_grads'):
                 capped_d_grads = self._multiply_gradients(
                     capped_d_grads, self.gradient_multipliers)
-        apply_d_gradient_op = d_optimizer.apply_gradients(
-            capped_d_grads, global_step=global_step)
-        apply_g_gradient_op = g_optimizer.apply_gradients(
-            capped_g_grads, global_step=global_step)
-        self.train_op_d = control_flow_ops.with_dependencies(
-            [apply_d_gradient_op], self.d_losses[-1])
-        self.train_op_g = control_flow_ops.with_dependencies(
-            [apply_g_gradient_op], self.g_losses[-1])
+        if self.fused_gan_step:
+            # both gradients read the variables before any update, then D is updated before G
+            grads = [g for g, _ in capped_d_grads + capped_g_grads if g is not None]
+            with tf.control_dependencies(grads):
+                apply_d_gradient_op = d_optimizer.apply_gradients(
+                    capped_d_grads, global_step=global_step)
+            with tf.control_dependencies([apply_d_gradient_op]):
+                apply_g_gradient_op = g_optimizer.apply_gradients(
+                    capped_g_grads, global_step=global_step)
+            self.train_op = control_flow_ops.with_dependencies(
+                [apply_g_gradient_op], self.d_losses[-1])
+        else:
+            apply_d_gradient_op = d_optimizer.apply_gradients(
+                capped_d_grads, global_step=global_step)
+            apply_g_gradient_op = g_optimizer.apply_gradients(
+                capped_g_grads, global_step=global_step)
+            self.train_op_d = control_flow_ops.with_dependencies(
+                [apply_d_gradient_op], self.d_losses[-1])
+            self.train_op_g = control_flow_ops.with_dependencies(
+                [apply_g_gradient_op], self.g_losses[-1])
 
 
 def _load_variables(sess, saver, weights_from):
@@ -0,0 +1,155 @@
+"""Local multi-process clusters.
+
+`LocalCluster` runs the parameter server and worker tasks of a distributed job as processes on
+localhost, with a cluster spec of free local ports, e.g. to test or benchmark
+`DistSupervisedTrainer` on one machine; see `tefla/dist_benchmark.py`. The tasks are started as
+new python processes (not forked) as a tensorflow runtime does not survive a fork.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import os
+import socket
+import subprocess
+import time
+
+logger = logging.getLogger('tefla')
+
+
+def free_ports(num_ports, host='localhost'):
+    """Returns `num_ports` distinct ports that are free on `host`"""
+    sockets = []
+    try:
+        for _ in range(num_ports):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind((host, 0))
+            sockets.append(s)
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def local_cluster_spec(num_workers, num_ps=1, host='localhost'):
+    """Returns a cluster spec dict of `num_ps` ps and `num_workers` worker tasks on `host`
+
+    Use it as `tf.train.ClusterSpec(local_cluster_spec(...))`.
+    """
+    ports = free_ports(num_ps + num_workers, host)
+    return {'ps': ['%s:%d' % (host, p) for p in ports[:num_ps]],
+            'worker': ['%s:%d' % (host, p) for p in ports[num_ps:]]}
+
+
+class LocalCluster(object):
+    """Runs the tasks of a cluster as local processes
+
+    Args:
+        num_workers: a int, number of worker tasks
+        num_ps: a int, number of parameter server tasks
+        task_command: a function (job_name, task_index, cluster_spec) returning the command line
+            of a task, a list of args
+        log_dir: directory of the task logs, `<job_name>-<task_index>.log`
+        env: a dict, extra environment variables of the tasks
+    """
+
+    def __init__(self, num_workers, num_ps, task_command, log_dir, env=None):
+        self.num_workers = num_workers
+        self.num_ps = num_ps
+        self.task_command = task_command
+        self.log_dir = log_dir
+        self.env = env or {}
+        self.cluster_spec = local_cluster_spec(num_workers, num_ps)
+        self._tasks = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def log_file(self, job_name, task_index):
+        return os.path.join(self.log_dir, '%s-%d.log' % (job_name, task_index))
+
+    def start(self):
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        env = dict(os.environ, **self.env)
+        for job_name, num_tasks in (('ps', self.num_ps), ('worker', self.num_workers)):
+            for task_index in range(num_tasks):
+                log = open(self.log_file(job_name, task_index), 'w')
+                process = subprocess.Popen(self.task_command(job_name, task_index, self.cluster_spec),
+                                           stdout=log, stderr=subprocess.STDOUT, env=env)
+                self._tasks[(job_name, task_index)] = (process, log)
+        logger.info('Started %d ps and %d worker tasks: %s' % (self.num_ps, self.num_workers, self.cluster_spec))
+
+    def log_tail(self, job_name, task_index, num_lines=20):
+        with open(self.log_file(job_name, task_index)) as f:
+            return ''.join(f.readlines()[-num_lines:])
+
+    def wait(self, job_name='worker', task_index=None, timeout=None):
+        """Waits for the tasks of a job to exit
+
+        Args:
+            job_name: `worker` or `ps`
+            task_index: a int, wait for this task only, all the tasks of the job if None
+            timeout: max seconds to wait, no limit if None
+
+        Raises:
+            RuntimeError: if a task exits with an error or the timeout expires
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for (job, index), (process, _) in sorted(self._tasks.items()):
+            if job != job_name or (task_index is not None and index != task_index):
+                continue
+            while process.poll() is None:
+                if deadline is not None and time.time() > deadline:
+                    raise RuntimeError('Task %s:%d did not finish in %.0fs' % (job, index, timeout))
+                time.sleep(0.1)
+            if process.returncode != 0:
+                raise RuntimeError('Task %s:%d failed with exit code %d:\n%s' %
+                                   (job, index, process.returncode, self.log_tail(job, index)))
+
+    def stop(self, grace_secs=5.0):
+        """Terminates the running tasks, e.g. the ps tasks which never exit"""
+        for process, _ in self._tasks.values():
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.time() + grace_secs
+        for process, log in self._tasks.values():
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            log.close()
+        self._tasks = {}
+
+
+def scaling_efficiency(throughputs):
+    """Computes the scaling of the throughput with the number of workers
+
+    Args:
+        throughputs: a dict, number of workers to examples per second
+
+    Returns:
+        a list of dicts sorted by number of workers, with the keys `num_workers`,
+        `examples_per_sec`, `speedup` and `efficiency` (speedup per added worker, 1.0 is linear
+        scaling), relative to the smallest number of workers
+    """
+    base_workers = min(throughputs)
+    base = throughputs[base_workers]
+    rows = []
+    for num_workers in sorted(throughputs):
+        speedup = throughputs[num_workers] / base if base > 0 else 0.0
+        rows.append({'num_workers': num_workers, 'examples_per_sec': throughputs[num_workers], 'speedup': speedup,
+                     'efficiency': speedup * base_workers / num_workers})
+    return rows
+
+
+def format_scaling_table(rows):
+    lines = ['%8s %16s %8s %11s' % ('workers', 'examples/sec', 'speedup', 'efficiency')]
+    for r in rows:
+        lines.append('%8d %16.1f %7.2fx %10.1f%%' % (r['num_workers'], r['examples_per_sec'], r['speedup'],
+                                                    100.0 * r['efficiency']))
+    return '\n'.join(lines)
@@ -165,6 +165,26 @@ def cross_entropy_loss(logits, labels, label_smoothing=0.0, weight=1.0, name='cr
         return loss
 
 
+def distillation_loss(logits, teacher_logits, temperature=4.0, name='distillation_loss'):
+    """Define a knowledge distillation loss, per example.
+    Args:
+        logits: 2D tensor, [batch_size, num_classes] logits of the student network.
+        teacher_logits: 2D tensor, [batch_size, num_classes] logits of the teacher, e.g. the log
+            of the ensembled teacher probabilities.
+        temperature: a float, softmax temperature of the soft targets, higher values give softer
+            targets.
+        name: Optional scope/name for op_scope.
+    Returns:
+        A 1D tensor, the KL divergence of the student softmax from the teacher softmax at
+        `temperature`, scaled by `temperature ** 2` to keep the gradient scale of the hard loss.
+    """
+    with tf.name_scope(name):
+        teacher_log_probs = log_prob_from_logits(teacher_logits / temperature)
+        student_log_probs = log_prob_from_logits(logits / temperature)
+        kl = tf.reduce_sum(tf.exp(teacher_log_probs) * (teacher_log_probs - student_log_probs), 1)
+        return tf.mul(kl, temperature ** 2, name='value')
+
+
 def l1_l2_regularizer(var, weight_l1=1.0, weight_l2=1.0, name='l1_l2_regularizer'):
     """Define a L2Loss, useful for regularize, i.e. weight decay.
     Args:
@@ -0,0 +1,239 @@
+"""Static cost model of a tefla model graph.
+
+Walks the ops of a built model graph and computes, per layer, the number of
+trainable parameters, the multiply-accumulates of the conv/matmul ops and the
+bytes of the activations, using the static shapes only (no session is run).
+A layer is the variable scope of a tefla layer, e.g. `squeezenet/fire2/squeeze`;
+the nested batch norm and prelu scopes are counted in their parent layer and the
+ops without variables (pooling, concat, ...) are grouped by their name scope.
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import os
+from collections import OrderedDict
+
+import tensorflow as tf
+
+from tefla.core.layer_arg_ops import common_layer_args
+from tefla.core.layers import input
+
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    from inspect import getargspec
+
+_SKIP_OP_TYPES = frozenset(['Const', 'Variable', 'VariableV2', 'Assign', 'NoOp', 'RestoreV2', 'SaveV2'])
+_SKIP_NAME_PARTS = ('/Initializer/', '/Regularizer/')
+
+
+def build_model(model_def, model_fn='model', batch_size=None, crop_size=None, is_training=False, reuse=None,
+                **model_kwargs):
+    """Builds a model from a `models/*.py` module in the default graph
+
+    The models which take the `inputs` tensor as first arg (e.g. `resnet_v1_50`)
+    get an input layer of shape [batch_size, crop height, crop width, 3]; the
+    other ones create their own input layer from the module `crop_size`.
+
+    Args:
+        model_def: the model module
+        model_fn: name of the model function in the module
+        batch_size: batch size of the input layer, None for a variable batch size
+        crop_size: a tuple, (width, height) of the input, defaults to the module crop_size;
+            required for the modules without one, e.g. `resnet_v1`
+        is_training: a bool, training or prediction graph
+        reuse: reuse the variables
+        model_kwargs: extra args of the model function, e.g. `num_classes` of the resnets
+
+    Returns:
+        the model end_points, a dict
+
+    Raises:
+        ValueError: if no crop size is given and the module has none
+    """
+    module_crop_size = getattr(model_def, 'crop_size', None)
+    crop_size = crop_size or module_crop_size
+    if crop_size is None:
+        raise ValueError('No crop size given for %s, and %s has no module crop_size' % (
+            model_fn, model_def.__name__))
+    crop_size = tuple(crop_size)
+    fn = getattr(model_def, model_fn)
+    try:
+        # the models read the module level crop_size when they build the input layer
+        model_def.crop_size = crop_size
+        if getargspec(fn).args[:1] == ['inputs']:
+            inputs = input((batch_size, crop_size[1], crop_size[0], 3),
+                           **common_layer_args(is_training, reuse))
+            end_points = fn(inputs, is_training=is_training, reuse=reuse, **model_kwargs)
+        else:
+            end_points = fn(is_training=is_training, reuse=reuse, **model_kwargs)
+    finally:
+        if module_crop_size is None:
+            del model_def.crop_size
+        else:
+            model_def.crop_size = module_crop_size
+    return end_points
+
+
+def _shape(tensor, batch_size):
+    shape = tensor.get_shape()
+    if shape.ndims is None:
+        return None
+    dims = shape.as_list()
+    if dims and dims[0] is None:
+        dims[0] = batch_size
+    if any(d is None for d in dims):
+        return None
+    return dims
+
+
+def _num_elements(shape):
+    n = 1
+    for d in shape:
+        n *= d
+    return n
+
+
+def op_macs(op, batch_size):
+    """Returns the multiply-accumulates of an op, 0 for the ops not counted
+
+    Args:
+        op: a `tf.Operation`
+        batch_size: used for the unknown batch dimension
+
+    Returns:
+        a int, number of multiply-accumulates
+    """
+    if op.type in ('Conv2D', 'DepthwiseConv2dNative', 'MatMul', 'Conv2DBackpropInput'):
+        out_shape = _shape(op.outputs[0], batch_size)
+        if op.type == 'Conv2DBackpropInput':
+            in_shape = _shape(op.inputs[2], batch_size)
+            w_shape = _shape(op.inputs[1], batch_size)
+        else:
+            in_shape = _shape(op.inputs[0], batch_size)
+            w_shape = _shape(op.inputs[1], batch_size)
+        if out_shape is None or in_shape is None or w_shape is None:
+            return 0
+        if op.type == 'Conv2D':
+            return _num_elements(out_shape) * w_shape[0] * w_shape[1] * w_shape[2]
+        if op.type == 'DepthwiseConv2dNative':
+            return _num_elements(out_shape) * w_shape[0] * w_shape[1]
+        if op.type == 'Conv2DBackpropInput':
+            return _num_elements(in_shape) * w_shape[0] * w_shape[1] * w_shape[2]
+        k = in_shape[0] if op.get_attr('transpose_a') else in_shape[1]
+        return _num_elements(out_shape) * k
+    return 0
+
+
+def _layer_scopes(variables):
+    scopes = set(os.path.dirname(v.op.name) for v in variables)
+    return sorted((s for s in scopes if s and not any(s.startswith(p + '/') for p in scopes)),
+                  key=len, reverse=True)
+
+
+def _layer_of(name, scopes):
+    for scope in scopes:
+        if name.startswith(scope + '/'):
+            return scope
+    return os.path.dirname(name) or name
+
+
+def _skip_op(op):
+    if op.type in _SKIP_OP_TYPES or op.name.endswith('/read') or op.name.startswith('save/'):
+        return True
+    return any(s in op.name for s in _SKIP_NAME_PARTS)
+
+
+def layer_costs(graph=None, batch_size=1):
+    """Computes the per layer costs of a model graph
+
+    Args:
+        graph: a `tf.Graph`, defaults to the default graph
+        batch_size: used for the unknown batch dimension
+
+    Returns:
+        a list of dicts, one per layer in graph order, with keys `name`, `params`,
+        `param_bytes`, `macs`, `activation_bytes`, `output_shape` and `num_ops`
+    """
+    graph = graph or tf.get_default_graph()
+    with graph.as_default():
+        trainable = tf.trainable_variables()
+        all_variables = tf.global_variables()
+    scopes = _layer_scopes(trainable)
+    layers = OrderedDict()
+
+    def get_layer(name):
+        if name not in layers:
+            layers[name] = {'name': name, 'params': 0, 'param_bytes': 0, 'macs': 0,
+                            'activation_bytes': 0, 'output_shape': None, 'num_ops': 0}
+        return layers[name]
+
+    trainable_names = set(v.op.name for v in trainable)
+    for op in graph.get_operations():
+        if _skip_op(op):
+            continue
+        layer = get_layer(_layer_of(op.name, scopes))
+        layer['num_ops'] += 1
+        layer['macs'] += op_macs(op, batch_size)
+        for t in op.outputs:
+            shape = _shape(t, batch_size)
+            if shape is None or not t.dtype.is_floating:
+                continue
+            layer['activation_bytes'] += _num_elements(shape) * t.dtype.size
+            layer['output_shape'] = shape
+    for v in all_variables:
+        shape = v.get_shape().as_list()
+        layer = get_layer(_layer_of(v.op.name, scopes))
+        layer['param_bytes'] += _num_elements(shape) * v.dtype.base_dtype.size
+        if v.op.name in trainable_names:
+            layer['params'] += _num_elements(shape)
+    return list(layers.values())
+
+
+def cost_totals(costs):
+    return {
+        'params': sum(c['params'] for c in costs),
+        'param_bytes': sum(c['param_bytes'] for c in costs),
+        'macs': sum(c['macs'] for c in costs),
+        'activation_bytes': sum(c['activation_bytes'] for c in costs),
+    }
+
+
+def format_cost_table(costs, sort_by='macs', top=None):
+    """Formats the layer costs as a text table sorted by `sort_by`
+
+    Args:
+        costs: the `layer_costs` output
+        sort_by: one of `macs`, `params`, `activation_bytes`
+        top: number of layers to show, all if None
+
+    Returns:
+        a string
+    """
+    totals = cost_totals(costs)
+    rows = sorted(costs, key=lambda c: c[sort_by], reverse=True)[:top]
+    lines = ['%-60s %12s %14s %8s %12s %8s  %s' % ('layer', 'params', 'MACs', 'MACs %', 'act MB', 'act %',
+                                                  'output shape')]
+    for c in rows:
+        lines.append('%-60s %12d %14d %7.2f%% %12.2f %7.2f%%  %s' % (
+            c['name'][-60:], c['params'], c['macs'], 100.0 * c['macs'] / max(totals['macs'], 1),
+            c['activation_bytes'] / 2 ** 20, 100.0 * c['activation_bytes'] / max(totals['activation_bytes'], 1),
+            c['output_shape']))
+    lines.append('%-60s %12d %14d %8s %12.2f %8s' % ('total', totals['params'], totals['macs'], '',
+                                                     totals['activation_bytes'] / 2 ** 20, ''))
+    return '\n'.join(lines)
+
+
+def write_cost_report(filename, costs, **info):
+    """Writes the layer costs and totals as json
+
+    Args:
+        filename: output json file
+        costs: the `layer_costs` output
+        info: extra fields of the report, e.g. model, batch_size, crop_size
+    """
+    report = dict(info)
+    report['totals'] = cost_totals(costs)
+    report['layers'] = costs
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -4,6 +4,8 @@ import time
 from scipy.stats.mstats import gmean
 import numpy as np
 import tensorflow as tf
+from tefla.core.session_config import create_session_config
+from tefla.core.step_profiler import StepProfiler
 from tefla.da import tta
 from tefla.utils import util
 
@@ -15,18 +17,14 @@ class PredictSessionMixin(object):
     Args:
         weights_from: path to the weights file
         gpu_memory_fraction: fraction of gpu memory to use, if not cpu prediction
+        cnf: prediction configs, used for the session thread pools and devices
     """
 
-    def __init__(self, weights_from, gpu_memory_fraction=None):
+    def __init__(self, weights_from, gpu_memory_fraction=None, cnf=None):
         self.weights_from = weights_from
         self.graph = tf.Graph()
-        if gpu_memory_fraction is not None:
-            gpu_options = tf.GPUOptions(
-                per_process_gpu_memory_fraction=gpu_memory_fraction)
-            self.sess = tf.Session(graph=self.graph,
-                                   config=tf.ConfigProto(gpu_options=gpu_options))
-        else:
-            self.sess = tf.Session(graph=self.graph, config=tf.ConfigProto())
+        self.sess = tf.Session(graph=self.graph,
+                               config=create_session_config(cnf, gpu_memory_fraction))
 
     def predict(self, X):
         with self.graph.as_default():
@@ -48,13 +46,17 @@ class OneCropPredictor(PredictSessionMixin):
         weights_from: location of the model weights file
         prediction_iterator: iterator to access and augment the data for prediction
         gpu_memory_fraction: fraction of gpu memory to use, if not cpu prediction
+
+    The prediction batches in `cnf['profile_steps']`, counted from 1 over all the `predict`
+    calls, are traced into `cnf['profile_dir']`, see `StepProfiler`.
     """
 
     def __init__(self, model, cnf, weights_from, prediction_iterator):
         self.model = model
         self.cnf = cnf
         self.prediction_iterator = prediction_iterator
-        super(OneCropPredictor, self).__init__(weights_from)
+        self.num_batches = 0
+        super(OneCropPredictor, self).__init__(weights_from, cnf=cnf)
         with self.graph.as_default():
             self._build_model()
             saver = tf.train.Saver()
@@ -65,14 +67,17 @@ class OneCropPredictor(PredictSessionMixin):
         end_points_predict = self.model(is_training=False, reuse=None)
         self.inputs = end_points_predict['inputs']
         self.predictions = end_points_predict['predictions']
+        self.profiler = StepProfiler.from_cnf(self.cnf, end_points=end_points_predict, graph=self.graph,
+                                              name='prediction')
 
     def _real_predict(self, X, xform=None, crop_bbox=None):
         tic = time.time()
         print('Making %d predictions' % len(X))
         data_predictions = []
         for X, y in self.prediction_iterator(X, xform=xform, crop_bbox=crop_bbox):
-            predictions_e = self.sess.run(
-                self.predictions, feed_dict={self.inputs: X})
+            self.num_batches += 1
+            predictions_e = self.profiler.run(
+                self.sess, self.predictions, feed_dict={self.inputs: X}, step=self.num_batches)
             data_predictions.append(predictions_e)
         data_predictions = np.vstack(data_predictions)
         print('took %6.1f seconds' % (time.time() - tic))
@@ -98,7 +103,7 @@ class QuasiPredictor(PredictSessionMixin):
         self.prediction_iterator = prediction_iterator
         self.predictor = OneCropPredictor(
             model, cnf, weights_from, prediction_iterator)
-        super(QuasiPredictor, self).__init__(weights_from)
+        super(QuasiPredictor, self).__init__(weights_from, cnf=cnf)
 
     def _real_predict(self, X):
         standardizer = self.prediction_iterator.standardizer
@@ -117,6 +122,72 @@ class QuasiPredictor(PredictSessionMixin):
         return np.mean(multiple_predictions, axis=0)
 
 
+class AdaptiveQuasiPredictor(QuasiPredictor):
+    """Quasi transform predictor with per image early stopping
+
+    Runs the quasi random transforms in rounds of `round_size` and keeps the
+    running mean and variance of the predictions of every image. After a round,
+    an image with at least `min_transforms` predictions whose standard error of
+    the mean, sqrt(variance / count), is below `tolerance` for every class is
+    dropped from the later rounds. The returned predictions are the running
+    means: `tolerance` bounds the estimated standard deviation of the mean of a
+    stopped image around the mean over all the transforms, it is an estimate
+    from the transforms seen so far, not a hard bound on the difference.
+
+    Args:
+        model: model definition file
+        cnf: prediction configs
+        weights_from: location of the model weights file
+        prediction_iterator: iterator to access and augment the data for prediction
+        number_of_transforms: max number of determinastic augmentaions to be performed on the input data
+        tolerance: a float, max standard error of the mean prediction for an image to be stopped
+        round_size: a int, number of transforms per round
+        min_transforms: a int, minimum number of transforms to run for every image
+    """
+
+    def __init__(self, model, cnf, weights_from, prediction_iterator, number_of_transforms, tolerance=0.01,
+                 round_size=2, min_transforms=4):
+        if number_of_transforms < 1:
+            raise ValueError('number_of_transforms must be at least 1, got %d' % number_of_transforms)
+        self.tolerance = tolerance
+        self.round_size = round_size
+        self.min_transforms = min_transforms
+        self.average_transforms = None
+        super(AdaptiveQuasiPredictor, self).__init__(
+            model, cnf, weights_from, prediction_iterator, number_of_transforms)
+
+    def _real_predict(self, X):
+        standardizer = self.prediction_iterator.standardizer
+        da_params = standardizer.da_processing_params()
+        util.veryify_args(da_params, [
+                          'sigma'], 'AdaptiveQuasiPredictor > standardizer does unknown da with param(s):')
+        color_sigma = da_params.get('sigma', 0.0)
+        tfs, color_vecs = tta.build_quasirandom_transforms(self.number_of_transforms, color_sigma=color_sigma,
+                                                           **self.cnf['aug_params'])
+        X = np.asarray(X)
+        active = np.arange(len(X))
+        stats = None
+        for start in range(0, len(tfs), self.round_size):
+            if len(active) == 0:
+                break
+            round_xforms = zip(tfs[start:start + self.round_size], color_vecs[start:start + self.round_size])
+            for i, (xform, color_vec) in enumerate(round_xforms, start=start + 1):
+                print('Adaptive quasi-random tta iteration: %d, images: %d' % (i, len(active)))
+                standardizer.set_tta_args(color_vec=color_vec)
+                predictions = self.predictor._real_predict(X[active], xform=xform)
+                if stats is None:
+                    stats = tta.RunningTTAStats(len(X), predictions.shape[1])
+                stats.update(active, predictions)
+            standard_error = stats.standard_error[active].max(axis=1)
+            converged = (standard_error < self.tolerance) & (stats.count[active] >= max(self.min_transforms, 2))
+            active = active[~converged]
+
+        self.average_transforms = stats.count.mean()
+        print('Adaptive tta: %.2f transforms per image on average (max %d)' %
+              (self.average_transforms, self.number_of_transforms))
+        return stats.mean.astype(np.float32)
+
+
 class CropPredictor(PredictSessionMixin):
     """Multiples non Data augmented crops predictor
 
@@ -138,7 +209,7 @@ class CropPredictor(PredictSessionMixin):
         self.prediction_iterator = prediction_iterator
         self.predictor = OneCropPredictor(
             model, cnf, weights_from, prediction_iterator)
-        super(CropPredictor, self).__init__(weights_from)
+        super(CropPredictor, self).__init__(weights_from, cnf=cnf)
 
     def _real_predict(self, X):
         crop_size = np.array(self.crop_size)
@@ -4,6 +4,7 @@ import time
 from scipy.stats.mstats import gmean
 import numpy as np
 import tensorflow as tf
+from tefla.core.session_config import create_session_config
 from tefla.da import tta
 from tefla.utils import util
 
@@ -15,17 +16,13 @@ class PredictSessionMixin(object):
     Args:
         weights_from: path to the weights file
         gpu_memory_fraction: fraction of gpu memory to use, if not cpu prediction
+        cnf: prediction configs, used for the session thread pools and devices
     """
 
-    def __init__(self, graph, gpu_memory_fraction=None):
+    def __init__(self, graph, gpu_memory_fraction=None, cnf=None):
         self.graph = graph
-        if gpu_memory_fraction is not None:
-            gpu_options = tf.GPUOptions(
-                per_process_gpu_memory_fraction=gpu_memory_fraction)
-            self.sess = tf.Session(graph=self.graph,
-                                   config=tf.ConfigProto(gpu_options=gpu_options))
-        else:
-            self.sess = tf.Session(graph=self.graph, config=tf.ConfigProto())
+        self.sess = tf.Session(graph=self.graph,
+                               config=create_session_config(cnf, gpu_memory_fraction))
 
     def predict(self, X):
         with self.graph.as_default():
@@ -0,0 +1,120 @@
+"""Prefetching of the iterator batches into the graph.
+
+With `feed_dict` every training step waits for the host to copy the batch into the session.
+`PrefetchQueue` runs a background thread that enqueues the iterator batches into a bounded
+`tf.FIFOQueue` while the previous steps run. The model reads the dequeued tensors through
+`layers.input_default` and `tf.placeholder_with_default`, so feeding the placeholders, e.g. for
+validation, still works.
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+class PrefetchQueue(object):
+    """Bounded queue of batches fed by a background thread
+
+    Args:
+        capacity: a int, max number of batches in the queue
+        dtypes: list of the `tf.DType` of the batch items, e.g. [tf.float32, tf.int32]
+        shapes: list of the shapes of the batch items, with None batch size, or None if unknown
+        name: an optional name of the ops
+    """
+
+    def __init__(self, capacity, dtypes, shapes, name='prefetch_queue'):
+        self.capacity = capacity
+        with tf.name_scope(name):
+            self._placeholders = [tf.placeholder(dtype, shape=shape) for dtype, shape in zip(dtypes, shapes)]
+            self._queue = tf.FIFOQueue(capacity, dtypes)
+            self._enqueue_op = self._queue.enqueue(self._placeholders)
+            self._close_op = self._queue.close(cancel_pending_enqueues=True)
+            outputs = self._queue.dequeue()
+        if not isinstance(outputs, (list, tuple)):
+            outputs = [outputs]
+        for output, shape in zip(outputs, shapes):
+            output.set_shape(shape)
+        self.outputs = list(outputs)
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._occupancy = []
+        self._wait_seconds = 0.0
+        self._enqueue_seconds = 0.0
+
+    def iterate(self, sess, batches):
+        """Feeds `batches` to the queue from a background thread
+
+        Every step run after a yield must dequeue exactly one batch, i.e. fetch ops depending on
+        `outputs` without feeding the placeholders built on them.
+
+        Args:
+            sess: the session
+            batches: an iterable of batches, tuples of arrays matching `dtypes` and `shapes`
+
+        Yields:
+            the batches, once they are in the queue, in the order of the queue
+        """
+        self._reset_stats()
+        pending = collections.deque()
+        condition = threading.Condition()
+        state = {'done': False, 'error': None}
+
+        def feed():
+            try:
+                for batch in batches:
+                    tic = time.time()
+                    sess.run(self._enqueue_op, feed_dict=dict(zip(self._placeholders, batch)))
+                    self._enqueue_seconds += time.time() - tic
+                    with condition:
+                        pending.append(batch)
+                        condition.notify()
+            except Exception as e:
+                state['error'] = e
+            finally:
+                with condition:
+                    state['done'] = True
+                    condition.notify()
+
+        thread = threading.Thread(target=feed, name='prefetch_feeder')
+        thread.daemon = True
+        thread.start()
+        finished = False
+        try:
+            while True:
+                with condition:
+                    ready = len(pending)
+                    tic = time.time()
+                    while not pending and not state['done']:
+                        condition.wait()
+                    self._wait_seconds += time.time() - tic
+                    if not pending:
+                        break
+                    self._occupancy.append(ready)
+                    batch = pending.popleft()
+                yield batch
+            if state['error'] is not None:
+                raise state['error']
+            finished = True
+        finally:
+            if not finished:
+                # the consumer stopped early, unblock the feeder
+                sess.run(self._close_op)
+            thread.join()
+
+    def stats(self):
+        """Returns the queue statistics of the last `iterate`
+
+        Returns:
+            a dict, `occupancy` mean fraction of the capacity filled before a step, `empty` fraction
+            of the steps that found the queue empty, i.e. were input bound, `wait_seconds` time the
+            steps waited for a batch and `enqueue_seconds` time the feeder spent in enqueue
+            (blocked on a full queue or copying)
+        """
+        occupancy = np.array(self._occupancy or [0], dtype=np.float32)
+        return {'occupancy': float(occupancy.mean() / self.capacity), 'empty': float(np.mean(occupancy == 0)),
+                'wait_seconds': self._wait_seconds, 'enqueue_seconds': self._enqueue_seconds}
@@ -0,0 +1,173 @@
+"""Activation recomputation (gradient checkpointing).
+
+The backprop of a deep model keeps every forward activation alive until its gradient is
+computed, the activation memory grows with the depth and limits the batch size. With
+`gradients` only the activations at a few checkpoint tensors, e.g. the outputs of the resnet
+units, are kept: the backprop runs segment by segment, from the last checkpoint to the first,
+and the forward ops of a segment are copied and recomputed from its input checkpoint when the
+gradient of its output is available. The memory of the activations goes from O(n) to
+O(checkpoints + largest segment), for about one more forward pass.
+
+The models mark their checkpoint candidates with `mark_checkpoint`, e.g. the units and blocks
+of `resnet_utils.stack_blocks_dense`, and a policy selects the checkpoints among them:
+
+    units: every unit output
+    blocks: every block output
+    sqrt: every ceil(sqrt(n)) unit output, of n units
+    k (a int): every k-th unit output
+
+The random ops, e.g. dropout masks, are not recomputed, their outputs are kept. The batch norm
+moving averages are updated once, by the forward pass.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import math
+import numbers
+
+import tensorflow as tf
+from tensorflow.contrib import graph_editor as ge
+
+logger = logging.getLogger('tefla')
+
+UNIT_CHECKPOINTS = 'recompute_unit_checkpoints'
+BLOCK_CHECKPOINTS = 'recompute_block_checkpoints'
+POLICIES = ('units', 'blocks', 'sqrt')
+
+_RANDOM_OP_TYPES = ('RandomUniform', 'RandomUniformInt', 'RandomStandardNormal', 'TruncatedNormal',
+                    'RandomShuffle', 'RandomGamma', 'Multinomial')
+
+
+def mark_checkpoint(tensor, collection=UNIT_CHECKPOINTS):
+    """Marks a tensor as a checkpoint candidate, returns it"""
+    tf.add_to_collection(collection, tensor)
+    return tensor
+
+
+def select_checkpoints(policy, ys, graph=None):
+    """Selects the checkpoints of the backprop of `ys` among the marked tensors
+
+    Args:
+        policy: one of `POLICIES` or a int, see the module doc
+        ys: a list of tensors, e.g. [loss], the candidates which are not ancestors of `ys`
+            (e.g. of the validation model or of an other tower) are left out
+        graph: a `tf.Graph`, defaults to the default graph
+
+    Returns:
+        a list of tensors, in forward order
+    """
+    graph = graph or tf.get_default_graph()
+    collection = BLOCK_CHECKPOINTS if policy == 'blocks' else UNIT_CHECKPOINTS
+    ancestors = set(ge.get_backward_walk_ops([y.op for y in ys], inclusive=True))
+    candidates = _unique([t for t in graph.get_collection(collection) if t.op in ancestors])
+    if policy in ('units', 'blocks'):
+        return candidates
+    if policy == 'sqrt':
+        every = max(int(math.ceil(math.sqrt(len(candidates)))), 1)
+    elif isinstance(policy, numbers.Integral) and policy > 0:
+        every = policy
+    else:
+        raise ValueError('Unknown checkpoint policy: %s, use one of %s or a int' % (policy, POLICIES))
+    return candidates[every - 1::every]
+
+
+def _unique(tensors):
+    # a tensor marked twice is one checkpoint, the first order is kept
+    seen = set()
+    unique = []
+    for t in tensors:
+        if t not in seen:
+            seen.add(t)
+            unique.append(t)
+    return unique
+
+
+def _segment_gradients(start, targets, target_grads, xs):
+    # the forward ops from `start` to `targets`, recomputed from a copy of `start` without gradient
+    segment = set(ge.get_forward_walk_ops(start.consumers(), inclusive=True))
+    segment.intersection_update(ge.get_backward_walk_ops([t.op for t in targets], inclusive=True))
+    segment = [op for op in segment if op.type not in _RANDOM_OP_TYPES]
+    start_copy = tf.stop_gradient(start)
+    _, info = ge.copy_with_input_replacements(ge.sgv(segment), {start: start_copy})
+    segment = set(segment)
+    copied_ops = [info.transformed(op) for op in segment]
+    copied_set = set(copied_ops)
+    # the recomputation waits for the gradients of the segment outputs
+    wait_for = [g.op for g in target_grads if g is not None]
+    for op in copied_ops:
+        if not any(t.op in copied_set for t in op.inputs):
+            ge.add_control_inputs(op, wait_for)
+    copied_targets = [info.transformed(t) if t.op in segment else t for t in targets]
+    grads = tf.gradients(copied_targets, [start_copy] + xs, grad_ys=target_grads)
+    return grads[0], grads[1:]
+
+
+def _sum_gradients(grads):
+    grads = [g for g in grads if g is not None]
+    if not grads:
+        return None
+    if len(grads) == 1:
+        return grads[0]
+    return tf.add_n([tf.convert_to_tensor(g) for g in grads])
+
+
+def gradients(ys, xs, checkpoints, grad_ys=None):
+    """Same as `tf.gradients`, keeping only the activations of the checkpoints
+
+    Args:
+        ys: a list of tensors to differentiate
+        xs: a list of tensors or variables
+        checkpoints: a list of tensors, ancestors of `ys`, in forward order, see
+            `select_checkpoints`; plain `tf.gradients` if empty. A checkpoint which is not an
+            ancestor of the next one, e.g. on a side branch joining later, is skipped: its
+            gradient flows through the kept activations of the later segment
+        grad_ys: a list of the gradients of `ys`, ones if None
+
+    Returns:
+        a list, the gradient of each of `xs`, None for the ones `ys` do not depend on
+
+    Raises:
+        ValueError: if no gradient flows from `ys` to a checkpoint
+    """
+    ys = list(ys)
+    xs = list(xs)
+    checkpoints = _unique(checkpoints)
+    if not checkpoints:
+        return tf.gradients(ys, xs, grad_ys=grad_ys)
+    targets = ys
+    target_grads = list(grad_ys) if grad_ys is not None else [tf.ones_like(y) for y in ys]
+    xs_grads = [[] for _ in xs]
+    for start in reversed(checkpoints):
+        if start.op not in ge.get_backward_walk_ops([t.op for t in targets], inclusive=False):
+            logger.debug('Checkpoint %s is not an ancestor of %s, skipped' % (start.name, targets[0].name))
+            continue
+        start_grad, grads = _segment_gradients(start, targets, target_grads, xs)
+        if start_grad is None:
+            raise ValueError('No gradient flows to the checkpoint %s' % start.name)
+        for x_grads, g in zip(xs_grads, grads):
+            x_grads.append(g)
+        targets, target_grads = [start], [start_grad]
+    # the first segment, before the first checkpoint, keeps its activations
+    for x_grads, g in zip(xs_grads, tf.gradients(targets, xs, grad_ys=target_grads)):
+        x_grads.append(g)
+    return [_sum_gradients(g) for g in xs_grads]
+
+
+def compute_gradients(loss, var_list=None, policy='sqrt'):
+    """Returns the (gradient, variable) pairs of a loss, with activation recomputation
+
+    A drop-in for `optimizer.compute_gradients(loss, var_list)`.
+
+    Args:
+        loss: the loss tensor
+        var_list: a list of variables, defaults to the trainable variables
+        policy: the checkpoint policy, see `select_checkpoints`
+    """
+    var_list = var_list or tf.trainable_variables()
+    checkpoints = select_checkpoints(policy, [loss])
+    if checkpoints:
+        logger.info('Recomputing the activations between %d checkpoints (%s policy)' % (len(checkpoints), policy))
+    else:
+        logger.warn('No checkpoint for the %s policy, the model marks none, no recomputation' % policy)
+    grads = gradients([loss], var_list, checkpoints)
+    return list(zip(grads, var_list))
@@ -0,0 +1,86 @@
+"""Progressive resolution training.
+
+The early epochs learn the coarse features of the images and train about as well on smaller
+crops, at a fraction of the cost: the step time of a convnet grows with the crop area.
+`ResolutionSchedule` runs the epochs at crop sizes stepping up to the full crop size of the
+model, the training model is built with a variable spatial input (see
+`layers.variable_spatial_input`), so it must be fully convolutional, e.g. end in
+`global_avg_pool`. The batch size is kept, every epoch has the same number of iterations for the
+lr policies. The validation runs at the full crop size.
+
+    cnf['resolution_schedule'] = [(1, 0.5), (10, 0.75), (20, 1.0)]
+
+runs the epochs 1 to 9 at half the crop size, the epochs 10 to 19 at three quarters of it and the
+next ones at the full crop size.
+"""
+from __future__ import division, print_function, absolute_import
+
+import bisect
+import logging
+
+logger = logging.getLogger('tefla')
+
+
+class ResolutionSchedule(object):
+    """Crop size of the training epochs
+
+    Args:
+        steps: a list of (start epoch, scale), scale is a fraction of the full crop size or a
+            (width, height) tuple
+        multiple: a int, the scaled crop sizes are rounded to a multiple of it, e.g. the total
+            stride of the model
+    """
+
+    def __init__(self, steps, multiple=32):
+        if not steps:
+            raise ValueError('A resolution schedule needs at least one step')
+        steps = sorted(steps, key=lambda s: s[0])
+        self.start_epochs = [s[0] for s in steps]
+        self.scales = [s[1] for s in steps]
+        self.multiple = multiple
+        self.full_crop_size = None
+        self._current = None
+
+    @classmethod
+    def from_cnf(cls, cnf):
+        """Creates a schedule from the `resolution_schedule` and `resolution_multiple` configs, None if not set"""
+        if not cnf.get('resolution_schedule'):
+            return None
+        return cls(cnf['resolution_schedule'], cnf.get('resolution_multiple', 32))
+
+    def crop_size(self, epoch, full_crop_size=None):
+        """Returns the (width, height) crop size of an epoch
+
+        Args:
+            epoch: a int, the epoch, from 1
+            full_crop_size: the (width, height) crop size of the model, defaults to the one seen by
+                `apply`
+        """
+        full_crop_size = full_crop_size or self.full_crop_size
+        i = bisect.bisect_right(self.start_epochs, epoch) - 1
+        if i < 0:
+            i = 0
+        scale = self.scales[i]
+        if isinstance(scale, (tuple, list)):
+            return tuple(scale)
+        return tuple(min(max(self.multiple, int(round(s * scale / self.multiple)) * self.multiple), s)
+                     for s in full_crop_size)
+
+    def apply(self, iterator, epoch):
+        """Sets the crop size of an epoch on a training iterator
+
+        Args:
+            iterator: a `DAIterator`, its crop size at the first call is the full crop size
+            epoch: a int, the epoch
+
+        Returns:
+            the (width, height) crop size
+        """
+        if self.full_crop_size is None:
+            self.full_crop_size = (iterator.w, iterator.h)
+        crop_size = self.crop_size(epoch)
+        iterator.set_crop_size(crop_size)
+        if crop_size != self._current:
+            logger.info('Epoch %d: training at crop size %dx%d' % (epoch, crop_size[0], crop_size[1]))
+            self._current = crop_size
+        return crop_size
@@ -0,0 +1,161 @@
+"""Session configuration shared by the trainers and predictors.
+
+All the `tf.Session` instances of tefla are created from `create_session_config`,
+so the thread pools, devices and cpu pinning are configured in one place. The
+settings are read from the training config `cnf` (keys below). The best settings
+recorded by `tefla/autotune.py` for the current host are tuned for one model, they
+are only used, below the `cnf` ones, if the `cnf` sets `session_tuning_file`.
+
+    intra_op_threads: threads used inside a single op, 0 lets tf decide
+    inter_op_threads: threads used to run independent ops, 0 lets tf decide
+    num_cpu_devices: number of cpu devices to expose to tf
+    num_gpu_devices: number of gpu devices to expose to tf
+    da_workers: number of data augmentation worker processes, None for one per core
+    pin_cpus: a bool, pin the da workers and the tf threads to disjoint cpus
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import logging
+import os
+import socket
+
+import tensorflow as tf
+
+# available_cpus and process_cpus are re-exported for the callers of the session settings
+from tefla.utils.cpu_affinity import available_cpus, cpu_split, process_cpus, set_cpu_affinity  # noqa
+
+logger = logging.getLogger('tefla')
+
+DEFAULT_TUNING_FILE = os.path.join(os.path.expanduser('~'), '.tefla', 'session_tuning.json')
+
+_SETTINGS_KEYS = ('intra_op_threads', 'inter_op_threads', 'num_cpu_devices',
+                  'num_gpu_devices', 'da_workers', 'pin_cpus')
+
+_DEFAULT_SETTINGS = {
+    'intra_op_threads': 0,
+    'inter_op_threads': 0,
+    'num_cpu_devices': None,
+    'num_gpu_devices': None,
+    'da_workers': None,
+    'pin_cpus': False,
+}
+
+
+def host_name():
+    return socket.gethostname()
+
+
+def load_tuned_settings(tuning_file=DEFAULT_TUNING_FILE, host=None):
+    """Loads the settings recorded by autotune for a host
+
+    Args:
+        tuning_file: path to the json file written by autotune
+        host: host name, defaults to this host
+
+    Returns:
+        a dict with the recorded settings, empty if nothing is recorded
+    """
+    if not tuning_file or not os.path.exists(tuning_file):
+        return {}
+    with open(tuning_file) as f:
+        records = json.load(f)
+    record = records.get(host or host_name(), {})
+    return dict((k, v) for k, v in record.get('settings', {}).items() if k in _SETTINGS_KEYS)
+
+
+def save_tuned_settings(settings, images_per_sec, model, batch_size, tuning_file=DEFAULT_TUNING_FILE, host=None):
+    """Records the best settings for a host, other hosts records are kept
+
+    Args:
+        settings: a dict, the session settings
+        images_per_sec: a float, throughput measured with `settings`
+        model: name of the model used for tuning
+        batch_size: batch size used for tuning
+        tuning_file: path to the json file
+        host: host name, defaults to this host
+    """
+    records = {}
+    if os.path.exists(tuning_file):
+        with open(tuning_file) as f:
+            records = json.load(f)
+    elif os.path.dirname(tuning_file) and not os.path.exists(os.path.dirname(tuning_file)):
+        os.makedirs(os.path.dirname(tuning_file))
+    records[host or host_name()] = {
+        'settings': settings,
+        'images_per_sec': images_per_sec,
+        'model': model,
+        'batch_size': batch_size,
+        'num_cpus': len(process_cpus()),
+    }
+    with open(tuning_file, 'w') as f:
+        json.dump(records, f, indent=2, sort_keys=True)
+
+
+def session_settings(cnf=None):
+    """Merges the session settings: defaults < host tuning record < cnf
+
+    Args:
+        cnf: training/prediction config dict, the `session_tuning_file` key selects
+            the tuning record file, the records are ignored if it is not set
+
+    Returns:
+        a dict with all the session settings keys
+    """
+    cnf = cnf or {}
+    settings = dict(_DEFAULT_SETTINGS)
+    tuned = load_tuned_settings(cnf.get('session_tuning_file'))
+    if tuned:
+        logger.info('Session settings tuned for this host: %s' % tuned)
+    settings.update(tuned)
+    settings.update(dict((k, cnf[k]) for k in _SETTINGS_KEYS if k in cnf))
+    return settings
+
+
+def da_pool_args(cnf=None):
+    """Returns the `num_workers` and `cpu_affinity` args for the parallel da iterators"""
+    settings = session_settings(cnf)
+    da_cpus = cpu_split(settings['da_workers'])[0] if settings['pin_cpus'] else []
+    return {'num_workers': settings['da_workers'], 'cpu_affinity': da_cpus or None}
+
+
+def create_session_config(cnf=None, gpu_memory_fraction=None, allow_soft_placement=False,
+                          log_device_placement=False, **overrides):
+    """Creates a `tf.ConfigProto` from the session settings
+
+    If `pin_cpus` is set, the calling process is pinned to the cpus left to tf
+    by `cpu_split`, the da workers pin themselves to the other ones. The split
+    is made from the cpus of the process before any pinning, so creating several
+    sessions pins the process to the same cpus.
+
+    Args:
+        cnf: training/prediction config dict
+        gpu_memory_fraction: fraction of gpu memory to use, None for tf default
+        allow_soft_placement: a bool, place ops on cpu if no gpu kernel exists
+        log_device_placement: a bool, log the device of every op
+        overrides: session settings that take precedence over the cnf ones
+
+    Returns:
+        a `tf.ConfigProto`
+    """
+    settings = session_settings(cnf)
+    settings.update(overrides)
+    intra_op_threads = settings['intra_op_threads'] or 0
+    if settings['pin_cpus']:
+        tf_cpus = cpu_split(settings['da_workers'])[1]
+        if set_cpu_affinity(tf_cpus) and not intra_op_threads:
+            intra_op_threads = len(tf_cpus)
+    device_count = {}
+    if settings['num_cpu_devices'] is not None:
+        device_count['CPU'] = settings['num_cpu_devices']
+    if settings['num_gpu_devices'] is not None:
+        device_count['GPU'] = settings['num_gpu_devices']
+    kwargs = {}
+    if gpu_memory_fraction is not None:
+        kwargs['gpu_options'] = tf.GPUOptions(per_process_gpu_memory_fraction=gpu_memory_fraction)
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=settings['inter_op_threads'] or 0,
+                          device_count=device_count,
+                          allow_soft_placement=allow_soft_placement,
+                          log_device_placement=log_device_placement,
+                          **kwargs)
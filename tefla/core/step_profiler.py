@@ -0,0 +1,229 @@
+"""Timeline profiling of selected training or prediction steps.
+
+`StepProfiler` runs the selected steps with full trace run options, writes the timeline of each
+of them as a Chrome trace (open it in chrome://tracing) and rolls the op timings up to the tefla
+layers: the variable scopes of the layers with variables and the name scopes of the model
+`end_points`, i.e. the outputs registered by the layers with `outputs_collections`. The op time
+of a layer is split in forward, backward (the ops under a `gradients` scope) and update (the
+optimizer `update_<variable>` ops) time.
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import tensorflow as tf
+
+logger = logging.getLogger('tefla')
+
+PASSES = ('forward', 'backward', 'update')
+
+
+def layer_scopes(graph=None, end_points=None):
+    """Returns the scopes of the tefla layers of a graph
+
+    Args:
+        graph: a `tf.Graph`, defaults to the default graph
+        end_points: a dict of layer name to output tensor, e.g. the model end_points
+
+    Returns:
+        a list of (scope, layer name), the most nested scopes first
+    """
+    graph = graph or tf.get_default_graph()
+    scopes = {}
+    for v in graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES):
+        scope = os.path.dirname(v.op.name)
+        if scope:
+            scopes[scope] = scope
+    # nested scopes of a layer with variables, e.g. its batch norm, are part of the layer
+    scopes = dict((s, n) for s, n in scopes.items() if not any(s.startswith(p + '/') for p in scopes))
+    for name, tensor in (end_points or {}).items():
+        if not hasattr(tensor, 'op'):
+            continue
+        scope = os.path.dirname(tensor.op.name)
+        if scope and not any(scope == s or scope.startswith(s + '/') for s in scopes):
+            scopes[scope] = name
+    return sorted(scopes.items(), key=lambda s: len(s[0]), reverse=True)
+
+
+def split_op_name(name):
+    """Returns the pass of an op and the name of the forward op or variable it belongs to
+
+    Args:
+        name: an op name, e.g. `gradients/conv1/Conv2D_grad/Conv2DBackpropFilter`
+
+    Returns:
+        a tuple, (one of `PASSES`, op name without the gradient or optimizer scopes), e.g.
+        ('backward', 'conv1/Conv2D_grad/Conv2DBackpropFilter')
+    """
+    parts = name.split(':')[0].split('/')
+    for i, part in enumerate(parts):
+        if part == 'gradients' or part.startswith('gradients_'):
+            return 'backward', '/'.join(parts[:i] + parts[i + 1:])
+        if part.startswith('update_') and i > 0:
+            return 'update', '/'.join(parts[:i - 1] + [part[len('update_'):]] + parts[i + 1:])
+    return 'forward', '/'.join(parts)
+
+
+def layer_of(name, scopes):
+    """Returns the layer name of an op name, or its name scope if it is not in a layer"""
+    for scope, layer in scopes:
+        if name.startswith(scope + '/'):
+            return layer
+    return os.path.dirname(name) or name
+
+
+def _timed_nodes(step_stats):
+    for dev_stats in step_stats.dev_stats:
+        # the per stream devices of a gpu repeat the kernels of `/stream:all`
+        if '/stream:' in dev_stats.device and not dev_stats.device.endswith('/stream:all'):
+            continue
+        if '/memcpy' in dev_stats.device:
+            continue
+        for node_stats in dev_stats.node_stats:
+            if node_stats.node_name in ('_SOURCE', '_SINK'):
+                continue
+            yield node_stats.node_name, node_stats.all_end_rel_micros
+
+
+def layer_times(step_stats, scopes):
+    """Rolls the op times of a step up to the layers
+
+    Args:
+        step_stats: a `StepStats` proto, the `step_stats` of a `tf.RunMetadata`
+        scopes: the `layer_scopes` of the graph
+
+    Returns:
+        an OrderedDict of layer name to a dict of the microseconds per pass, in order of
+        first execution
+    """
+    times = OrderedDict()
+    for node_name, micros in _timed_nodes(step_stats):
+        pass_name, op_name = split_op_name(node_name)
+        layer = layer_of(op_name, scopes)
+        if layer not in times:
+            times[layer] = dict((p, 0) for p in PASSES)
+        times[layer][pass_name] += micros
+    return times
+
+
+def format_layer_times(rows, top=None):
+    """Formats the per layer times as a text table, slowest layers first
+
+    Args:
+        rows: the `StepProfiler.layer_times` output
+        top: number of layers to show, all if None
+
+    Returns:
+        a string
+    """
+    total = sum(r['total'] for r in rows)
+    lines = ['%-60s %12s %12s %12s %12s %8s' % ('layer', 'forward ms', 'backward ms', 'update ms', 'total ms',
+                                                 'total %')]
+    for r in sorted(rows, key=lambda r: r['total'], reverse=True)[:top]:
+        lines.append('%-60s %12.3f %12.3f %12.3f %12.3f %7.2f%%' % (
+            r['name'][-60:], r['forward'], r['backward'], r['update'], r['total'], 100.0 * r['total'] / max(total, 1e-9)))
+    lines.append('%-60s %12.3f %12.3f %12.3f %12.3f' % (
+        'total', sum(r['forward'] for r in rows), sum(r['backward'] for r in rows), sum(r['update'] for r in rows),
+        total))
+    return '\n'.join(lines)
+
+
+class StepProfiler(object):
+    """Traces selected steps of a session loop
+
+    Use `run` in place of `sess.run` in the loop. The selected steps are run with full trace
+    run options; for each of them a Chrome trace `<name>-step-<step>.json` is written to
+    `output_dir`. After the last selected step the per layer times, averaged over the
+    traced steps, are logged and written to `<name>-layer-times.json`; call `close` at the end
+    of the loop to report them if some selected steps were never run.
+
+    Args:
+        output_dir: directory of the trace and report files
+        profile_steps: the steps to trace
+        end_points: the model end_points, to name the layers without variables
+        graph: the traced `tf.Graph`, defaults to the default graph when the first step is traced
+        name: prefix of the output files, e.g. `training` or `prediction`
+    """
+
+    def __init__(self, output_dir, profile_steps=(), end_points=None, graph=None, name='step'):
+        self.output_dir = output_dir
+        self.profile_steps = set(profile_steps or ())
+        self.end_points = end_points
+        self.graph = graph
+        self.name = name
+        self._scopes = None
+        self._times = OrderedDict()
+        self._traced_steps = []
+
+    @classmethod
+    def from_cnf(cls, cnf, end_points=None, graph=None, name='step'):
+        """Creates a profiler from the `profile_steps` and `profile_dir` configs"""
+        cnf = cnf or {}
+        return cls(cnf.get('profile_dir', '/tmp/tefla-profile'), cnf.get('profile_steps', ()), end_points=end_points,
+                   graph=graph, name=name)
+
+    def should_profile(self, step):
+        return step in self.profile_steps and step not in self._traced_steps
+
+    def run(self, sess, fetches, feed_dict=None, step=None):
+        """Same as `sess.run`, tracing the step if it is selected"""
+        if step is None or not self.should_profile(step):
+            return sess.run(fetches, feed_dict=feed_dict)
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        result = sess.run(fetches, feed_dict=feed_dict, options=run_options, run_metadata=run_metadata)
+        self.add_step_stats(run_metadata.step_stats, step, graph=sess.graph)
+        return result
+
+    def add_step_stats(self, step_stats, step, graph=None):
+        """Writes the trace of a step and adds its op times to the layer times"""
+        from tensorflow.python.client import timeline
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        trace_file = os.path.join(self.output_dir, '%s-step-%d.json' % (self.name, step))
+        with open(trace_file, 'w') as f:
+            f.write(timeline.Timeline(step_stats).generate_chrome_trace_format())
+        logger.info('Step %d timeline written to %s' % (step, trace_file))
+
+        if self._scopes is None:
+            self._scopes = layer_scopes(self.graph or graph, self.end_points)
+        for layer, times in layer_times(step_stats, self._scopes).items():
+            layer_total = self._times.setdefault(layer, dict((p, 0) for p in PASSES))
+            for p in PASSES:
+                layer_total[p] += times[p]
+        self._traced_steps.append(step)
+        if not self.profile_steps.difference(self._traced_steps):
+            self.report()
+
+    def close(self):
+        """Reports the traced steps if some selected steps were never run, e.g. past the last step"""
+        if self._traced_steps and self.profile_steps.difference(self._traced_steps):
+            self.report()
+
+    def layer_times(self):
+        """Returns the per layer milliseconds per traced step
+
+        Returns:
+            a list of dicts, one per layer in order of first execution, with the keys `name`,
+            `forward`, `backward`, `update` and `total`
+        """
+        num_steps = max(len(self._traced_steps), 1)
+        rows = []
+        for layer, times in self._times.items():
+            row = dict((p, times[p] / 1000.0 / num_steps) for p in PASSES)
+            row['name'] = layer
+            row['total'] = sum(row[p] for p in PASSES)
+            rows.append(row)
+        return rows
+
+    def report(self, top=None):
+        """Logs the per layer times and writes them as json, returns the json file name"""
+        rows = self.layer_times()
+        logger.info('Per layer times of steps %s:\n%s' % (sorted(self._traced_steps), format_layer_times(rows, top)))
+        report_file = os.path.join(self.output_dir, '%s-layer-times.json' % self.name)
+        with open(report_file, 'w') as f:
+            json.dump({'steps': sorted(self._traced_steps), 'layers': rows}, f, indent=2)
+        return report_file
@@ -7,6 +7,7 @@ import tensorflow as tf
 import os
 
 from tefla.utils.util import rms
+from tefla.core.summary_scheduler import AsyncSummaryWriter
 
 
 __all__ = ['summary_metric', 'summary_activation', 'create_summary_writer',
@@ -65,7 +66,7 @@ def create_summary_writer(summary_dir, sess):
         sess: the session to sun the ops
 
     Returns:
-        training and vaidation summary writter
+        training and vaidation summary writter, `AsyncSummaryWriter`s writing from a background thread
     """
     if not os.path.exists(summary_dir):
         os.mkdir(summary_dir)
@@ -76,7 +77,7 @@ def create_summary_writer(summary_dir, sess):
     train_writer = tf.summary.FileWriter(
         summary_dir + '/train', graph=sess.graph)
     val_writer = tf.summary.FileWriter(summary_dir + '/test', graph=sess.graph)
-    return train_writer, val_writer
+    return AsyncSummaryWriter(train_writer), AsyncSummaryWriter(val_writer)
 
 
 def summary_param(op, tensor, ndims, name, collections=None):
@@ -104,7 +105,7 @@ def summary_param(op, tensor, ndims, name, collections=None):
     }[op]
 
 
-def summary_trainable_params(summary_types, collections=None):
+def summary_trainable_params(summary_types, collections=None, params=None):
     """
     Add summary to all trainable tensors
 
@@ -112,8 +113,10 @@ def summary_trainable_params(summary_types, collections=None):
         summary_type: a list of all sumary types to add
             e.g.: ['scalar', 'histogram', 'sparsity', 'mean', 'rms', 'stddev', 'norm', 'max', 'min']
         collections: training or validation collections
+        params: a list of the variables to add summary to, all trainable variables if None
     """
-    params = tf.trainable_variables()
+    if params is None:
+        params = tf.trainable_variables()
     with tf.name_scope('summary/trainable'):
         for tensor in params:
             name = _formatted_name(tensor)
@@ -0,0 +1,149 @@
+"""Scheduling and asynchronous writing of the training batch summaries.
+
+The merged histogram summaries of the activations, the parameters and the gradients cost as
+much as a training step on deep models, and flushing the event file after every batch blocks
+the training thread on disk. `SummaryScheduler` runs the batch summaries every
+`every_n_steps` steps on a subset of the layers and measures what they cost, and
+`AsyncSummaryWriter` moves the event file writes and flushes to a background thread.
+"""
+from __future__ import division, print_function, absolute_import
+
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+
+
+class SummaryScheduler(object):
+    """Decides which training steps run the batch summaries, and on which layers
+
+    Args:
+        every_n_steps: a int, run the batch summaries every that many steps
+        max_layers: a int, max number of layers (end points, parameters, gradients) with
+            summaries, evenly spaced over the depth of the model; None for all layers
+    """
+
+    def __init__(self, every_n_steps=100, max_layers=None):
+        if every_n_steps < 1:
+            raise ValueError('every_n_steps must be >= 1, got %d' % every_n_steps)
+        self.every_n_steps = every_n_steps
+        self.max_layers = max_layers
+        self.reset()
+
+    @classmethod
+    def from_cnf(cls, cnf):
+        """Creates a scheduler from the `summary_every_steps` and `summary_max_layers` configs"""
+        return cls(cnf.get('summary_every_steps', 100), cnf.get('summary_max_layers'))
+
+    def should_run(self, step):
+        return step % self.every_n_steps == 0
+
+    def sample_layers(self, items):
+        """Returns the subset of `items`, a list in model order, that get summaries"""
+        items = list(items)
+        if self.max_layers is None or len(items) <= self.max_layers:
+            return items
+        if self.max_layers <= 0:
+            return []
+        # keep the first and the last layers, which usually show problems first
+        indices = np.unique(np.round(np.linspace(0, len(items) - 1, self.max_layers)).astype(np.int64))
+        return [items[i] for i in indices]
+
+    def reset(self):
+        self._step_seconds = {True: [], False: []}
+
+    def record_step(self, seconds, with_summary):
+        """Records the duration of a training step, including the summary writes"""
+        self._step_seconds[bool(with_summary)].append(seconds)
+
+    def overhead(self):
+        """Returns the summary overhead as a percentage of the step time since the last `reset`
+
+        The overhead is the extra time of the summary steps over the mean duration of the steps
+        without summaries, None without steps of both kinds.
+        """
+        with_summary, without_summary = self._step_seconds[True], self._step_seconds[False]
+        if not with_summary or not without_summary:
+            return None
+        total = np.sum(with_summary) + np.sum(without_summary)
+        extra = np.sum(with_summary) - len(with_summary) * np.mean(without_summary)
+        return 100.0 * max(extra, 0.0) / total
+
+
+class AsyncSummaryWriter(object):
+    """Writes the summaries of a `tf.summary.FileWriter` from a background thread
+
+    `add_summary` only enqueues the serialized summary. The background thread adds them to the
+    event file and flushes it every `flush_every` summaries or `flush_secs` seconds.
+
+    Args:
+        writer: a `tf.summary.FileWriter`, or any object with `add_summary`, `flush` and `close`
+        flush_every: a int, number of summaries between flushes
+        flush_secs: a float, max seconds between flushes
+        max_pending: a int, max number of summaries waiting to be written, `add_summary`
+            blocks when it is reached; 0 for no limit
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, writer, flush_every=100, flush_secs=30.0, max_pending=1000):
+        self.writer = writer
+        self.flush_every = flush_every
+        self.flush_secs = flush_secs
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='summary_writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        pending = 0
+        last_flush = time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_secs)
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None and item is not self._CLOSE:
+                    self.writer.add_summary(*item)
+                    pending += 1
+                if pending and (item is None or item is self._CLOSE or pending >= self.flush_every or
+                                time.time() - last_flush >= self.flush_secs):
+                    self.writer.flush()
+                    pending = 0
+                    last_flush = time.time()
+            except Exception as e:
+                self._error = e
+            finally:
+                if item is not None:
+                    self._queue.task_done()
+            if item is self._CLOSE:
+                return
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def add_summary(self, summary, global_step=None):
+        self._check_error()
+        self._queue.put((summary, global_step))
+
+    def flush(self):
+        """Blocks until the enqueued summaries are written"""
+        self._queue.join()
+        self.writer.flush()
+        self._check_error()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+        self.writer.close()
+        self._check_error()
@@ -0,0 +1,88 @@
+"""Precomputed teacher logits for distillation.
+
+Running a teacher ensemble at every training step of a student costs more than the student
+itself. The teacher logits of the training files are computed once by `write_teacher_logits` into
+a `.npy` file, one row per file in the order of the training file list (kept next to it in a
+`.files.txt` file), and `TeacherLogits` memory maps it: a batch reads only its rows.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger('tefla')
+
+
+def _files_list(path):
+    return path + '.files.txt'
+
+
+def write_teacher_logits(path, files, predict_fn, chunk_size=1024, eps=1e-7):
+    """Writes the teacher logits of a file list
+
+    Args:
+        path: the `.npy` output file
+        files: the file list, e.g. the `training_X` of a dataset
+        predict_fn: a function returning the class probabilities, [len(files), num_classes], of a
+            list of files, e.g. the `predict` of an `EnsemblePredictor`
+        chunk_size: number of files predicted per `predict_fn` call
+        eps: probability floor before the log
+
+    Returns:
+        the images per second of `predict_fn`
+    """
+    files = list(files)
+    logits = None
+    tic = time.time()
+    for start in range(0, len(files), chunk_size):
+        probs = np.asarray(predict_fn(files[start:start + chunk_size]), dtype=np.float32)
+        if logits is None:
+            logits = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                               shape=(len(files), probs.shape[1]))
+        # the log probabilities are logits of the same softmax
+        logits[start:start + len(probs)] = np.log(np.maximum(probs, eps))
+        logger.info('Teacher logits: %d/%d files' % (min(start + chunk_size, len(files)), len(files)))
+    images_per_sec = len(files) / max(time.time() - tic, 1e-9)
+    if logits is not None:
+        logits.flush()
+        del logits
+    with open(_files_list(path), 'w') as f:
+        f.write('\n'.join(str(fname) for fname in files))
+    return images_per_sec
+
+
+class TeacherLogits(object):
+    """Memory mapped teacher logits of a file list
+
+    Args:
+        path: the `.npy` file written by `write_teacher_logits`
+        files: the training file list, if given it must be the file list of `path`
+    """
+
+    def __init__(self, path, files=None):
+        self.path = path
+        self.logits = np.load(path, mmap_mode='r')
+        with open(_files_list(path)) as f:
+            self.files = f.read().split('\n') if self.logits.shape[0] else []
+        if len(self.files) != self.logits.shape[0]:
+            raise ValueError('%s has %d rows for %d files' % (path, self.logits.shape[0], len(self.files)))
+        self._rows = dict((fname, i) for i, fname in enumerate(self.files))
+        if files is not None:
+            self.check_files(files)
+
+    @property
+    def num_classes(self):
+        return self.logits.shape[1]
+
+    def check_files(self, files):
+        """Raises a ValueError if a file has no teacher logits"""
+        missing = [str(fname) for fname in files if str(fname) not in self._rows]
+        if missing:
+            raise ValueError('%d files without teacher logits in %s, e.g. %s' % (len(missing), self.path, missing[0]))
+
+    def lookup(self, files):
+        """Returns the teacher logits of a batch of files, a float32 array [len(files), num_classes]"""
+        rows = np.array([self._rows[str(fname)] for fname in files], dtype=np.int64)
+        return np.asarray(self.logits[rows], dtype=np.float32)
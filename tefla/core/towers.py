@@ -0,0 +1,100 @@
+"""Data parallel towers on gpus or on logical cpu devices.
+
+A batch is split into `num_towers` equal slices, each one runs through a replica of the model
+(sharing the variables) on its own device, and the tower gradients are averaged. Without gpus
+the towers go on logical cpu devices: the session exposes `num_towers` cpu devices, see
+`tower_session_settings`, and the towers run concurrently, each op of a tower on a share of the
+intra op threads, which scales better on many core hosts than one op using all the threads.
+"""
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core.session_config import available_cpus
+
+
+def tower_devices(num_towers, device_type='gpu'):
+    """Returns the device names of the towers, e.g. ['/cpu:0', '/cpu:1']
+
+    Args:
+        num_towers: a int, number of towers
+        device_type: `gpu` or `cpu`
+    """
+    if device_type not in ('gpu', 'cpu'):
+        raise ValueError('Unknown tower device type: %s' % device_type)
+    return ['/%s:%d' % (device_type, i) for i in range(num_towers)]
+
+
+def tower_session_settings(num_towers, device_type='gpu', threads_per_tower=None, inter_op_threads_per_tower=2):
+    """Returns the session settings overrides of the towers, see `create_session_config`
+
+    tf runs the kernels of all the cpu devices on the intra op thread pool of the process, the
+    per tower thread budget is set by sizing that pool to `num_towers * threads_per_tower` and
+    allowing `inter_op_threads_per_tower` ops in flight per tower.
+
+    Args:
+        num_towers: a int, number of towers
+        device_type: `gpu` or `cpu`, no overrides for gpu towers
+        threads_per_tower: a int, intra op threads per tower, defaults to the cpus divided by
+            the number of towers
+        inter_op_threads_per_tower: a int, number of concurrent ops per tower
+
+    Returns:
+        a dict of session settings
+    """
+    if device_type != 'cpu':
+        return {}
+    threads_per_tower = threads_per_tower or max(len(available_cpus()) // num_towers, 1)
+    return {'num_cpu_devices': num_towers, 'intra_op_threads': num_towers * threads_per_tower,
+            'inter_op_threads': num_towers * inter_op_threads_per_tower}
+
+
+def split_batch(tensor, num_towers):
+    """Splits a batch tensor in `num_towers` equal slices, the batch size must be a multiple of it"""
+    if num_towers == 1:
+        return [tensor]
+    return tf.split(0, num_towers, tensor)
+
+
+def pad_batch(X, y, num_towers):
+    """Pads a batch to a multiple of `num_towers` examples by repeating its first examples
+
+    Args:
+        X: a numpy array, the batch inputs
+        y: a numpy array, the batch labels, or None
+        num_towers: a int, number of towers
+
+    Returns:
+        a tuple, (padded X, padded y, number of examples before padding)
+    """
+    n = len(X)
+    pad = -n % num_towers
+    if pad == 0:
+        return X, y, n
+    index = np.arange(n + pad) % n
+    return X[index], (y[index] if y is not None else None), n
+
+
+def average_gradients(tower_grads):
+    """Averages the gradients of the towers
+
+    Args:
+        tower_grads: a list, per tower, of lists of (gradient, variable), in the same variable order
+
+    Returns:
+        a list of (averaged gradient, variable), the gradient is None for the variables without
+        gradient
+    """
+    if len(tower_grads) == 1:
+        return tower_grads[0]
+    average_grads = []
+    for grad_and_vars in zip(*tower_grads):
+        v = grad_and_vars[0][1]
+        grads = [g for g, _ in grad_and_vars if g is not None]
+        if not grads:
+            average_grads.append((None, v))
+            continue
+        grad = tf.reduce_mean(tf.concat(0, [tf.expand_dims(g, 0) for g in grads]), 0)
+        average_grads.append((grad, v))
+    return average_grads
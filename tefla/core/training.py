@@ -11,6 +11,13 @@ import tensorflow as tf
 from tefla.da.iterator import BatchIterator
 from tefla.core.lr_policy import NoDecayPolicy
 from tefla.core.losses import kappa_log_loss_clipped
+from tefla.core import layers
+from tefla.core import recompute
+from tefla.core.prefetch import PrefetchQueue
+from tefla.core.resolution_schedule import ResolutionSchedule
+from tefla.core.session_config import create_session_config
+from tefla.core.summary_scheduler import SummaryScheduler, AsyncSummaryWriter
+from tefla.core.step_profiler import StepProfiler
 
 logger = logging.getLogger('tefla')
 
@@ -38,6 +45,24 @@ class SupervisedTrainer(object):
             e.g: total_training_samples/batch_size
         gpu_memory_fraction: amount of gpu memory to use
         is_summary: bool, to write summary or not
+
+    With `cnf['prefetch_batches']` > 0 the training batches are enqueued into a `PrefetchQueue` of
+    that capacity by a background thread and the model reads them from the queue, otherwise they
+    are fed through the input placeholders.
+
+    In the summary epochs the batch summaries run every `cnf['summary_every_steps']` steps, on at
+    most `cnf['summary_max_layers']` layers, and the event files are written from a background
+    thread, see `SummaryScheduler`. The summary overhead is logged every summary epoch.
+
+    The global steps in `cnf['profile_steps']` are traced into `cnf['profile_dir']`, see
+    `StepProfiler`.
+
+    With a `cnf['resolution_schedule']` the training epochs run at the crop sizes of a
+    `ResolutionSchedule`, on a training model with a variable spatial input.
+
+    With a `cnf['recompute_checkpoints']` policy, e.g. `sqrt`, only the activations of the
+    checkpoints it selects are kept for the backprop, the other ones are recomputed, see
+    `tefla.core.recompute`.
     """
 
     def __init__(self, model, cnf, training_iterator=BatchIterator(32, False),
@@ -58,6 +83,10 @@ class SupervisedTrainer(object):
         self.loss_type=loss_type
         self.num_classes=5
         self.label_smoothing=0.009
+        self.prefetch_batches = cnf.get('prefetch_batches', 0)
+        self.prefetch_queue = None
+        self.summary_scheduler = SummaryScheduler.from_cnf(cnf)
+        self.resolution_schedule = ResolutionSchedule.from_cnf(cnf)
 
     def fit(self, data_set, weights_from=None, start_epoch=1, summary_every=10, verbose=0):
         """
@@ -88,6 +117,10 @@ class SupervisedTrainer(object):
             self.update_ops = None
             # if update_ops is not None:
             #     regularized_training_loss = control_flow_ops.with_dependencies(update_ops, regularized_training_loss)
+        if self.prefetch_queue is not None and self.update_ops is not None:
+            # a separate run would dequeue an other batch
+            self.optimizer_step = tf.group(self.optimizer_step, *self.update_ops)
+            self.update_ops = None
 
     def _print_info(self, data_set, verbose):
         logger.info('Config:')
@@ -135,8 +168,8 @@ class SupervisedTrainer(object):
             validation_batch_summary_op = tf.summary.merge_all(key=VALIDATION_BATCH_SUMMARIES)
             validation_epoch_summary_op = tf.summary.merge_all(key=VALIDATION_EPOCH_SUMMARIES)
 
-        gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=self.gpu_memory_fraction)
-        with tf.Session(config=tf.ConfigProto(gpu_options=gpu_options)) as sess:
+        sess_config = create_session_config(self.cnf, self.gpu_memory_fraction)
+        with tf.Session(config=sess_config) as sess:
             if start_epoch > 1:
                 weights_from = "weights/model-epoch-%d.ckpt" % (start_epoch - 1)
 
@@ -146,6 +179,7 @@ class SupervisedTrainer(object):
 
             learning_rate_value = self.lr_policy.initial_lr
             logger.info("Initial learning rate: %f " % learning_rate_value)
+            profiler = StepProfiler.from_cnf(self.cnf, end_points=self.training_end_points, name='training')
             if self.is_summary:
                 train_writer, validation_writer = _create_summary_writer(self.cnf.get('summary_dir', '/tmp/tefla-summary'), sess)
 
@@ -160,20 +194,25 @@ class SupervisedTrainer(object):
                 tic = time.time()
                 training_losses = []
                 batch_train_sizes = []
+                if self.resolution_schedule is not None:
+                    self.resolution_schedule.apply(self.training_iterator, epoch)
 
-                for batch_num, (Xb, yb) in enumerate(self.training_iterator(training_X, training_y)):
-                    feed_dict_train = {self.inputs: Xb, self.target: self._adjust_ground_truth(yb),
-                                       self.learning_rate: learning_rate_value}
+                for batch_num, (Xb, yb) in enumerate(self._training_batches(sess, training_X, training_y)):
+                    feed_dict_train = {self.learning_rate: learning_rate_value}
+                    if self.prefetch_queue is None:
+                        feed_dict_train.update({self.inputs: Xb, self.target: yb})
 
                     logger.debug('1. Loading batch %d data done.' % batch_num)
-                    if epoch % summary_every == 0 and self.is_summary:
+                    step_tic = time.time()
+                    with_summary = (epoch % summary_every == 0 and self.is_summary and
+                                    self.summary_scheduler.should_run(batch_iter_idx))
+                    if with_summary:
                         logger.debug('2. Running training steps with summary...')
-                        training_predictions_e, training_loss_e, summary_str_train, _ = sess.run(
-                            [self.training_predictions, self.regularized_training_loss, training_batch_summary_op,
-                             self.optimizer_step],
-                            feed_dict=feed_dict_train)
-                        train_writer.add_summary(summary_str_train, epoch)
-                        train_writer.flush()
+                        training_predictions_e, training_loss_e, summary_str_train, _ = profiler.run(
+                            sess, [self.training_predictions, self.regularized_training_loss,
+                                   training_batch_summary_op, self.optimizer_step],
+                            feed_dict=feed_dict_train, step=batch_iter_idx)
+                        train_writer.add_summary(summary_str_train, batch_iter_idx)
                         logger.debug('2. Running training steps with summary done.')
                         if verbose > 3:
                             logger.debug("Epoch %d, Batch %d training loss: %s" % (epoch, batch_num, training_loss_e))
@@ -181,9 +220,10 @@ class SupervisedTrainer(object):
                                          (epoch, batch_num, training_predictions_e))
                     else:
                         logger.debug('2. Running training steps without summary...')
-                        training_loss_e, _ = sess.run([self.regularized_training_loss, self.optimizer_step],
-                                                      feed_dict=feed_dict_train)
+                        training_loss_e, _ = profiler.run(sess, [self.regularized_training_loss, self.optimizer_step],
+                                                          feed_dict=feed_dict_train, step=batch_iter_idx)
                         logger.debug('2. Running training steps without summary done.')
+                    self.summary_scheduler.record_step(time.time() - step_tic, with_summary)
 
                     training_losses.append(training_loss_e)
                     batch_train_sizes.append(len(Xb))
@@ -198,6 +238,15 @@ class SupervisedTrainer(object):
                     logger.debug('4. Training batch %d done.' % batch_num)
 
                 epoch_training_loss = np.average(training_losses, weights=batch_train_sizes)
+                if self.prefetch_queue is not None:
+                    stats = self.prefetch_queue.stats()
+                    logger.info("Epoch %d prefetch queue: %.0f%% full, empty at %.0f%% of the steps, "
+                                "%.1fs waiting for input" % (epoch, 100 * stats['occupancy'], 100 * stats['empty'],
+                                                             stats['wait_seconds']))
+                summary_overhead = self.summary_scheduler.overhead()
+                if summary_overhead is not None:
+                    logger.info("Epoch %d summary overhead: %.1f%% of the step time" % (epoch, summary_overhead))
+                self.summary_scheduler.reset()
 
                 # Plot training loss every epoch
                 logger.debug('5. Writing epoch summary...')
@@ -224,7 +273,6 @@ class SupervisedTrainer(object):
                             [self.validation_predictions, self.validation_loss, validation_batch_summary_op],
                             feed_dict=feed_dict_validation)
                         validation_writer.add_summary(summary_str_validate, epoch)
-                        validation_writer.flush()
                         logger.debug('7. Running validation steps with summary done.')
                         if verbose > 3:
                             logger.debug(
@@ -284,10 +332,40 @@ class SupervisedTrainer(object):
                 if verbose > 0:
                     logger.info("Learning rate: %f " % learning_rate_value)
                 logger.debug('10. Epoch done. [%d]' % epoch)
+            profiler.close()
             if self.is_summary:
                 train_writer.close()
                 validation_writer.close()
 
+    def _training_batches(self, sess, training_X, training_y):
+        batches = ((Xb, self._adjust_ground_truth(yb)) for Xb, yb in self.training_iterator(training_X, training_y))
+        if self.prefetch_queue is None:
+            return batches
+        return self.prefetch_queue.iterate(sess, batches)
+
+    def _setup_prefetch(self, target_dtype, target_shape):
+        if self.prefetch_batches <= 0:
+            return
+        # the input layer of the model sets the input shape
+        self.prefetch_queue = PrefetchQueue(self.prefetch_batches, [tf.float32, target_dtype], [None, target_shape])
+
+    def _build_training_model(self):
+        def build():
+            if self.prefetch_queue is None:
+                return self.model(is_training=True, reuse=None)
+            with layers.input_default(self.prefetch_queue.outputs[0]):
+                return self.model(is_training=True, reuse=None)
+
+        if self.resolution_schedule is None:
+            return build()
+        with layers.variable_spatial_input():
+            return build()
+
+    def _target(self, dtype, shape):
+        if self.prefetch_queue is None:
+            return tf.placeholder(dtype, shape=shape)
+        return tf.placeholder_with_default(self.prefetch_queue.outputs[1], shape=shape)
+
     def _setup_summaries(self):
         with tf.name_scope('summaries'):
             self.epoch_loss = tf.placeholder(tf.float32, shape=[], name="epoch_loss")
@@ -298,15 +376,16 @@ class SupervisedTrainer(object):
                               collections=[TRAINING_EPOCH_SUMMARIES])
             if len(self.inputs.get_shape()) == 4:
                 tf.image_summary('input', self.inputs, 10, collections=[TRAINING_BATCH_SUMMARIES])
-            for key, val in self.training_end_points.iteritems():
+            sample_layers = self.summary_scheduler.sample_layers
+            for key, val in sample_layers(self.training_end_points.items()):
                 variable_summaries(val, key, collections=[TRAINING_BATCH_SUMMARIES])
-            for var in tf.trainable_variables():
+            for var in sample_layers(tf.trainable_variables()):
                 variable_summaries(var, var.op.name, collections=[TRAINING_BATCH_SUMMARIES])
-            for grad, var in self.grads_and_vars:
+            for grad, var in sample_layers(self.grads_and_vars):
                 variable_summaries(var, var.op.name + '/grad', collections=[TRAINING_BATCH_SUMMARIES])
 
             # Validation summaries
-            for key, val in self.validation_end_points.iteritems():
+            for key, val in sample_layers(self.validation_end_points.items()):
                 variable_summaries(val, key, collections=[VALIDATION_BATCH_SUMMARIES])
 
             tf.scalar_summary('validation loss', self.epoch_loss, collections=[VALIDATION_EPOCH_SUMMARIES])
@@ -323,7 +402,11 @@ class SupervisedTrainer(object):
         # Keep old variable around to load old params, till we need this
         self.obsolete_learning_rate = tf.Variable(1.0, trainable=False, name="learning_rate")
         optimizer = self._optimizer(self.learning_rate, optname=self.cnf.get('optname', 'momentum'), **self.cnf.get('opt_kwargs', {'decay':0.9}))
-        self.grads_and_vars = optimizer.compute_gradients(self.regularized_training_loss, tf.trainable_variables())
+        if self.cnf.get('recompute_checkpoints'):
+            self.grads_and_vars = recompute.compute_gradients(self.regularized_training_loss, tf.trainable_variables(),
+                                                              policy=self.cnf['recompute_checkpoints'])
+        else:
+            self.grads_and_vars = optimizer.compute_gradients(self.regularized_training_loss, tf.trainable_variables())
         if self.clip_norm:
             self.grads_and_vars = _clip_grad_norms(self.grads_and_vars)
         self.optimizer_step = optimizer.apply_gradients(self.grads_and_vars)
@@ -359,7 +442,12 @@ class SupervisedTrainer(object):
             self._setup_regression_predictions_and_loss()
 
     def _setup_classification_predictions_and_loss(self, loss_type='kappa_log'):
-        self.training_end_points = self.model(is_training=True, reuse=None)
+        if loss_type == 'kappa_log':
+            target_shape = (None, self.num_classes)
+        else:
+            target_shape = (None,)
+        self._setup_prefetch(tf.int32, target_shape)
+        self.training_end_points = self._build_training_model()
         self.inputs = self.training_end_points['inputs']
         training_logits, self.training_predictions = self.training_end_points['logits'], self.training_end_points['predictions']
         self.validation_end_points = self.model(is_training=False, reuse=True)
@@ -368,12 +456,12 @@ class SupervisedTrainer(object):
         with tf.name_scope('loss'):
             if loss_type == 'kappa_log':
                 with tf.name_scope('predictions'):
-                    self.target = tf.placeholder(tf.int32, shape=(None, self.num_classes))
+                    self.target = self._target(tf.int32, target_shape)
                 training_loss = kappa_log_loss_clipped(self.training_predictions, self.target, y_pow=2, label_smoothing=self.label_smoothing, batch_size=self.training_iterator.batch_size)
                 self.validation_loss = kappa_log_loss_clipped(self.validation_predictions, self.target, batch_size=self.training_iterator.batch_size)
             else:
                 with tf.name_scope('predictions'):
-                    self.target = tf.placeholder(tf.int32, shape=(None,))
+                    self.target = self._target(tf.int32, target_shape)
                 training_loss = tf.reduce_mean(
                     tf.nn.sparse_softmax_cross_entropy_with_logits(
                         training_logits, self.target))
@@ -386,14 +474,15 @@ class SupervisedTrainer(object):
             self.regularized_training_loss = training_loss + l2_loss * self.cnf.get('l2_reg', 0.0)
 
     def _setup_regression_predictions_and_loss(self):
-        self.training_end_points = self.model(is_training=True, reuse=None)
+        self._setup_prefetch(tf.float32, (None, 1))
+        self.training_end_points = self._build_training_model()
         self.inputs = self.training_end_points['inputs']
         self.training_predictions = self.training_end_points['predictions']
         self.validation_end_points = self.model(is_training=False, reuse=True)
         self.validation_inputs = self.validation_end_points['inputs']
         self.validation_predictions = self.validation_end_points['predictions']
         with tf.name_scope('predictions'):
-            self.target = tf.placeholder(tf.float32, shape=(None, 1))
+            self.target = self._target(tf.float32, (None, 1))
         with tf.name_scope('loss'):
             training_loss = tf.reduce_mean(
                 tf.square(tf.sub(self.training_predictions, self.target)))
@@ -448,7 +537,7 @@ def _create_summary_writer(summary_dir, sess):
 
     train_writer = tf.summary.FileWriter(summary_dir + '/training', graph=sess.graph)
     val_writer = tf.summary.FileWriter(summary_dir + '/validation', graph=sess.graph)
-    return train_writer, val_writer
+    return AsyncSummaryWriter(train_writer), AsyncSummaryWriter(val_writer)
 
 
 def variable_summaries(var, name, collections, extensive=True):
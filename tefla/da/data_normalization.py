@@ -5,9 +5,10 @@
 from __future__ import division, print_function, absolute_import
 
 import numpy as np
-import pickle
 import tensorflow as tf
 
+from tefla.da.dataset_stats import RunningCovariance
+
 _EPSILON = 1e-8
 
 
@@ -86,27 +87,24 @@ class DataNormalization(object):
             print("---------------------------------")
             print("Preprocessing... PCA over all dataset "
                   "(this may take long)...")
-            self.compute_global_pc(dataset, session, limit)
-            with open('PC.pkl', 'wb') as f:
-                pickle.dump(self.global_pc.value, f)
-            print("PC saved to 'PC.pkl' (To avoid repetitive computation, "
-                  "load this pickle file and assign its value to 'pc' "
-                  "argument of `add_zca_whitening`)")
+            whitener = self.compute_global_pc(dataset, session, limit)
+            whitener.save('PC.npz')
+            print("PC saved to 'PC.npz' (To avoid repetitive computation, "
+                  "load it with `ZCAWhitener.load` and assign its `components` "
+                  "to 'pc' argument of `add_zca_whitening`)")
 
     def zca_whitening(self, image):
         """ZCA wgitening
 
         Args:
-            image: input image
+            image: input image, or a batch of images, all whitened with a single matrix product
 
         Returns:
             ZCA whitened image
         """
-        flat = np.reshape(image, image.size)
-        white = np.dot(flat, self.global_pc.value)
-        s1, s2, s3 = image.shape[0], image.shape[1], image.shape[2]
-        image = np.reshape(white, (s1, s2, s3))
-        return image
+        pc = self.global_pc.value
+        white = np.dot(np.reshape(image, (-1, pc.shape[0])).astype(pc.dtype, copy=False), pc)
+        return np.reshape(white, np.shape(image))
 
     def normalize_image(self, batch):
         """Normalize image to [0,1] range
@@ -225,6 +223,25 @@ class DataNormalization(object):
         self.global_std.assign(std, session)
         return std
 
+    def compute_global_pc(self, dataset, session, limit=None, chunk_size=256):
+        """ Compute the ZCA whitening matrix of a dataset, streaming it by chunks.
+        A limit can be specified for faster computation, considering only 'limit' first elements.
+
+        Args:
+            dataset: A `ndarray` or a list of images.
+            session: The session use to perform the computation
+            limit: Number of data sample to use, if None, computes on the whole dataset
+            chunk_size: Number of images accumulated at a time
+
+        Returns:
+            the fitted `ZCAWhitener`
+        """
+        num_images = len(dataset) if limit is None else min(limit, len(dataset))
+        chunks = (np.asarray(dataset[i:min(i + chunk_size, num_images)]) for i in range(0, num_images, chunk_size))
+        whitener = ZCAWhitener().fit(chunks)
+        self.global_pc.assign(whitener.components, session)
+        return whitener
+
     class PersistentParameter:
         """ Create a persistent variable that will be stored into the Graph.
         """
@@ -269,3 +286,71 @@ class DataNormalization(object):
             self.value = value
             session.run(self.var_r.assign(True))
             self.restored = True
+
+
+class ZCAWhitener(object):
+    """ZCA whitening fitted incrementally
+
+    The covariance of the flattened images is accumulated chunk by chunk, so the dataset never
+    needs to be in memory, and a whole `[N, H, W, C]` batch is whitened with one matrix product.
+
+    Args:
+        epsilon: a float, added to the covariance eigenvalues
+    """
+
+    def __init__(self, epsilon=1e-5):
+        self.epsilon = epsilon
+        self.mean = None
+        self.components = None
+        self._stats = None
+
+    def partial_fit(self, batch):
+        """Accumulates a batch of images of shape [N, H, W, C]"""
+        batch = np.asarray(batch)
+        flat = batch.reshape(len(batch), -1)
+        if self._stats is None:
+            self._stats = RunningCovariance(flat.shape[1])
+        self._stats.update(flat)
+        return self
+
+    def fit(self, batches):
+        """Fits the whitening on an iterator of image batches
+
+        Args:
+            batches: an iterable of `[N, H, W, C]` arrays
+
+        Returns:
+            self
+        """
+        for batch in batches:
+            self.partial_fit(batch)
+        return self.finalize()
+
+    def finalize(self):
+        """Computes the whitening matrix of the accumulated batches"""
+        if self._stats is None or self._stats.count == 0:
+            raise ValueError('ZCAWhitener has no data, call partial_fit first')
+        s, u = np.linalg.eigh(self._stats.covariance)
+        s = np.maximum(s, 0)
+        self.components = np.dot(u / np.sqrt(s + self.epsilon), u.T).astype(np.float32)
+        self.mean = self._stats.mean.astype(np.float32)
+        return self
+
+    def apply(self, batch):
+        """Whitens a batch of images of shape [N, H, W, C], returns a float32 array of the same shape"""
+        batch = np.asarray(batch, dtype=np.float32)
+        flat = batch.reshape(len(batch), -1) - self.mean
+        return np.dot(flat, self.components).reshape(batch.shape)
+
+    def save(self, fname):
+        """Saves the float32 mean and whitening matrix as a npz file"""
+        with open(fname, 'wb') as f:
+            np.savez(f, mean=self.mean, components=self.components, epsilon=self.epsilon)
+
+    @classmethod
+    def load(cls, fname):
+        params = np.load(fname)
+        whitener = cls(epsilon=float(params['epsilon']))
+        whitener.mean = params['mean']
+        whitener.components = params['components']
+        return whitener
@@ -0,0 +1,143 @@
+"""Streaming dataset statistics.
+
+The statistics are accumulated in one pass as a count, a mean and the co-moment matrix
+(the sum of the outer products of the deviations from the mean). Partial results of chunks or
+worker processes are merged with the pairwise update of Chan et al., which stays accurate
+where a sum of squares minus the squared sum loses all precision, e.g. with float32 pixels.
+"""
+from __future__ import division, print_function, absolute_import
+
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from PIL import Image
+
+
+class RunningCovariance(object):
+    """Running mean and covariance of `dim` dimensional samples
+
+    Args:
+        dim: a int, number of dimensions of a sample
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.count = 0
+        self.mean = np.zeros(dim, dtype=np.float64)
+        self.comoment = np.zeros((dim, dim), dtype=np.float64)
+
+    def update(self, samples):
+        """Accumulates a 2-D array of samples, [num_samples, dim]"""
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, self.dim)
+        if not len(samples):
+            return self
+        mean = samples.mean(axis=0)
+        centered = samples - mean
+        return self.merge_moments(len(samples), mean, np.dot(centered.T, centered))
+
+    def merge(self, other):
+        """Merges the statistics of an other `RunningCovariance`"""
+        return self.merge_moments(other.count, other.mean, other.comoment)
+
+    def merge_moments(self, count, mean, comoment):
+        if count == 0:
+            return self
+        total = self.count + count
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.count * count / total)
+        self.mean += delta * (count / total)
+        self.count = total
+        return self
+
+    def moments(self):
+        """Returns (count, mean, comoment), e.g. to return the statistics from a worker process"""
+        return self.count, self.mean, self.comoment
+
+    @property
+    def covariance(self):
+        return self.comoment / max(self.count, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(np.diag(self.covariance))
+
+
+def image_pixels(fname):
+    """Returns the pixels of an image file as a [num_pixels, 3] float array of [0, 255] values"""
+    img = Image.open(fname).convert('RGB')
+    return np.asarray(img, dtype=np.float32).reshape(-1, 3)
+
+
+def _image_moments(fname):
+    try:
+        return fname, RunningCovariance(3).update(image_pixels(fname)).moments(), None
+    except Exception as e:
+        return fname, None, str(e)
+
+
+def compute_channel_stats(filenames, num_workers=None, chunksize=8, subset=None, seed=None, report_every=10.0):
+    """Computes the per channel statistics of a list of images in one pass
+
+    Args:
+        filenames: list of image file names
+        num_workers: number of worker processes, defaults to the number of cpus
+        chunksize: number of images sent to a worker at a time
+        subset: if not None, the statistics are computed on a random subset of that many images
+        seed: seed of the subset selection
+        report_every: seconds between progress reports
+
+    Returns:
+        a tuple, (`RunningCovariance` of the RGB pixels, list of (fname, error) of the unreadable images)
+    """
+    filenames = list(filenames)
+    if subset is not None and subset < len(filenames):
+        rng = np.random.RandomState(seed)
+        filenames = [filenames[i] for i in sorted(rng.choice(len(filenames), subset, replace=False))]
+    stats = RunningCovariance(3)
+    failures = []
+    pool = Pool(num_workers or cpu_count())
+    last_report = time.time()
+    try:
+        for done, (fname, moments, error) in enumerate(
+                pool.imap_unordered(_image_moments, filenames, chunksize=chunksize), 1):
+            if error is not None:
+                failures.append((fname, error))
+            else:
+                stats.merge_moments(*moments)
+            if time.time() - last_report > report_every:
+                last_report = time.time()
+                print('Processed %d of %d images' % (done, len(filenames)))
+    finally:
+        pool.close()
+        pool.join()
+    return stats, failures
+
+
+def standardizer_params(stats):
+    """Returns the `AggregateStandardizer` parameters of the pixel statistics
+
+    The color PCA basis is the eigen decomposition of the covariance of the standardized
+    pixels, i.e. the channel correlation matrix, as `AggregateStandardizer` adds the color noise
+    after standardizing.
+
+    Args:
+        stats: a `RunningCovariance` of the RGB pixels
+
+    Returns:
+        a dict with the float32 arrays `mean`, `std`, `u` (eigenvectors as columns) and `ev`
+        (eigenvalues, in decreasing order)
+    """
+    std = stats.std
+    correlation = stats.covariance / np.outer(std, std)
+    ev, u = np.linalg.eigh(correlation)
+    order = np.argsort(ev)[::-1]
+    return {'mean': stats.mean.astype(np.float32), 'std': std.astype(np.float32),
+            'u': u[:, order].astype(np.float32), 'ev': ev[order].astype(np.float32)}
+
+
+def save_standardizer_params(fname, params, **extra):
+    """Saves the `AggregateStandardizer` parameters as a npz file, see `AggregateStandardizer.from_file`"""
+    params = dict(params, **extra)
+    with open(fname, 'wb') as f:
+        np.savez(f, **params)
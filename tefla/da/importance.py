@@ -0,0 +1,78 @@
+"""Loss driven importance sampling of the training samples.
+
+Late in training most samples are classified right with a small loss and an epoch spends most of
+its steps on them. `LossSampler` keeps the last training loss of every sample, reported by the
+trainer after each batch, and draws the samples of the next epoch with a probability growing with
+their loss. The draws are biased toward the hard samples, the loss of a sample drawn with
+probability `p` is weighted by `1 / (n * p)` so the weighted mean loss of a batch stays an
+unbiased estimate of the mean loss of the dataset. A `floor` share of the probability is spread
+uniformly, every sample keeps a chance to be drawn and the weights stay below `1 / floor`.
+"""
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+
+class LossSampler(object):
+    """Samples the training set by loss
+
+    Args:
+        num_samples: a int, size of the training set
+        power: a float, the sampling probabilities grow as `loss ** power`, 0 for uniform sampling
+        floor: a float in (0, 1], share of the probability spread uniformly over the samples
+        momentum: a float in [0, 1), the reported losses are smoothed as
+            `momentum * previous + (1 - momentum) * reported`
+    """
+
+    def __init__(self, num_samples, power=1.0, floor=0.2, momentum=0.0):
+        if not 0 < floor <= 1:
+            raise ValueError('floor must be in (0, 1], got %s' % floor)
+        self.num_samples = num_samples
+        self.power = power
+        self.floor = floor
+        self.momentum = momentum
+        # nan until a sample is seen
+        self.losses = np.full(num_samples, np.nan, dtype=np.float32)
+
+    def update(self, indices, losses):
+        """Records the training losses of samples
+
+        Args:
+            indices: sample ids, a sample drawn several times in the batch keeps its last loss
+            losses: the per sample losses, same length as `indices`
+        """
+        indices = np.asarray(indices)
+        losses = np.maximum(np.asarray(losses, dtype=np.float32), 0)
+        if self.momentum > 0:
+            previous = self.losses[indices]
+            seen = ~np.isnan(previous)
+            losses = np.where(seen, self.momentum * previous + (1 - self.momentum) * losses, losses)
+        self.losses[indices] = losses
+
+    def probabilities(self):
+        """Returns the sampling probability of every sample
+
+        The samples not seen yet get the largest seen loss, so they are drawn early.
+        """
+        seen = ~np.isnan(self.losses)
+        if not seen.any():
+            return np.full(self.num_samples, 1.0 / self.num_samples)
+        losses = np.where(seen, self.losses, self.losses[seen].max()).astype(np.float64)
+        scores = losses ** self.power
+        total = scores.sum()
+        if total <= 0:
+            return np.full(self.num_samples, 1.0 / self.num_samples)
+        return (1 - self.floor) * scores / total + self.floor / self.num_samples
+
+    def sample(self, size=None):
+        """Draws sample ids, with replacement, and their importance weights
+
+        Args:
+            size: number of samples to draw, defaults to the size of the training set
+
+        Returns:
+            a tuple, (sample ids, float32 importance weights `1 / (num_samples * p)`)
+        """
+        p = self.probabilities()
+        indices = np.random.choice(self.num_samples, size=size or self.num_samples, replace=True, p=p)
+        return indices, (1.0 / (self.num_samples * p[indices])).astype(np.float32)
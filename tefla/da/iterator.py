@@ -10,13 +10,32 @@ from uuid import uuid4
 import numpy as np
 
 from tefla.da import data
+from tefla.da.importance import LossSampler
+from tefla.utils.cpu_affinity import set_cpu_affinity
+
+
+LAST_BATCH_MODES = ('keep', 'drop', 'pad')
 
 
 class BatchIterator(object):
+    """Iterates over the batches of X and y
+
+    Args:
+        batch_size: a int, batch size
+        shuffle: a bool, shuffle the samples every epoch
+        last_batch: what to do with a last batch shorter than `batch_size`, `keep` it, `drop` it or
+            `pad` it with the first samples of the epoch, for models with a fixed batch size
+    """
 
-    def __init__(self, batch_size, shuffle):
+    def __init__(self, batch_size, shuffle, last_batch='keep'):
         self.batch_size = batch_size
         self.shuffle = shuffle
+        self.set_last_batch(last_batch)
+
+    def set_last_batch(self, last_batch):
+        if last_batch not in LAST_BATCH_MODES:
+            raise ValueError('last_batch must be one of %s, got %s' % (LAST_BATCH_MODES, last_batch))
+        self.last_batch = last_batch
 
     def __call__(self, X, y=None):
         if self.shuffle:
@@ -27,11 +46,21 @@ class BatchIterator(object):
             self.X, self.y = X, y
         return self
 
+    def batch_index(self, i):
+        """Returns the index of the i-th batch in the epoch samples, a slice or an index array"""
+        n_samples = self.X.shape[0]
+        bs = self.batch_size
+        if self.last_batch == 'pad' and (i + 1) * bs > n_samples:
+            # pad by index, before the samples are loaded
+            return np.arange(i * bs, (i + 1) * bs) % n_samples
+        return slice(i * bs, (i + 1) * bs)
+
     def __iter__(self):
         n_samples = self.X.shape[0]
         bs = self.batch_size
-        for i in range((n_samples + bs - 1) // bs):
-            sl = slice(i * bs, (i + 1) * bs)
+        n_batches = n_samples // bs if self.last_batch == 'drop' else (n_samples + bs - 1) // bs
+        for i in range(n_batches):
+            sl = self.batch_index(i)
             Xb = self.X[sl]
             if self.y is not None:
                 yb = self.y[sl]
@@ -99,6 +128,10 @@ class DAIterator(BatchIterator):
             os.makedirs(save_to_dir)
         super(DAIterator, self).__init__(batch_size, shuffle)
 
+    def set_crop_size(self, crop_size):
+        """Sets the (width, height) crop size of the next batches"""
+        self.w, self.h = crop_size
+
     def da_args(self):
         kwargs = {'preprocessor': self.preprocessor, 'w': self.w, 'h': self.h, 'is_training': self.is_training,
                   'fill_mode': self.fill_mode, 'fill_mode_cval': self.fill_mode_cval, 'standardizer': self.standardizer,
@@ -138,12 +171,19 @@ def load_shared(args):
     array[i] = data.load_augment(fname, **kwargs)
 
 
+def pin_worker(cpus):
+    set_cpu_affinity(cpus)
+
+
 class ParallelDAIterator(QueuedDAIterator):
 
     def __init__(self, batch_size, shuffle, preprocessor, crop_size, is_training,
                  aug_params=data.no_augmentation_params, fill_mode='constant', fill_mode_cval=0, standardizer=None,
-                 save_to_dir=None):
-        self.pool = multiprocessing.Pool()
+                 save_to_dir=None, num_workers=None, cpu_affinity=None):
+        if cpu_affinity:
+            self.pool = multiprocessing.Pool(num_workers, initializer=pin_worker, initargs=(cpu_affinity,))
+        else:
+            self.pool = multiprocessing.Pool(num_workers)
         super(ParallelDAIterator, self).__init__(batch_size, shuffle, preprocessor, crop_size, is_training, aug_params,
                                                  fill_mode, fill_mode_cval, standardizer, save_to_dir)
 
@@ -177,13 +217,15 @@ class BalancingDAIterator(ParallelDAIterator):
             self, batch_size, shuffle, preprocessor, crop_size, is_training,
             balance_weights, final_balance_weights, balance_ratio, balance_epoch_count=0,
             aug_params=data.no_augmentation_params,
-            fill_mode='constant', fill_mode_cval=0, standardizer=None, save_to_dir=None):
+            fill_mode='constant', fill_mode_cval=0, standardizer=None, save_to_dir=None, num_workers=None,
+            cpu_affinity=None):
         self.count = balance_epoch_count
         self.balance_weights = balance_weights
         self.final_balance_weights = final_balance_weights
         self.balance_ratio = balance_ratio
         super(BalancingDAIterator, self).__init__(batch_size, shuffle, preprocessor, crop_size, is_training, aug_params,
-                                                  fill_mode, fill_mode_cval, standardizer, save_to_dir)
+                                                  fill_mode, fill_mode_cval, standardizer, save_to_dir, num_workers,
+                                                  cpu_affinity)
 
     def __call__(self, X, y=None):
         if y is not None:
@@ -221,3 +263,58 @@ class BalancingQueuedDAIterator(QueuedDAIterator):
             X = X[indices]
             y = y[indices]
         return super(BalancingQueuedDAIterator, self).__call__(X, y)
+
+
+class ImportanceSamplingDAIterator(ParallelDAIterator):
+    """Draws the samples of every epoch with probability tilted toward the high loss ones
+
+    The trainer reports the per sample training losses of each batch with `update_losses` and
+    weights the sample losses by `batch_weights`, see `tefla.da.importance.LossSampler`. The
+    samples are drawn in random order, `shuffle` is ignored.
+
+    Args:
+        sampling_power: a float, the sampling probabilities grow as `loss ** sampling_power`
+        sampling_floor: a float in (0, 1], share of the probability spread uniformly
+        loss_momentum: a float in [0, 1), smoothing of the reported losses
+        epoch_fraction: a float, number of samples drawn per epoch, as a fraction of the
+            training set
+    """
+
+    def __init__(
+            self, batch_size, shuffle, preprocessor, crop_size, is_training,
+            sampling_power=1.0, sampling_floor=0.2, loss_momentum=0.0, epoch_fraction=1.0,
+            aug_params=data.no_augmentation_params,
+            fill_mode='constant', fill_mode_cval=0, standardizer=None, save_to_dir=None, num_workers=None,
+            cpu_affinity=None):
+        self.sampling_power = sampling_power
+        self.sampling_floor = sampling_floor
+        self.loss_momentum = loss_momentum
+        self.epoch_fraction = epoch_fraction
+        self.sampler = None
+        super(ImportanceSamplingDAIterator, self).__init__(batch_size, False, preprocessor, crop_size, is_training,
+                                                           aug_params, fill_mode, fill_mode_cval, standardizer,
+                                                           save_to_dir, num_workers, cpu_affinity)
+
+    def epoch_size(self, num_samples):
+        """Returns the number of samples drawn per epoch from a training set of `num_samples`"""
+        return max(int(round(num_samples * self.epoch_fraction)), 1)
+
+    def __call__(self, X, y=None):
+        if self.sampler is None or self.sampler.num_samples != len(X):
+            self.sampler = LossSampler(len(X), self.sampling_power, self.sampling_floor, self.loss_momentum)
+        self.sample_ids, self.sample_weights = self.sampler.sample(self.epoch_size(len(X)))
+        return super(ImportanceSamplingDAIterator, self).__call__(
+            X[self.sample_ids], y[self.sample_ids] if y is not None else None)
+
+    def batch_ids(self, i):
+        """Returns the training set ids of the samples of the i-th batch"""
+        return self.sample_ids[self.batch_index(i)]
+
+    def batch_weights(self, i):
+        """Returns the importance weights of the samples of the i-th batch"""
+        return self.sample_weights[self.batch_index(i)]
+
+    def update_losses(self, i, losses):
+        """Records the per sample training losses of the i-th batch"""
+        ids = self.batch_ids(i)
+        self.sampler.update(ids, losses[:len(ids)])
@@ -80,6 +80,18 @@ class AggregateStandardizer(object):
         self.sigma = sigma
         self.color_vec = color_vec
 
+    @classmethod
+    def from_file(cls, fname, sigma=0.0, color_vec=None):
+        """Creates a standardizer from a parameter file written by `tefla/compute_stats.py`
+
+        Args:
+            fname: npz file with the `mean`, `std`, `u` and `ev` arrays
+            sigma: float, noise factor
+            color_vec: an optional color vector
+        """
+        params = np.load(fname)
+        return cls(params['mean'], params['std'], params['u'], params['ev'], sigma=sigma, color_vec=color_vec)
+
     def da_processing_params(self):
         return {'sigma': self.sigma}
 
@@ -80,3 +80,43 @@ def build_quasirandom_transforms(num_transforms, color_sigma, zoom_range,
                   for s in uniform_samples]
 
     return tfs, color_vecs
+
+
+class RunningTTAStats(object):
+    """Per image running mean and variance of the tta predictions
+
+    Uses Welford's update so that images can be added to or dropped from
+    the tta rounds independently of each other.
+
+    Args:
+        num_images: a int, total number of images
+        num_classes: a int, length of the prediction vector of an image
+    """
+
+    def __init__(self, num_images, num_classes):
+        self.count = np.zeros(num_images, dtype=np.int32)
+        self.mean = np.zeros((num_images, num_classes), dtype=np.float64)
+        self._m2 = np.zeros((num_images, num_classes), dtype=np.float64)
+
+    def update(self, indices, predictions):
+        """Add one transform prediction for a subset of the images
+
+        Args:
+            indices: 1-D int array, index of the images the predictions belong to
+            predictions: 2-D array, [len(indices), num_classes] predictions
+        """
+        count = self.count[indices] + 1
+        delta = predictions - self.mean[indices]
+        self.mean[indices] += delta / count[:, np.newaxis]
+        self._m2[indices] += delta * (predictions - self.mean[indices])
+        self.count[indices] = count
+
+    @property
+    def variance(self):
+        """Unbiased per image, per class variance of the predictions"""
+        return self._m2 / np.maximum(self.count - 1, 1)[:, np.newaxis]
+
+    @property
+    def standard_error(self):
+        """Per image, per class standard error of the mean prediction, from the unbiased variance"""
+        return np.sqrt(self.variance / np.maximum(self.count, 1)[:, np.newaxis])
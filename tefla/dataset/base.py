@@ -8,10 +8,16 @@ from __future__ import division
 from __future__ import print_function
 
 from abc import ABCMeta
+import fnmatch
+import logging
 import os
 import math
 import tensorflow as tf
 
+from tefla.dataset import shard_index
+
+logger = logging.getLogger('tefla')
+
 
 class Dataset(object):
     """A simple class for handling data sets,
@@ -21,14 +27,17 @@ class Dataset(object):
         decoder: object instance, tfrecords object decoding and image encoding and decoding
         data_dir: a string, path to the data folder
         num_classes: num of classes of the dataset
-        num_examples_per_epoch: total number of examples per epoch
+        num_examples_per_epoch: total number of examples per epoch, if None it is counted from the
+            index sidecars of the shards, see `tefla.dataset.shard_index`, or from the records of
+            the shards without a sidecar
         items_to_description: a string descriving the items of the dataset
+        file_pattern: a string, glob pattern of the data files in `data_dir`, e.g. `train-*`
 
     """
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, name, decoder, data_dir=None, num_classes=10, num_examples_per_epoch=1, batch_size=1, items_to_descriptions=None, **kwargs):
+    def __init__(self, name, decoder, data_dir=None, num_classes=10, num_examples_per_epoch=None, batch_size=1, items_to_descriptions=None, file_pattern='*', **kwargs):
         self.name = name
         self._decoder = decoder
         self.data_dir = data_dir
@@ -36,6 +45,7 @@ class Dataset(object):
         self._num_examples_per_epoch = num_examples_per_epoch
         self._batch_size = batch_size
         self.items_to_descriptions = items_to_descriptions
+        self.file_pattern = file_pattern
         self.__dict__.update(kwargs)
 
     @property
@@ -51,11 +61,13 @@ class Dataset(object):
     @property
     def num_examples_per_epoch(self):
         """Returns the number of examples in the data subset."""
+        if self._num_examples_per_epoch is None:
+            self._num_examples_per_epoch = self.count_examples()
         return self._num_examples_per_epoch
 
     @property
     def n_iters_per_epoch(self):
-        return int(math.ceil(self._num_examples_per_epoch / float(self._batch_size)))
+        return int(math.ceil(self.num_examples_per_epoch / float(self._batch_size)))
 
     @num_examples_per_epoch.setter
     def num_examples_per_epoch(self, value):
@@ -65,6 +77,9 @@ class Dataset(object):
     def data_files(self):
         """Returns a python list of all (sharded) data subset files.
 
+        The files of `data_dir` matching `file_pattern`, index sidecars excluded, sorted by name
+        so every worker of a distributed job sees the same order.
+
         Returns:
             python list of all (sharded) data set files.
 
@@ -72,12 +87,93 @@ class Dataset(object):
             ValueError: if there are not data_files matching the subset.
         """
         try:
-            data_files = [f for f in os.listdir(self.data_dir)]
-            data_files = [os.path.join(self.data_dir, f) for f in data_files]
-            # return np.array(sorted(data_files))
-            return data_files
+            data_files = [f for f in sorted(os.listdir(self.data_dir))
+                          if fnmatch.fnmatch(f, self.file_pattern) and not shard_index.is_index_file(f)]
         except Exception:
-            raise ValueError('No files found for dataset %s at %s' % (self.name, self.data_dir))
+            data_files = []
+        data_files = [os.path.join(self.data_dir, f) for f in data_files]
+        data_files = [f for f in data_files if os.path.isfile(f)]
+        if not data_files:
+            raise ValueError('No files matching %s found for dataset %s at %s' % (
+                self.file_pattern, self.name, self.data_dir))
+        return data_files
+
+    def worker_data_files(self, num_workers=1, worker_index=0):
+        """Returns the data files read by one worker of a distributed job.
+
+        The shards are dealt round robin, the workers get disjoint subsets covering the data set.
+
+        Args:
+            num_workers: a int, total number of workers
+            worker_index: a int, index of the worker in [0, num_workers)
+
+        Returns:
+            python list of data files.
+
+        Raises:
+            ValueError: if there are less data files than workers.
+        """
+        if not 0 <= worker_index < num_workers:
+            raise ValueError('worker_index %d not in [0, %d)' % (worker_index, num_workers))
+        data_files = self.data_files()
+        if len(data_files) < num_workers:
+            raise ValueError('Dataset %s has %d data files, less than the %d workers' % (
+                self.name, len(data_files), num_workers))
+        return data_files[worker_index::num_workers]
+
+    def shard_indices(self, data_files=None):
+        """Returns the index sidecars of the data files.
+
+        Args:
+            data_files: list of data files, defaults to `data_files()`
+
+        Returns:
+            python list of index dicts, see `tefla.dataset.shard_index.write_index`.
+
+        Raises:
+            ValueError: if a data file has no index sidecar.
+        """
+        data_files = data_files or self.data_files()
+        indexed = shard_index.indexed_shards(data_files)
+        if len(indexed) != len(data_files):
+            missing = sorted(set(data_files) - set(indexed))
+            raise ValueError('No index found for %d data files of dataset %s, e.g. %s' % (
+                len(missing), self.name, missing[0]))
+        return [shard_index.read_index(f) for f in data_files]
+
+    def count_examples(self, data_files=None):
+        """Returns the exact number of examples of the data files.
+
+        The counts are read from the index sidecars, the records of the data files without a
+        sidecar (e.g. written before the sidecars existed) are counted by reading them.
+
+        Args:
+            data_files: list of data files, defaults to `data_files()`
+
+        Returns:
+            a int, the number of examples.
+        """
+        data_files = data_files or self.data_files()
+        indexed = set(shard_index.indexed_shards(data_files))
+        unindexed = [f for f in data_files if f not in indexed]
+        num_examples = sum(shard_index.read_index(f)['num_examples'] for f in data_files if f in indexed)
+        if unindexed:
+            logger.warning('No index found for %d data files of dataset %s, counting their records' % (
+                len(unindexed), self.name))
+            num_examples += sum(sum(1 for _ in tf.python_io.tf_record_iterator(f)) for f in unindexed)
+        return num_examples
+
+    def class_histogram(self):
+        """Returns a dict, label -> number of examples, read from the index sidecars."""
+        return shard_index.label_histogram(self.shard_indices())
+
+    def record_reader(self):
+        """Returns a random access reader of the data files.
+
+        Returns:
+            `tefla.dataset.shard_index.RecordReader` object.
+        """
+        return shard_index.RecordReader(sorted(self.data_files()))
 
     @property
     def reader_class(self):
@@ -19,14 +19,26 @@ class Dataflow(object):
         num_epochs: total number of epoch for training or validation
         min_queue_examples: minimum number of items after dequeue
         capacity: total queue capacity
+        num_workers: num of workers of a distributed job, each one reads a disjoint subset of the
+            data files, so an epoch of all the workers is one pass over the dataset
+        worker_index: index of this worker in [0, num_workers)
+        seed: seed of the per epoch data files shuffling
     """
 
-    def __init__(self, dataset, num_readers=1, shuffle=True, num_epochs=None, min_queue_examples=1024, capacity=2048):
+    def __init__(self, dataset, num_readers=1, shuffle=True, num_epochs=None, min_queue_examples=1024, capacity=2048, num_workers=1, worker_index=0, seed=None):
         self.min_queue_examples = min_queue_examples
         self.num_readers = num_readers
         self.shuffle = shuffle
         self.dataset = dataset
-        self.reader = Reader(dataset, shuffle=shuffle, num_readers=num_readers, capacity=capacity, num_epochs=num_epochs)
+        self.reader = Reader(dataset, shuffle=shuffle, num_readers=num_readers, capacity=capacity, num_epochs=num_epochs,
+                             num_workers=num_workers, worker_index=worker_index, seed=seed)
+
+    @property
+    def num_examples_per_epoch(self):
+        """Returns the number of examples this worker reads per epoch, counted from the shard indices"""
+        if self.reader.num_workers == 1:
+            return self.dataset.num_examples_per_epoch
+        return self.dataset.count_examples(self.reader.data_files())
 
     def get(self, items, image_size, resize_size=None):
         """ Get a single example from the dataset
@@ -122,6 +134,48 @@ class Dataflow(object):
 
             return images, tf.reshape(label_index_batch, [batch_size])
 
+    def batched_inputs(self, batch_size, train, tfrecords_image_size, crop_size, im_size=None, bbox=None, image_preprocessing=None, num_preprocess_threads=8, num_batch_threads=2):
+        """Contruct batches of training or evaluation examples with batched parsing.
+
+            Unlike `batch_inputs`, the read, decode and preprocess subgraph is built once: the
+            records are dequeued `batch_size` at a time, parsed by one batched parse op and the
+            images decoded and preprocessed by `num_preprocess_threads` parallel iterations.
+            `num_batch_threads` queue runner threads run the subgraph concurrently.
+
+        Args:
+            batch_size: integer
+            train: boolean
+            tfrecords_image_size: a list with original image size used to encode image in tfrecords
+                e.g.: [width, height, channel]
+            crop_size: training time image size. a int or tuple
+            image_preprocessing: a function to process image
+            num_preprocess_threads: integer, number of images decoded and preprocessed in parallel
+            num_batch_threads: integer, number of threads running the batch subgraph
+
+        Returns:
+            images: 4-D float Tensor of a batch of images
+            labels: 1-D integer Tensor of [batch_size].
+        """
+        with tf.name_scope('batched_processing'):
+            data = self.reader.batch_reader(batch_size, self.min_queue_examples)
+            outputs = self.dataset.decoder.decode_batch(data, tfrecords_image_size, resize_size=im_size,
+                                                        num_parallel=num_preprocess_threads)
+            images, labels = outputs['image'], outputs['label']
+            if image_preprocessing is not None:
+                images = tf.map_fn(lambda image: image_preprocessing(image, train, crop_size, im_size, 0, bbox),
+                                   images, parallel_iterations=num_preprocess_threads, back_prop=False)
+
+            depth = 3
+            if isinstance(crop_size, int):
+                crop_size = (crop_size, crop_size)
+
+            images = tf.cast(images, tf.float32)
+            images = tf.reshape(images, shape=[batch_size, crop_size[0], crop_size[1], depth])
+            images, labels = tf.train.batch([images, tf.reshape(labels, [batch_size])], batch_size=batch_size,
+                                            num_threads=num_batch_threads, capacity=2 * num_batch_threads * batch_size,
+                                            enqueue_many=True)
+            return images, labels
+
     def _validate_items(self, items, valid_items):
         if not isinstance(items, (list, tuple)):
             raise ValueError('items must be a list or tuple')
@@ -56,6 +56,40 @@ class Decoder(object):
 
         return outputs
 
+    def decode_batch(self, examples_serialized, image_size, resize_size=None, num_parallel=8):
+        """Parses a batch of Example protos with one batched parse op.
+
+            The images are decoded by `num_parallel` parallel iterations of a single decode op,
+            instead of a parse and decode subgraph per example.
+
+        Args:
+            examples_serialized: 1-D Tensor tf.string of serialized Example protocol buffers.
+            image_size: a list with original image size
+                e.g.: [width, height, channel]
+            resize_size: if image resize required, provide a list of width and height
+            num_parallel: a int, number of images decoded in parallel
+
+        Returns:
+            a dict, feature type to batched Tensor, e.g. `image` a 4-D float Tensor of [batch_size] + image_size
+        """
+        features = tf.parse_example(examples_serialized, self._feature_keys)
+        outputs = dict()
+        for feature in self._feature_names:
+            f_type = feature.split('/')[-1]
+            if f_type == 'image':
+                out = tf.map_fn(lambda image_buffer: tf.reshape(self._decode_jpeg(image_buffer), image_size),
+                                features[feature], dtype=tf.float32, parallel_iterations=num_parallel,
+                                back_prop=False)
+                if resize_size is not None:
+                    out = tf.image.resize_bilinear(out, resize_size, align_corners=False)
+            elif f_type in ['format', 'text', 'colorspace', 'filename']:
+                out = tf.convert_to_tensor(features[feature], dtype=tf.string)
+            else:
+                out = tf.convert_to_tensor(features[feature], dtype=tf.int64)
+            outputs.update({f_type: out})
+
+        return outputs
+
     def _decode_feature(self, f_type, feature):
         return {
             'image': self._decode_jpeg(feature),
@@ -6,16 +6,20 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import io
 import os
 import sys
 import threading
+import time
 from datetime import datetime
+from multiprocessing import Pool, cpu_count
 import tensorflow as tf
 import glob
 import numpy as np
 from PIL import Image
 import random
 from tefla.dataset.decoder import ImageCoder
+from tefla.dataset import shard_index
 
 
 class TFRecords(object):
@@ -108,6 +112,37 @@ class TFRecords(object):
 
         return image_data, height, width
 
+    def process_image_pil(self, filename, validate=False):
+        """Process a single image file without decoding it when possible.
+
+        The dimensions are read from the image header. JPEG files in RGB are stored
+        as they are, the other ones (PNG, grayscale or CMYK JPEG, ...) are decoded and
+        transcoded to RGB JPEG with PIL.
+
+        Args:
+            filename: string, path to an image file e.g., '/path/to/example.JPG'.
+            validate: bool, decode every image, so corrupt or truncated files raise here
+                instead of in the input pipeline.
+
+        Returns:
+            image_buffer: string, JPEG encoding of RGB image.
+            height: integer, image height in pixels.
+            width: integer, image width in pixels.
+        """
+        with open(filename, 'rb') as f:
+            image_data = f.read()
+        # only reads the header
+        im = Image.open(io.BytesIO(image_data))
+        width, height = im.size
+        if validate:
+            # decodes the whole image, raises on corrupt or truncated data
+            im.load()
+        if im.format != 'JPEG' or im.mode != 'RGB':
+            buf = io.BytesIO()
+            im.convert('RGB').save(buf, format='JPEG', quality=95)
+            image_data = buf.getvalue()
+        return image_data, height, width
+
     def convert_to_example(self, filename, image_buffer, label, text, height, width, image_format='jpg', colorspace='RGB', channels=3):
         """Build an Example proto for an example.
 
@@ -167,7 +202,7 @@ class TFRecords(object):
             shard = thread_index * num_shards_per_batch + s
             output_filename = '%s-%.5d-of-%.5d' % (name, shard, num_shards)
             output_file = os.path.join(train_dir, output_filename)
-            writer = tf.python_io.TFRecordWriter(output_file)
+            writer = shard_index.IndexedTFRecordWriter(output_file)
             print('processing')
             shard_counter = 0
             files_in_shard = np.arange(shard_ranges[s], shard_ranges[s + 1], dtype=int)
@@ -177,7 +212,7 @@ class TFRecords(object):
                 text = texts[i]
                 image_buffer, height, width = self.process_image(filename, coder)
                 example = self.convert_to_example(filename, image_buffer, label, text, height, width)
-                writer.write(example.SerializeToString())
+                writer.write(example.SerializeToString(), name=os.path.basename(filenames[i]), label=label)
                 shard_counter += 1
                 counter += 1
                 print('Num of files %d' % (counter))
@@ -185,6 +220,7 @@ class TFRecords(object):
                     print('%s [thread %d]: Processed %d of %d images in thread batch.' % (datetime.now(), thread_index, counter, num_files_in_thread))
                     sys.stdout.flush()
 
+            writer.close()
             print('%s [thread %d]: Wrote %d images to %s' % (datetime.now(), thread_index, shard_counter, output_file))
             sys.stdout.flush()
             shard_counter = 0
@@ -230,6 +266,65 @@ class TFRecords(object):
         print('%s: Finished writing all %d images in data set.' % (datetime.now(), len(filenames)))
         sys.stdout.flush()
 
+    def process_image_files_parallel(self, name, filenames, texts, labels, num_shards, output_dir, num_workers=None,
+                                     validate=False):
+        """Process and save list of images as TFRecord of Example protos, one process per shard.
+
+        The shards are spread over a process pool, each shard is written by one worker
+        which reads and encodes its images with PIL (see `process_image_pil`), so no work
+        is serialized by the GIL or a shared TF session. `num_shards` does not have to be
+        a multiple of `num_workers`. Every shard gets an index sidecar, see
+        `tefla.dataset.shard_index`.
+
+        Args:
+            name: string, unique identifier specifying the data set
+            filenames: list of strings; each string is a path to an image file
+            texts: list of strings; each string is human readable, e.g. 'dog'
+            labels: list of integer; each integer identifies the ground truth
+            num_shards: integer number of shards for this data set.
+            output_dir: string, directory of the shards
+            num_workers: number of worker processes, defaults to the number of cpus
+            validate: bool, decode every image to reject the corrupt ones, see `process_image_pil`
+
+        Returns:
+            a list of (filename, error) of the images which could not be processed
+        """
+        assert len(filenames) == len(texts)
+        assert len(filenames) == len(labels)
+        spacing = np.linspace(0, len(filenames), num_shards + 1).astype(int)
+        tasks = []
+        for shard in range(num_shards):
+            sl = slice(spacing[shard], spacing[shard + 1])
+            output_file = os.path.join(output_dir, shard_index.shard_filename(name, shard, num_shards))
+            tasks.append((output_file, filenames[sl], texts[sl], labels[sl], validate))
+
+        num_workers = num_workers or cpu_count()
+        print('%s: Writing %d images to %d shards with %d processes' % (datetime.now(), len(filenames), num_shards,
+                                                                        num_workers))
+        sys.stdout.flush()
+        pool = Pool(num_workers)
+        failures = []
+        counter = 0
+        tic = time.time()
+        try:
+            for output_file, num_images, shard_failures in pool.imap_unordered(_write_shard, tasks):
+                counter += num_images
+                failures.extend(shard_failures)
+                elapsed = time.time() - tic
+                print('%s: Wrote %s, %d of %d images, %.1f images/sec' % (
+                    datetime.now(), output_file, counter, len(filenames), counter / elapsed))
+                sys.stdout.flush()
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = time.time() - tic
+        print('%s: Finished writing %d images in %.1f sec, %.1f images/sec, %d failed' % (
+            datetime.now(), len(filenames) - len(failures), elapsed, len(filenames) / elapsed, len(failures)))
+        for filename, error in failures:
+            print('Failed %s: %s' % (filename, error))
+        sys.stdout.flush()
+        return failures
+
     def find_image_files(self, data_dir, labels_file):
         """Build a list of all images files and labels in the data set.
 
@@ -285,7 +380,8 @@ class TFRecords(object):
         print('Found %d JPEG files across %d labels inside %s.' % (len(filenames), len(unique_labels), data_dir))
         return filenames, texts, labels
 
-    def process_dataset(self, name, directory, num_shards, labels_file):
+    def process_dataset(self, name, directory, num_shards, labels_file, output_dir='.', num_workers=None,
+                        validate=False):
         """Process a complete data set and save it as a TFRecord.
 
         Args:
@@ -293,9 +389,14 @@ class TFRecords(object):
             directory: string, root path to the data set.
             num_shards: integer number of shards for this data set.
             labels_file: string, path to the labels file.
+            output_dir: string, directory of the shards
+            num_workers: number of worker processes, defaults to the number of cpus
+            validate: bool, decode every image to reject the corrupt ones
         """
         filenames, texts, labels = self.find_image_files(directory, labels_file)
-        self.process_image_files(name, filenames, texts, labels, num_shards)
+        filenames = [f + '.jpg' for f in filenames]
+        self.process_image_files_parallel(name, filenames, texts, labels, num_shards, output_dir, num_workers,
+                                          validate)
 
     def read_images_from(self, data_dir, imresize=[512, 512]):
         images = []
@@ -313,6 +414,23 @@ class TFRecords(object):
         return images_only
 
 
+def _write_shard(args):
+    output_file, filenames, texts, labels, validate = args
+    tfrecords = TFRecords()
+    writer = shard_index.IndexedTFRecordWriter(output_file)
+    failures = []
+    for filename, text, label in zip(filenames, texts, labels):
+        try:
+            image_buffer, height, width = tfrecords.process_image_pil(filename, validate)
+        except Exception as e:
+            failures.append((filename, str(e)))
+            continue
+        example = tfrecords.convert_to_example(filename, image_buffer, label, text, height, width)
+        writer.write(example.SerializeToString(), name=os.path.splitext(os.path.basename(filename))[0], label=label)
+    writer.close()
+    return output_file, len(filenames), failures
+
+
 if __name__ == '__main__':
     # Convert Images to tfRecords files
     im2r = TFRecords()
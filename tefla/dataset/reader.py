@@ -16,15 +16,21 @@ class Reader(object):
         num_readers:a int, num of readers to launch
         capacity: a int, capacity of the queue used
         num_epochs: a int, num of epochs for training or validation
+        num_workers: a int, num of workers of a distributed job reading the dataset
+        worker_index: a int, index of this worker, it reads a disjoint subset of the data files
+        seed: a int, seed of the data files shuffling, offset by `worker_index`
 
     """
 
-    def __init__(self, dataset, reader_kwargs=None, shuffle=True, num_readers=16, capacity=1, num_epochs=None,):
+    def __init__(self, dataset, reader_kwargs=None, shuffle=True, num_readers=16, capacity=1, num_epochs=None, num_workers=1, worker_index=0, seed=None):
         reader_kwargs = reader_kwargs or {}
         self.dataset = dataset
         self.num_epochs = num_epochs
         self.shuffle = shuffle
         self.capacity = capacity
+        self.num_workers = num_workers
+        self.worker_index = worker_index
+        self.seed = None if seed is None else seed + worker_index
         self._readers = [self.dataset.reader_class(**reader_kwargs) for _ in range(num_readers)]
 
     @property
@@ -32,6 +38,15 @@ class Reader(object):
         """Returns the number of readers"""
         return len(self._readers)
 
+    def data_files(self):
+        """Returns the data files read by this worker"""
+        return self.dataset.worker_data_files(self.num_workers, self.worker_index)
+
+    def _filename_queue(self, num_epochs, shuffle, capacity=32):
+        # with shuffle the producer reshuffles the file order at every epoch
+        return tf.train.string_input_producer(self.data_files(), num_epochs=num_epochs, shuffle=shuffle,
+                                              seed=self.seed, capacity=capacity)
+
     def single_reader(self, num_epochs=1, shuffle=False, capacity=1):
         """Single record reader
 
@@ -46,10 +61,9 @@ class Reader(object):
             a single item from the tfrecord files
         """
         with tf.name_scope('single_reader'):
-            data_files = self.dataset.data_files()
-            filename_queue = tf.string_input_producer(data_files, num_epochs=num_epochs, shuffle=shuffle, capacity=capacity)
+            filename_queue = self._filename_queue(num_epochs, shuffle, capacity=capacity)
             # return key, value
-            _, value = self._reader.read(filename_queue)
+            _, value = self._readers[0].read(filename_queue)
             return value
 
     def parallel_reader(self, min_queue_examples=1024):
@@ -64,16 +78,34 @@ class Reader(object):
             a single item from the tfrecord files
         """
         with tf.name_scope('parallel_reader'):
-            data_files = self.dataset.data_files()
-            filename_queue = tf.train.string_input_producer(data_files, num_epochs=self.num_epochs, shuffle=self.shuffle)
-            if self.shuffle:
-                examples_queue = tf.RandomShuffleQueue(capacity=self.capacity, min_after_dequeue=min_queue_examples, dtypes=[tf.string])
-            else:
-                examples_queue = tf.FIFOQueue(capacity=self.capacity, dtypes=[tf.string])
-
-            enqueue_ops = []
-            for _reader in self._readers:
-                _, value = _reader.read(filename_queue)
-                enqueue_ops.append(examples_queue.enqueue([value]))
-            tf.train.queue_runner.add_queue_runner(tf.train.queue_runner.QueueRunner(examples_queue, enqueue_ops))
-            return examples_queue.dequeue()
+            return self._examples_queue(min_queue_examples).dequeue()
+
+    def batch_reader(self, batch_size, min_queue_examples=1024):
+        """Parallel record reader returning batches of serialized records
+
+            Same queue as `parallel_reader`, dequeued `batch_size` records at a time, to be
+            parsed with a single batched parse op, see `Decoder.decode_batch`
+
+        Args:
+            batch_size: a int, number of records per batch
+            min_queue_examples: min number of queue examples after dequeue
+
+        Returns
+            a 1-D string Tensor of `batch_size` serialized records
+        """
+        with tf.name_scope('batch_reader'):
+            return self._examples_queue(min_queue_examples).dequeue_many(batch_size)
+
+    def _examples_queue(self, min_queue_examples):
+        filename_queue = self._filename_queue(self.num_epochs, self.shuffle)
+        if self.shuffle:
+            examples_queue = tf.RandomShuffleQueue(capacity=self.capacity, min_after_dequeue=min_queue_examples, dtypes=[tf.string], shapes=[[]])
+        else:
+            examples_queue = tf.FIFOQueue(capacity=self.capacity, dtypes=[tf.string], shapes=[[]])
+
+        enqueue_ops = []
+        for _reader in self._readers:
+            _, value = _reader.read(filename_queue)
+            enqueue_ops.append(examples_queue.enqueue([value]))
+        tf.train.queue_runner.add_queue_runner(tf.train.queue_runner.QueueRunner(examples_queue, enqueue_ops))
+        return examples_queue
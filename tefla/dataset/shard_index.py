@@ -0,0 +1,196 @@
+"""Index sidecar files of the dataset shards.
+
+Every shard file `name-00003-of-00016[.npy]` written by `tefla/convert.py` has an index
+sidecar `name-00003-of-00016[.npy].index` with the number of examples, their source names
+and labels and, for TFRecord shards, the byte offset and length of every record, so a shard
+can be counted and read at random without scanning it.
+
+TFRecord shards written through `IndexedTFRecordWriter` (`image_to_tfrecords` and the
+`examples/datasets` builders) get the same sidecar, `RecordReader` fetches their records by offset.
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import os
+import struct
+
+import numpy as np
+
+INDEX_SUFFIX = '.index'
+
+# a TFRecord record is framed by a uint64 length, its crc and the data crc
+TFRECORD_FRAMING_BYTES = 16
+
+
+def shard_filename(name, shard, num_shards, extension=''):
+    return '%s-%.5d-of-%.5d%s' % (name, shard, num_shards, extension)
+
+
+def index_filename(shard_file):
+    return shard_file + INDEX_SUFFIX
+
+
+def write_index(shard_file, shard_format, names, labels, shape=None, record_lengths=None):
+    """Writes the index sidecar of a shard
+
+    Args:
+        shard_file: shard file name
+        shard_format: `array` or `tfrecord`
+        names: list of the example names, source file names without extension
+        labels: list of the example labels, None if unknown
+        shape: shape of one example of a `array` shard
+        record_lengths: list of the serialized example lengths of a `tfrecord` shard
+    """
+    index = {'format': shard_format, 'num_examples': len(names), 'names': list(names),
+             'labels': [int(l) if l is not None else None for l in labels]}
+    if shape is not None:
+        index['shape'] = list(shape)
+    if record_lengths is not None:
+        offsets = []
+        offset = 0
+        for length in record_lengths:
+            offsets.append(offset)
+            offset += length + TFRECORD_FRAMING_BYTES
+        index['offsets'] = offsets
+        index['lengths'] = list(record_lengths)
+    with open(index_filename(shard_file), 'w') as f:
+        json.dump(index, f)
+
+
+def read_index(shard_file):
+    """Reads the index sidecar of a shard, returns a dict"""
+    with open(index_filename(shard_file)) as f:
+        return json.load(f)
+
+
+class IndexedTFRecordWriter(object):
+    """A `tf.python_io.TFRecordWriter` that writes the index sidecar of its shard on close
+
+    Args:
+        shard_file: shard file name
+    """
+
+    def __init__(self, shard_file):
+        import tensorflow as tf
+        self.shard_file = shard_file
+        self._writer = tf.python_io.TFRecordWriter(shard_file)
+        self._names = []
+        self._labels = []
+        self._lengths = []
+
+    @property
+    def num_examples(self):
+        return len(self._lengths)
+
+    def write(self, serialized, name=None, label=None):
+        """Writes a serialized example
+
+        Args:
+            serialized: a string, serialized `tf.train.Example`
+            name: example name, defaults to its position in the shard
+            label: example label, None if unknown
+        """
+        self._writer.write(serialized)
+        self._names.append(str(len(self._names)) if name is None else name)
+        self._labels.append(label)
+        self._lengths.append(len(serialized))
+
+    def close(self):
+        self._writer.close()
+        write_index(self.shard_file, 'tfrecord', self._names, self._labels, record_lengths=self._lengths)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def is_index_file(fname):
+    return fname.endswith(INDEX_SUFFIX)
+
+
+def indexed_shards(shard_files):
+    """Returns the shard files of `shard_files` that have an index sidecar"""
+    return [f for f in shard_files if not is_index_file(f) and os.path.exists(index_filename(f))]
+
+
+def label_histogram(indices):
+    """Returns a dict, label -> number of examples, of a list of shard indices; unknown labels are keyed None"""
+    histogram = {}
+    for index in indices:
+        for label in index['labels']:
+            histogram[label] = histogram.get(label, 0) + 1
+    return histogram
+
+
+class RecordReader(object):
+    """Random access reader of indexed TFRecord shards
+
+    Reads the records by the offsets of the index sidecars, without a TF graph, e.g. to build a
+    fixed validation subset or a class stratified sample of a large dataset.
+
+    Args:
+        shard_files: list of TFRecord shard files, each with an index sidecar
+    """
+
+    def __init__(self, shard_files):
+        self.shard_files = list(shard_files)
+        self._records = []
+        for shard, shard_file in enumerate(self.shard_files):
+            index = read_index(shard_file)
+            if index['format'] != 'tfrecord':
+                raise ValueError('%s is not a tfrecord shard' % shard_file)
+            for offset, length, label in zip(index['offsets'], index['lengths'], index['labels']):
+                self._records.append((shard, offset, length, label))
+        self._files = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def labels(self):
+        return [r[3] for r in self._records]
+
+    def read(self, i):
+        """Returns the serialized example of record `i` of the dataset"""
+        shard, offset, length, _ = self._records[i]
+        f = self._files.get(shard)
+        if f is None:
+            f = self._files[shard] = open(self.shard_files[shard], 'rb')
+        f.seek(offset)
+        header = f.read(12)
+        if len(header) < 12 or struct.unpack('<Q', header[:8])[0] != length:
+            raise IOError('Record %d of %s does not match its index' % (i, self.shard_files[shard]))
+        return f.read(length)
+
+    def read_many(self, indices):
+        """Returns the serialized examples of the records `indices`, read in file order"""
+        order = sorted(range(len(indices)), key=lambda k: self._records[indices[k]][:2])
+        records = [None] * len(indices)
+        for k in order:
+            records[k] = self.read(indices[k])
+        return records
+
+    def sample(self, num_examples, seed=None):
+        """Returns a sorted list of `num_examples` random record numbers"""
+        rng = np.random.RandomState(seed)
+        num_examples = min(num_examples, len(self))
+        return sorted(rng.choice(len(self), num_examples, replace=False).tolist())
+
+    def stratified_sample(self, num_per_class, seed=None):
+        """Returns a sorted list of up to `num_per_class` random record numbers of every label"""
+        rng = np.random.RandomState(seed)
+        by_label = {}
+        for i, label in enumerate(self.labels):
+            by_label.setdefault(label, []).append(i)
+        selected = []
+        for label in sorted(by_label, key=lambda l: (l is None, l)):
+            members = by_label[label]
+            selected.extend(rng.choice(members, min(num_per_class, len(members)), replace=False).tolist())
+        return sorted(selected)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
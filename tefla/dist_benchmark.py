@@ -0,0 +1,210 @@
+"""Sync replica training of `DistSupervisedTrainer` on a local cluster, with its scaling efficiency.
+
+`benchmark` writes a small synthetic TFRecord dataset, then for every worker count runs a cluster
+of local ps and worker processes (see `tefla.core.local_cluster`) training on it, and reports the
+examples/sec measured by the chief against the worker count. `task` runs one task of a cluster,
+it is started by `benchmark`.
+"""
+from __future__ import division, print_function, absolute_import
+
+import io
+import json
+import logging
+import os
+import sys
+
+import click
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from tefla.core.layer_arg_ops import common_layer_args, make_args, end_points
+from tefla.core.layers import conv2d, fully_connected, max_pool, relu, softmax
+from tefla.core.learning_distributed import DistSupervisedTrainer
+from tefla.core.local_cluster import LocalCluster, scaling_efficiency, format_scaling_table
+from tefla.core.session_config import available_cpus, create_session_config
+from tefla.dataset import shard_index
+from tefla.utils import util
+
+
+def small_convnet(inputs, is_training, reuse, num_classes=10):
+    common_args = common_layer_args(is_training, reuse)
+    conv_args = make_args(activation=relu, **common_args)
+    logit_args = make_args(activation=None, **common_args)
+
+    x = conv2d(inputs, 32, name='conv1', **conv_args)
+    x = max_pool(x, name='pool1', **common_args)
+    x = conv2d(x, 64, name='conv2', **conv_args)
+    x = max_pool(x, name='pool2', **common_args)
+    x = fully_connected(x, n_output=128, name='fc1', **conv_args)
+    logits = fully_connected(x, n_output=num_classes, name='logits', **logit_args)
+    softmax(logits, name='predictions', **common_args)
+    return end_points(is_training)
+
+
+def _bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _int64_feature(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def write_synthetic_tfrecords(data_dir, num_examples, image_size, num_classes, num_shards, seed=0):
+    """Writes indexed TFRecord shards of random jpeg images, with a per class mean color
+
+    Args:
+        data_dir: output directory, the shards are `train-<shard>-of-<num_shards>`
+        num_examples: total number of examples
+        image_size: a list, [height, width] of the images
+        num_classes: number of classes
+        num_shards: number of shards, at least the max number of workers
+        seed: seed of the images and labels
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    rng = np.random.RandomState(seed)
+    class_colors = rng.randint(0, 256, size=(num_classes, 3))
+    for shard in range(num_shards):
+        shard_file = os.path.join(data_dir, shard_index.shard_filename('train', shard, num_shards))
+        with shard_index.IndexedTFRecordWriter(shard_file) as writer:
+            for i in range(shard, num_examples, num_shards):
+                label = int(rng.randint(num_classes))
+                noise = rng.randint(-64, 64, size=(image_size[0], image_size[1], 3))
+                pixels = np.clip(class_colors[label] + noise, 0, 255).astype(np.uint8)
+                buf = io.BytesIO()
+                Image.fromarray(pixels).save(buf, format='JPEG')
+                example = tf.train.Example(features=tf.train.Features(feature={
+                    'image/encoded/image': _bytes_feature(buf.getvalue()),
+                    'image/format': _bytes_feature(b'jpg'),
+                    'image/class/label': _int64_feature(label)}))
+                writer.write(example.SerializeToString(), name='%d' % i, label=label)
+
+
+def _task_command(config_file):
+    def command(job_name, task_index, cluster_spec):
+        return [sys.executable, '-m', 'tefla.dist_benchmark', 'task', '--job_name', job_name,
+                '--task_index', str(task_index), '--cluster_spec', json.dumps(cluster_spec), '--config', config_file]
+    return command
+
+
+def run_benchmark(work_dir, worker_counts, num_ps=1, batch_size=32, steps=100, warmup=20, image_size=(32, 32),
+                  num_classes=10, num_examples=2048, model=None, model_fn='model', threads_per_worker=None,
+                  timeout=1800):
+    """Runs the sync replica training on a local cluster for every worker count
+
+    Returns:
+        the `scaling_efficiency` rows of the examples/sec reported by the chief
+    """
+    data_dir = os.path.join(work_dir, 'data')
+    write_synthetic_tfrecords(data_dir, num_examples, image_size, num_classes, max(worker_counts))
+    throughputs = {}
+    for num_workers in worker_counts:
+        run_dir = os.path.join(work_dir, 'workers-%d' % num_workers)
+        if not os.path.exists(run_dir):
+            os.makedirs(run_dir)
+        threads = threads_per_worker or max(len(available_cpus()) // num_workers, 1)
+        config = {'data_dir': data_dir, 'run_dir': run_dir, 'batch_size': batch_size, 'max_steps': steps,
+                  'warmup_steps': warmup, 'image_size': list(image_size), 'num_classes': num_classes,
+                  'model': model, 'model_fn': model_fn, 'intra_op_threads': threads}
+        config_file = os.path.join(run_dir, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(config, f, indent=2)
+        with LocalCluster(num_workers, num_ps, _task_command(config_file), os.path.join(run_dir, 'logs')) as cluster:
+            # the other workers may wait for a token of a step that is never aggregated, they are stopped
+            cluster.wait('worker', task_index=0, timeout=timeout)
+        with open(os.path.join(run_dir, 'worker-0.json')) as f:
+            stats = json.load(f)
+        throughputs[num_workers] = stats['examples_per_sec']
+        print('%d workers: %.1f examples/sec' % (num_workers, stats['examples_per_sec']))
+    return scaling_efficiency(throughputs)
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--work_dir', default='/tmp/tefla-dist-benchmark', show_default=True,
+              help='Directory of the synthetic dataset, the checkpoints and the task logs.')
+@click.option('--workers', default='1,2,4', show_default=True, help='Comma separated worker counts.')
+@click.option('--num_ps', default=1, show_default=True, help='Number of parameter server tasks.')
+@click.option('--batch_size', default=32, show_default=True, help='Batch size per worker.')
+@click.option('--steps', default=100, show_default=True, help='Number of global steps.')
+@click.option('--warmup', default=20, show_default=True, help='Number of untimed steps of the chief.')
+@click.option('--image_size', default='32,32', show_default=True, help='Comma separated height, width.')
+@click.option('--num_classes', default=10, show_default=True, help='Number of classes.')
+@click.option('--num_examples', default=2048, show_default=True, help='Number of synthetic examples.')
+@click.option('--model', default=None, show_default=True,
+              help='Relative path to a model file, a small convnet if not given.')
+@click.option('--model_fn', default='model', show_default=True,
+              help='Model function in the model file, it takes the inputs tensor as first arg.')
+@click.option('--threads_per_worker', default=None, type=int, show_default=True,
+              help='Intra op threads of a task, the cpus divided by the number of workers if not given.')
+@click.option('--timeout', default=1800, show_default=True, help='Max seconds of a run.')
+@click.option('--output', default=None, show_default=True, help='Json report file.')
+def benchmark(work_dir, workers, num_ps, batch_size, steps, warmup, image_size, num_classes, num_examples, model,
+              model_fn, threads_per_worker, timeout, output):
+    """Reports the sync replica training examples/sec against the number of workers"""
+    worker_counts = sorted(int(w) for w in workers.split(','))
+    image_size = [int(s) for s in image_size.split(',')]
+    rows = run_benchmark(work_dir, worker_counts, num_ps, batch_size, steps, warmup, image_size, num_classes,
+                         num_examples, model, model_fn, threads_per_worker, timeout)
+    print(format_scaling_table(rows))
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'num_ps': num_ps, 'batch_size': batch_size, 'steps': steps, 'results': rows}, f, indent=2)
+        print('Report written to %s' % output)
+
+
+@main.command()
+@click.option('--job_name', type=click.Choice(['ps', 'worker']), help='Job of the task.')
+@click.option('--task_index', default=0, help='Index of the task in its job.')
+@click.option('--cluster_spec', help='Json cluster spec, a dict of job name to list of host:port.')
+@click.option('--config', help='Json benchmark config file written by the benchmark command.')
+def task(job_name, task_index, cluster_spec, config):
+    """Runs a task of a local cluster"""
+    with open(config) as f:
+        config = json.load(f)
+    util.init_logging(os.path.join(config['run_dir'], '%s-%d.log' % (job_name, task_index)),
+                      file_log_level=logging.INFO, console_log_level=logging.INFO)
+    cluster_spec = tf.train.ClusterSpec(json.loads(cluster_spec))
+    image_size = config['image_size']
+    cnf = {
+        'batch_size': config['batch_size'],
+        'max_steps': config['max_steps'],
+        'warmup_steps': config['warmup_steps'],
+        'tfrecords_image_size': image_size + [3],
+        'crop_size': image_size,
+        'num_preprocess_threads': 4,
+        'num_readers': 2,
+        'min_queue_examples': 4 * config['batch_size'],
+        'capacity': 16 * config['batch_size'],
+        'data_file_pattern': 'train-*',
+        'seed': 0,
+        'train_dir': os.path.join(config['run_dir'], 'train'),
+        'save_interval_secs': 1000000,
+        'intra_op_threads': config['intra_op_threads'],
+    }
+    server = tf.train.Server(cluster_spec, job_name=job_name, task_index=task_index,
+                             config=create_session_config(cnf))
+    if job_name == 'ps':
+        server.join()
+        return
+
+    if config['model']:
+        model = getattr(util.load_module(config['model']), config['model_fn'])
+    else:
+        def model(inputs, is_training, reuse):
+            return small_convnet(inputs, is_training, reuse, num_classes=config['num_classes'])
+    trainer = DistSupervisedTrainer(model, cnf, is_summary=False,
+                                    log_file_name=os.path.join(config['run_dir'], 'trainer-%d.log' % task_index),
+                                    weights_dir=os.path.join(config['run_dir'], 'weights'))
+    stats = trainer.fit(task_index, server.target, None, config['data_dir'], cluster_spec)
+    with open(os.path.join(config['run_dir'], 'worker-%d.json' % task_index), 'w') as f:
+        json.dump(stats, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Distillation of a teacher ensemble into a student model.
+
+`teacher_logits` predicts the training files once with an ensemble of teachers (quasi-random tta
+per teacher, as `predict.py`) and writes their logits, see `tefla.core.teacher_logits`, with a json
+of the teacher kappa on the training labels and of the teacher inference cost. `train` trains a
+student model with `DistillationTrainer` on these logits, and logs its inference cost relative to
+the teachers.
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import logging
+import os
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import layers
+from tefla.core import model_cost
+from tefla.core.dir_dataset import DataSet
+from tefla.core.iter_ops import create_training_iters, create_prediction_iter
+from tefla.core.learning_distill import DistillationTrainer
+from tefla.core.prediction import EnsemblePredictor, OneCropPredictor, QuasiPredictor
+from tefla.core.teacher_logits import TeacherLogits, write_teacher_logits
+from tefla.da.standardizer import NoOpStandardizer
+from tefla.utils import util
+
+logger = logging.getLogger('tefla')
+
+
+def model_macs(model_def):
+    """Returns the multiply-accumulates of a model per image"""
+    with tf.Graph().as_default():
+        model_cost.build_model(model_def, 'model', batch_size=1)
+        return model_cost.cost_totals(model_cost.layer_costs(batch_size=1))['macs']
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--teacher', 'teachers', multiple=True,
+              help='A teacher, relative path to its model and weights file separated by a colon, repeat for an ensemble.')
+@click.option('--training_cnf', help='Relative path to the training config file.')
+@click.option('--data_dir', help='Path to the training directory.')
+@click.option('--image_size', default=256, show_default=True, help='Image size of the dataset.')
+@click.option('--num_transforms', default=10, show_default=True,
+              help='Number of quasi-random tta transforms per teacher, 0 for one crop.')
+@click.option('--ensemble_type', default='mean', show_default=True, help='mean, gmean or log_mean.')
+@click.option('--output', default='teacher_logits.npy', show_default=True, help='Teacher logits file.')
+def teacher_logits(teachers, training_cnf, data_dir, image_size, num_transforms, ensemble_type, output):
+    """Writes the teacher ensemble logits of the training files"""
+    util.init_logging('distill.log', file_log_level=logging.INFO, console_log_level=logging.INFO)
+    cnf = util.load_module(training_cnf).cnf
+    standardizer = cnf.get('standardizer', NoOpStandardizer())
+    data_set = DataSet(data_dir, image_size)
+    predictors = []
+    teacher_macs = 0
+    for teacher in teachers:
+        model_file, weights_from = teacher.split(':')
+        model_def = util.load_module(model_file)
+        prediction_iterator = create_prediction_iter(cnf, standardizer, model_def.crop_size)
+        if num_transforms > 0:
+            predictors.append(QuasiPredictor(model_def.model, cnf, weights_from, prediction_iterator,
+                                             num_transforms))
+        else:
+            predictors.append(OneCropPredictor(model_def.model, cnf, weights_from, prediction_iterator))
+        teacher_macs += model_macs(model_def) * max(num_transforms, 1)
+    ensemble = EnsemblePredictor(predictors)
+
+    def predict_fn(files):
+        predictions = ensemble.predict(np.array(files), ensemble_type=ensemble_type)
+        return np.exp(predictions) if ensemble_type == 'log_mean' else predictions
+
+    images_per_sec = write_teacher_logits(output, data_set.training_X, predict_fn)
+    logits = TeacherLogits(output, data_set.training_X)
+    kappa = util.kappa_wrapper(data_set.training_y, logits.lookup(data_set.training_X))
+    info = {'teachers': list(teachers), 'num_transforms': num_transforms, 'ensemble_type': ensemble_type,
+            'training_kappa': float(kappa), 'images_per_sec': images_per_sec, 'macs_per_image': teacher_macs}
+    with open(os.path.splitext(output)[0] + '.json', 'w') as f:
+        json.dump(info, f, indent=2)
+    logger.info('Teacher ensemble: training kappa %.4f, %.1f images/sec, %.2f GMACs per image' % (
+        kappa, images_per_sec, teacher_macs / 1e9))
+
+
+@main.command()
+@click.option('--model', help='Relative path to the student model.')
+@click.option('--training_cnf', help='Relative path to the training config file.')
+@click.option('--data_dir', help='Path to the training directory.')
+@click.option('--image_size', default=256, show_default=True, help='Image size of the dataset.')
+@click.option('--teacher_logits', 'teacher_logits_file', default='teacher_logits.npy', show_default=True,
+              help='Teacher logits file written by teacher_logits.')
+@click.option('--parallel', default=True, show_default=True, help='parallel or queued.')
+@click.option('--start_epoch', default=1, show_default=True, help='Epoch number from which to resume training.')
+@click.option('--weights_from', default=None, show_default=True, help='Path to initial weights file.')
+@click.option('--resume_lr', default=0.01, show_default=True, help='Learning rate of a resumed training.')
+@click.option('--gpu_memory_fraction', default=0.92, show_default=True, help='Fraction of gpu memory to use.')
+@click.option('--is_summary', default=False, show_default=True, help='Write the summaries.')
+def train(model, training_cnf, data_dir, image_size, teacher_logits_file, parallel, start_epoch, weights_from,
+          resume_lr, gpu_memory_fraction, is_summary):
+    """Trains a student model on the teacher logits"""
+    util.init_logging('distill.log', file_log_level=logging.INFO, console_log_level=logging.INFO)
+    model_def = util.load_module(model)
+    cnf = util.load_module(training_cnf).cnf
+    data_set = DataSet(data_dir, image_size)
+    standardizer = cnf.get('standardizer', NoOpStandardizer())
+    teacher = TeacherLogits(teacher_logits_file, data_set.training_X)
+
+    info_file = os.path.splitext(teacher_logits_file)[0] + '.json'
+    if os.path.exists(info_file):
+        with open(info_file) as f:
+            info = json.load(f)
+        student_macs = model_macs(model_def)
+        logger.info('Student: %.2f GMACs per image, %.1f%% of the teacher ensemble (training kappa %.4f)' % (
+            student_macs / 1e9, 100.0 * student_macs / max(info['macs_per_image'], 1), info['training_kappa']))
+
+    def student(inputs, is_training, reuse):
+        with layers.input_default(inputs):
+            return model_def.model(is_training=is_training, reuse=reuse)
+    student.crop_size = model_def.crop_size
+
+    training_iter, validation_iter = create_training_iters(
+        cnf, data_set, standardizer, model_def.crop_size, start_epoch, parallel=parallel)
+    trainer = DistillationTrainer(student, cnf, teacher, training_iterator=training_iter,
+                                  validation_iterator=validation_iter, resume_lr=resume_lr,
+                                  classification=cnf['classification'], gpu_memory_fraction=gpu_memory_fraction,
+                                  is_summary=is_summary)
+    trainer.fit(data_set, weights_from, start_epoch, summary_every=cnf.get('summary_every', 10))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,9 @@ import os
 import click
 import numpy as np
 
+from tefla.core import dataset_manifest
 from tefla.core.iter_ops import create_prediction_iter, convert_preprocessor
-from tefla.core.prediction import QuasiPredictor
+from tefla.core.prediction import QuasiPredictor, AdaptiveQuasiPredictor
 from tefla.da import data
 from tefla.utils import util
 
@@ -23,14 +24,18 @@ from tefla.utils import util
               help='Image size for conversion.')
 @click.option('--sync', is_flag=True,
               help='Do all processing on the calling thread.')
-@click.option('--test_type', default='quasi', help='Specify test type, crop_10 or quasi')
+@click.option('--test_type', default='quasi', help='Specify test type, crop_10, quasi or adaptive_quasi')
+@click.option('--num_transforms', default=20, show_default=True,
+              help='Number of quasi-random tta transforms, max number for adaptive_quasi.')
+@click.option('--tta_tolerance', default=0.01, show_default=True,
+              help='Max standard error of the mean prediction for an image to stop adaptive_quasi tta.')
 def predict(model, training_cnf, predict_dir, weights_from, dataset_name, convert, image_size, sync,
-            test_type):
+            test_type, num_transforms, tta_tolerance):
     model_def = util.load_module(model)
     model = model_def.model
     cnf = util.load_module(training_cnf).cnf
     weights_from = str(weights_from)
-    images = data.get_image_files(predict_dir)
+    images = dataset_manifest.image_files(predict_dir)
 
     standardizer = cnf.get('standardizer', None)
 
@@ -40,7 +45,11 @@ def predict(model, training_cnf, predict_dir, weights_from, dataset_name, conver
 
     if test_type == 'quasi':
         predictor = QuasiPredictor(
-            model, cnf, weights_from, prediction_iterator, 20)
+            model, cnf, weights_from, prediction_iterator, num_transforms)
+        predictions = predictor.predict(images)
+    elif test_type == 'adaptive_quasi':
+        predictor = AdaptiveQuasiPredictor(
+            model, cnf, weights_from, prediction_iterator, num_transforms, tolerance=tta_tolerance)
         predictions = predictor.predict(images)
 
     if not os.path.exists(os.path.join(predict_dir, '..', 'results')):
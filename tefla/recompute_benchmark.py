@@ -0,0 +1,147 @@
+"""Memory and time of the activation recomputation policies.
+
+`compare` trains a model for a few steps with each checkpoint policy of `tefla.core.recompute`
+and with the default backprop (`none`), and reports the step time and the step memory, i.e. the
+growth of the peak resident memory of the process over the training steps, against the default.
+Every policy runs in its own process (`run`), the peak resident memory of a process only grows.
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import model_cost
+from tefla.core import recompute
+from tefla.core.session_config import create_session_config
+from tefla.utils import util
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_policy(model_def, model_fn, batch_size, policy, steps=10, warmup=2, cnf=None, crop_size=None,
+               num_classes=None):
+    """Trains a model for a few steps with a checkpoint policy, `none` for the default backprop
+
+    The `crop_size` and `num_classes` are needed by the resnets, their modules have no crop size
+    and no classifier by default.
+
+    Returns:
+        a dict with the number of checkpoints, the seconds per step and the step memory in bytes
+    """
+    model_args = {'num_classes': num_classes} if num_classes else {}
+    end_points = model_cost.build_model(model_def, model_fn, batch_size=batch_size, crop_size=crop_size,
+                                        is_training=True, **model_args)
+    inputs = end_points['inputs']
+    predictions = end_points.get('predictions')
+    if predictions is None:
+        predictions = tf.nn.softmax(end_points['logits'])
+    loss = -tf.reduce_mean(tf.log(predictions + 1e-7))
+    variables = tf.trainable_variables()
+    if policy == 'none':
+        checkpoints = []
+    else:
+        checkpoints = recompute.select_checkpoints(int(policy) if policy.isdigit() else policy, [loss])
+    grads = recompute.gradients([loss], variables, checkpoints)
+    train_op = tf.group(*[g for g in grads if g is not None])
+    batch = np.random.rand(batch_size, *inputs.get_shape().as_list()[1:]).astype(np.float32)
+    with tf.Session(config=create_session_config(cnf)) as sess:
+        sess.run(tf.global_variables_initializer())
+        base_rss = _peak_rss_bytes()
+        for _ in range(warmup):
+            sess.run(train_op, feed_dict={inputs: batch})
+        tic = time.time()
+        for _ in range(steps):
+            sess.run(train_op, feed_dict={inputs: batch})
+        seconds_per_step = (time.time() - tic) / steps
+    return {'policy': policy, 'checkpoints': len(checkpoints), 'seconds_per_step': seconds_per_step,
+            'step_memory_bytes': _peak_rss_bytes() - base_rss}
+
+
+def format_report(rows):
+    """Formats the `compare` rows as a text table, relative to the `none` policy"""
+    base = dict((r['policy'], r) for r in rows).get('none')
+    lines = ['%-8s %12s %10s %14s %10s %10s' % ('policy', 'checkpoints', 'sec/step', 'step memory MB', 'time',
+                                                 'memory')]
+    for r in rows:
+        time_ratio = r['seconds_per_step'] / base['seconds_per_step'] if base else float('nan')
+        memory_ratio = r['step_memory_bytes'] / max(base['step_memory_bytes'], 1) if base else float('nan')
+        lines.append('%-8s %12d %10.3f %14.1f %9.0f%% %9.0f%%' % (
+            r['policy'], r['checkpoints'], r['seconds_per_step'], r['step_memory_bytes'] / 2 ** 20,
+            100 * time_ratio, 100 * memory_ratio))
+    return '\n'.join(lines)
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--model', default='models/resnet_v2.py', show_default=True, help='Relative path to the model file.')
+@click.option('--model_fn', default='resnet_v2_101', show_default=True, help='Model function in the model file.')
+@click.option('--batch_size', default=16, show_default=True, help='Batch size.')
+@click.option('--crop_size', default='224,224', show_default=True,
+              help='Input width,height, empty for the crop_size of the model file.')
+@click.option('--num_classes', default=1000, show_default=True,
+              help='Number of classes of the model function, 0 for its default.')
+@click.option('--policies', default='none,sqrt,blocks,units', show_default=True,
+              help='Comma separated checkpoint policies, `none` is the default backprop.')
+@click.option('--steps', default=10, show_default=True, help='Number of timed steps.')
+@click.option('--warmup', default=2, show_default=True, help='Number of untimed steps.')
+@click.option('--output', default=None, show_default=True, help='Json report file.')
+def compare(model, model_fn, batch_size, crop_size, num_classes, policies, steps, warmup, output):
+    """Reports the step time and memory of the checkpoint policies"""
+    rows = []
+    for policy in policies.split(','):
+        fd, result_file = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            subprocess.check_call([sys.executable, '-m', 'tefla.recompute_benchmark', 'run', '--model', model,
+                                   '--model_fn', model_fn, '--batch_size', str(batch_size),
+                                   '--crop_size', crop_size, '--num_classes', str(num_classes), '--policy', policy,
+                                   '--steps', str(steps), '--warmup', str(warmup), '--output', result_file])
+            with open(result_file) as f:
+                rows.append(json.load(f))
+        finally:
+            os.remove(result_file)
+    print(format_report(rows))
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'model': '%s:%s' % (model, model_fn), 'batch_size': batch_size, 'results': rows}, f, indent=2)
+        print('Report written to %s' % output)
+
+
+@main.command()
+@click.option('--model', help='Relative path to the model file.')
+@click.option('--model_fn', help='Model function in the model file.')
+@click.option('--batch_size', default=16, help='Batch size.')
+@click.option('--crop_size', default='224,224', help='Input width,height, empty for the model file crop_size.')
+@click.option('--num_classes', default=1000, help='Number of classes of the model function, 0 for its default.')
+@click.option('--policy', default='none', help='Checkpoint policy, `none` is the default backprop.')
+@click.option('--steps', default=10, help='Number of timed steps.')
+@click.option('--warmup', default=2, help='Number of untimed steps.')
+@click.option('--output', help='Json result file.')
+def run(model, model_fn, batch_size, crop_size, num_classes, policy, steps, warmup, output):
+    """Trains a model with one checkpoint policy, started by `compare`"""
+    crop_size = tuple(int(c) for c in crop_size.split(',')) if crop_size else None
+    result = run_policy(util.load_module(model), model_fn, batch_size, policy, steps, warmup,
+                        crop_size=crop_size, num_classes=num_classes)
+    with open(output, 'w') as f:
+        json.dump(result, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import pytest
+import tensorflow as tf
+
+from tefla.benchmark import MODEL_ZOO, compare_benchmarks
+from tefla.core import model_cost
+from tefla.utils import util
+
+
+def _report(models):
+    return {'models': models}
+
+
+def _result(forward=None, forward_backward=None):
+    result = {}
+    if forward is not None:
+        result['forward'] = {'throughput': dict((str(b), {'images_per_sec': v}) for b, v in forward.items())}
+    if forward_backward is not None:
+        result['forward_backward'] = {
+            'throughput': dict((str(b), {'images_per_sec': v}) for b, v in forward_backward.items())}
+    return result
+
+
+def test_compare_benchmarks():
+    baseline = _report({'a': _result({1: 100.0, 8: 400.0}, {8: 100.0}), 'b': _result({1: 50.0})})
+    current = _report({'a': _result({1: 95.0, 8: 300.0}, {8: 100.0}), 'b': _result({1: 60.0})})
+    assert compare_benchmarks(baseline, current, tolerance=0.1) == [('a', 'forward', 8, 400.0, 300.0)]
+
+
+def test_compare_benchmarks_failed_model():
+    baseline = _report({'a': _result({1: 100.0}, {1: 50.0}), 'b': _result({1: 50.0})})
+    # a lost its forward_backward pass, b failed
+    current = _report({'a': _result({1: 100.0}), 'b': {'error': 'out of memory'}})
+    regressions = sorted(compare_benchmarks(baseline, current))
+    assert regressions == [('a', 'forward_backward', 1, 50.0, 0.0), ('b', 'forward', 1, 50.0, 0.0)]
+
+
+@pytest.mark.parametrize('model_file,model_fn,build_args', MODEL_ZOO)
+def test_model_zoo_builds(model_file, model_fn, build_args):
+    with tf.Graph().as_default():
+        end_points = model_cost.build_model(util.load_module(model_file), model_fn, batch_size=1, **build_args)
+    assert 'inputs' in end_points
+    assert 'predictions' in end_points
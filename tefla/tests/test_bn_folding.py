@@ -0,0 +1,51 @@
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import bn_folding
+
+
+def _bn(net, num_channels, rng, eps=1e-3):
+    # the inference batch norm of a frozen tefla layer: constant per channel mul and add
+    mean = rng.randn(num_channels).astype(np.float32)
+    variance = rng.rand(num_channels).astype(np.float32) + 0.5
+    gamma = rng.rand(num_channels).astype(np.float32) + 0.5
+    beta = rng.randn(num_channels).astype(np.float32)
+    inv = gamma / np.sqrt(variance + eps)
+    net = tf.mul(net, tf.constant(inv))
+    return tf.add(net, tf.constant(beta - mean * inv))
+
+
+def _conv_bn_graph_def():
+    rng = np.random.RandomState(0)
+    with tf.Graph().as_default() as graph:
+        inputs = tf.placeholder(tf.float32, [None, 8, 8, 3], name='inputs')
+        w = tf.constant(rng.randn(3, 3, 3, 4).astype(np.float32))
+        net = tf.nn.conv2d(inputs, w, [1, 1, 1, 1], 'SAME')
+        net = tf.nn.relu(_bn(net, 4, rng))
+        w = tf.constant(rng.randn(8 * 8 * 4, 5).astype(np.float32))
+        net = tf.matmul(tf.reshape(net, [-1, 8 * 8 * 4]), w)
+        tf.identity(_bn(net, 5, rng), name='output')
+    return graph.as_graph_def()
+
+
+def test_fold_conv_and_fc_batch_norms():
+    graph_def = _conv_bn_graph_def()
+    folded_graph_def, folded = bn_folding.fold_batch_norms(graph_def, ['output'])
+    assert [op for op, _ in folded] == ['Conv2D', 'MatMul']
+    ops = [n.op for n in folded_graph_def.node]
+    assert 'Mul' not in ops
+    assert ops.count('BiasAdd') == 2
+    batch = np.random.RandomState(1).randn(2, 8, 8, 3).astype(np.float32)
+    max_diff, _, _ = bn_folding.compare_graphs(graph_def, folded_graph_def, 'inputs:0', 'output:0', batch,
+                                               num_runs=1)
+    assert max_diff < 1e-4
+
+
+def test_fold_keeps_graph_without_batch_norm():
+    with tf.Graph().as_default() as graph:
+        inputs = tf.placeholder(tf.float32, [None, 4], name='inputs')
+        w = tf.constant(np.ones((4, 2), dtype=np.float32))
+        tf.add(tf.matmul(inputs, w), tf.constant([1., 2.]), name='output')
+    folded_graph_def, folded = bn_folding.fold_batch_norms(graph.as_graph_def(), ['output'])
+    assert folded == []
+    assert sorted(n.name for n in folded_graph_def.node) == sorted(n.name for n in graph.as_graph_def().node)
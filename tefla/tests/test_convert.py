@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from PIL import Image, ImageDraw
+
+from tefla import convert
+from tefla.dataset import shard_index
+
+
+@pytest.fixture
+def fundus_image(tmpdir):
+    img = Image.new('RGB', (1600, 1200))
+    ImageDraw.Draw(img).ellipse((250, 40, 1370, 1160), fill=(180, 90, 40))
+    fname = str(tmpdir.join('fundus.jpeg'))
+    img.save(fname, quality=95)
+    return fname
+
+
+def test_thumbnail_bbox_matches_full_bbox(fundus_image):
+    img = Image.open(fundus_image)
+    full = convert.foreground_bbox(img, fundus_image)
+    thumb = convert.thumbnail_bbox(fundus_image, img.size, thumbnail_size=256)
+    assert full is not None and thumb is not None
+    assert convert.bbox_iou(full, thumb) > 0.97
+
+
+def test_convert_thumbnail_output(fundus_image):
+    resized = convert.convert_thumbnail(fundus_image, 128, thumbnail_size=256)
+    expected = convert.convert(fundus_image, 128)
+    assert resized.size == (128, 128)
+    diff = np.abs(np.array(resized, dtype=np.float32) - np.array(expected, dtype=np.float32))
+    assert diff.mean() < 5
+
+
+@pytest.fixture
+def image_dir(tmpdir):
+    directory = tmpdir.mkdir('train')
+    for i in range(2):
+        Image.new('RGB', (40, 32), color=(60 * i, 90, 40)).save(str(directory.join('%d.jpeg' % i)))
+    # a worker raises on this one, the others are still converted
+    directory.join('broken.jpeg').write_binary(b'not a jpeg')
+    return str(directory), str(tmpdir.join('train_res'))
+
+
+def _run_convert(directory, convert_directory):
+    result = CliRunner().invoke(convert.main, ['--directory', directory, '--convert_directory', convert_directory,
+                                               '--crop_size', '16', '--extension', 'png', '--num_workers', '1',
+                                               '--chunksize', '1'])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def _failures(convert_directory):
+    with open(os.path.join(convert_directory, convert.FAILURES_NAME)) as f:
+        return [line.split('\t')[0] for line in f]
+
+
+def test_convert_records_failures_and_continues(image_dir):
+    directory, convert_directory = image_dir
+    output = _run_convert(directory, convert_directory)
+    assert '0 files up to date, converting 3' in output
+    for i in range(2):
+        assert Image.open(os.path.join(convert_directory, '%d.png' % i)).size == (16, 16)
+    assert not os.path.exists(os.path.join(convert_directory, 'broken.png'))
+    assert _failures(convert_directory) == [os.path.join(directory, 'broken.jpeg')]
+    manifest = convert.ConvertManifest(os.path.join(convert_directory, convert.MANIFEST_NAME))
+    manifest.close()
+    assert sorted(manifest.entries) == [os.path.join(directory, '%d.jpeg' % i) for i in range(2)]
+
+
+def test_convert_resumes_from_manifest(image_dir):
+    directory, convert_directory = image_dir
+    _run_convert(directory, convert_directory)
+    # the converted files are skipped, the failed one is retried
+    assert '2 files up to date, converting 1' in _run_convert(directory, convert_directory)
+    assert _failures(convert_directory) == [os.path.join(directory, 'broken.jpeg')]
+
+    # a changed source is converted again, a fixed one leaves no failures file
+    Image.new('RGB', (48, 32)).save(os.path.join(directory, '0.jpeg'))
+    Image.new('RGB', (48, 32)).save(os.path.join(directory, 'broken.jpeg'))
+    assert '1 files up to date, converting 2' in _run_convert(directory, convert_directory)
+    assert np.array(Image.open(os.path.join(convert_directory, '0.png'))).max() == 0
+    assert not os.path.exists(os.path.join(convert_directory, convert.FAILURES_NAME))
+    assert '3 files up to date, converting 0' in _run_convert(directory, convert_directory)
+
+
+def test_manifest_skips_cut_lines(tmpdir, fundus_image):
+    fname = str(tmpdir.join(convert.MANIFEST_NAME))
+    manifest = convert.ConvertManifest(fname)
+    manifest.add(fundus_image, os.stat(fundus_image), fundus_image)
+    manifest.close()
+    with open(fname, 'a') as f:
+        f.write('{"source": "cut')
+    manifest = convert.ConvertManifest(fname)
+    manifest.close()
+    assert list(manifest.entries) == [fundus_image]
+    assert manifest.is_current(fundus_image, os.stat(fundus_image))
+
+
+def test_convert_to_array_shards(tmpdir):
+    filenames = []
+    for i in range(5):
+        fname = str(tmpdir.join('%d.png' % i))
+        Image.new('RGB', (40, 32), color=(10 * i, 0, 0)).save(fname)
+        filenames.append(fname)
+    tmpdir.join('3.png').write_binary(b'not a png')
+    labels = [0, 1, 2, 3, 4]
+    convert_directory = str(tmpdir.mkdir('shards'))
+    failures = convert.convert_to_shards(convert.convert, filenames, labels, convert_directory, 'train', 'array',
+                                         shard_size=2, crop_size=8, num_workers=2)
+    assert [fname for fname, _ in failures] == [filenames[3]]
+
+    shard_files = [os.path.join(convert_directory, shard_index.shard_filename('train', i, 3, '.npy'))
+                   for i in range(3)]
+    indices = [shard_index.read_index(f) for f in shard_files]
+    # the failed file is dropped from its shard
+    assert [index['num_examples'] for index in indices] == [1, 2, 1]
+    assert [index['names'] for index in indices] == [['0'], ['1', '2'], ['4']]
+    assert [index['labels'] for index in indices] == [[0], [1, 2], [4]]
+    for shard_file, index in zip(shard_files, indices):
+        array = np.load(shard_file)
+        assert array.dtype == np.uint8
+        assert array.shape == (index['num_examples'], 8, 8, 3)
+        assert index['shape'] == [8, 8, 3]
+        assert [int(v) for v in array[:, 0, 0, 0]] == [10 * int(name) for name in index['names']]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from tefla.utils import cpu_affinity
+
+
+def test_cpu_split():
+    assert cpu_affinity.cpu_split(2, cpus=[0, 1, 2, 3]) == ([2, 3], [0, 1])
+    assert cpu_affinity.cpu_split(None, cpus=[0, 1]) == ([], [0, 1])
+    # at least one cpu is left for tf
+    assert cpu_affinity.cpu_split(8, cpus=[0, 1, 2]) == ([1, 2], [0])
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason='needs sched_setaffinity')
+def test_cpu_split_after_pinning(monkeypatch):
+    monkeypatch.setattr(cpu_affinity, '_PROCESS_CPUS', [0, 1, 2, 3])
+    pinned = cpu_affinity.available_cpus()
+    try:
+        cpu_affinity.set_cpu_affinity(pinned[:1])
+        # the split is made from the cpus at import, not from the pinned ones
+        assert cpu_affinity.cpu_split(1) == ([3], [0, 1, 2])
+        assert cpu_affinity.cpu_split(1) == cpu_affinity.cpu_split(1)
+    finally:
+        cpu_affinity.set_cpu_affinity(pinned)
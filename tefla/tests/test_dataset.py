@@ -0,0 +1,37 @@
+import pytest
+
+from tefla.dataset import shard_index
+from tefla.dataset.base import Dataset
+
+
+@pytest.fixture
+def dataset(tmpdir):
+    for shard in range(7):
+        fname = str(tmpdir.join(shard_index.shard_filename('train', shard, 7)))
+        open(fname, 'w').close()
+        shard_index.write_index(fname, 'tfrecord', [], [], record_lengths=[])
+    tmpdir.join('validation-00000-of-00001').write('')
+    return Dataset('train', None, data_dir=str(tmpdir), file_pattern='train-*')
+
+
+def test_data_files_skip_index_sidecars(dataset):
+    data_files = dataset.data_files()
+    assert len(data_files) == 7
+    assert data_files == sorted(data_files)
+    assert not any(shard_index.is_index_file(f) for f in data_files)
+
+
+@pytest.mark.parametrize('num_workers', [1, 2, 3, 7])
+def test_worker_data_files_are_disjoint_and_cover(dataset, num_workers):
+    subsets = [dataset.worker_data_files(num_workers, i) for i in range(num_workers)]
+    files = [f for subset in subsets for f in subset]
+    assert sorted(files) == dataset.data_files()
+    assert len(set(files)) == len(files)
+    assert max(len(s) for s in subsets) - min(len(s) for s in subsets) <= 1
+
+
+def test_worker_data_files_errors(dataset):
+    with pytest.raises(ValueError):
+        dataset.worker_data_files(8, 0)
+    with pytest.raises(ValueError):
+        dataset.worker_data_files(2, 2)
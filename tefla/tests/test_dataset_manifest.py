@@ -0,0 +1,80 @@
+import os
+import time
+
+import numpy as np
+
+from tefla.core import data_load_ops
+from tefla.core import dataset_manifest
+
+
+def _write_images(images_dir, names):
+    for name in names:
+        images_dir.join(name).write('x' * (len(name) + 1))
+
+
+def _write_labels(labels_file, labels):
+    labels_file.write('image,level\n' + ''.join('%s,%d\n' % (n, l) for n, l in sorted(labels.items())))
+
+
+def _set_mtime(path, mtime):
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_rebuilt_manifest_matches_a_fresh_glob(tmpdir):
+    images_dir = tmpdir.mkdir('train')
+    _write_images(images_dir, ['1_left.jpeg', '2_left.jpeg', '3_right.jpeg'])
+    _set_mtime(images_dir, time.time() - 100)
+    dataset_manifest.load_manifest(str(images_dir))
+    assert tmpdir.join('.train.manifest.npz').check()
+
+    _write_images(images_dir, ['0_right.jpeg', '4_left.jpeg'])
+    images_dir.join('2_left.jpeg').remove()
+    _set_mtime(images_dir, time.time() - 50)
+    manifest = dataset_manifest.load_manifest(str(images_dir))
+    expected = data_load_ops.get_image_files(str(images_dir))
+    assert list(manifest['files']) == list(expected)
+    assert list(manifest['sizes']) == [os.path.getsize(f) for f in expected]
+    assert list(dataset_manifest.image_files(str(images_dir), use_cache=False)) == list(expected)
+
+
+def test_manifest_mtime_validation(tmpdir, monkeypatch):
+    images_dir = tmpdir.mkdir('train')
+    labels_file = tmpdir.join('labels.csv')
+    _write_images(images_dir, ['1.jpeg', '2.jpeg'])
+    _write_labels(labels_file, {'1': 0, '2': 1})
+    _set_mtime(images_dir, time.time() - 100)
+    _set_mtime(labels_file, time.time() - 100)
+    dataset_manifest.load_manifest(str(images_dir), str(labels_file))
+
+    # unchanged mtimes: the cached listing is used, the directory is not listed
+    listdir = os.listdir
+
+    def no_listdir(path):
+        raise AssertionError('listed %s' % path)
+    monkeypatch.setattr(os, 'listdir', no_listdir)
+    assert list(dataset_manifest.load_manifest(str(images_dir), str(labels_file))['labels']) == [0, 1]
+    monkeypatch.setattr(os, 'listdir', listdir)
+
+    # a changed labels file is read again
+    _write_labels(labels_file, {'1': 3, '2': 4})
+    _set_mtime(labels_file, time.time() - 50)
+    assert list(dataset_manifest.load_manifest(str(images_dir), str(labels_file))['labels']) == [3, 4]
+
+
+def test_manifest_label_lookup(tmpdir):
+    images_dir = tmpdir.mkdir('train')
+    labels_file = tmpdir.join('labels.csv')
+    labels = {'10_left': 2, '10_right': 0, '7_left': 4, '8_left': 3, '9_right': 1}
+    _write_images(images_dir, [n + '.jpeg' for n in labels if n != '8_left'])
+    _write_labels(labels_file, dict(labels, unused=3))
+    _set_mtime(images_dir, time.time() - 100)
+    _set_mtime(labels_file, time.time() - 100)
+    dataset_manifest.load_manifest(str(images_dir), str(labels_file))
+
+    # the label of an added file is looked up, the other ones are kept
+    _write_images(images_dir, ['8_left.jpeg'])
+    _set_mtime(images_dir, time.time() - 50)
+    manifest = dataset_manifest.load_manifest(str(images_dir), str(labels_file))
+    names = data_load_ops.get_names(manifest['files'])
+    assert names == sorted(labels)
+    assert list(manifest['labels']) == [labels[n] for n in names]
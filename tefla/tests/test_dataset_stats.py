@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from tefla.da import dataset_stats
+
+
+def test_running_covariance_merge_matches_numpy():
+    rng = np.random.RandomState(0)
+    samples = (rng.rand(1000, 3) * [200, 120, 60] + 1e4).astype(np.float32)
+    chunks = [dataset_stats.RunningCovariance(3).update(c) for c in np.array_split(samples, 7)]
+    stats = dataset_stats.RunningCovariance(3)
+    for chunk in chunks:
+        stats.merge(chunk)
+    expected = samples.astype(np.float64)
+    assert stats.count == 1000
+    assert np.allclose(stats.mean, expected.mean(axis=0))
+    assert np.allclose(stats.covariance, np.cov(expected.T, bias=True))
+
+
+def test_standardizer_params():
+    rng = np.random.RandomState(1)
+    stats = dataset_stats.RunningCovariance(3).update(rng.randn(5000, 3) * [2, 3, 4] + [10, 20, 30])
+    params = dataset_stats.standardizer_params(stats)
+    assert np.allclose(params['std'], [2, 3, 4], rtol=0.05)
+    assert np.all(np.diff(params['ev']) <= 0)
+    assert np.allclose(np.dot(params['u'].T, params['u']), np.eye(3), atol=1e-5)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,85 @@
+import io
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from PIL import Image
+
+from tefla.dataset import shard_index
+from tefla.dataset.base import Dataset
+from tefla.dataset.dataflow import Dataflow
+from tefla.dataset.decoder import Decoder
+from tefla.dataset.image_to_tfrecords import TFRecords
+
+IMAGE_SIZE = [8, 8, 3]
+
+
+def _feature_keys():
+    return {
+        'image/encoded/image': tf.FixedLenFeature((), tf.string, default_value=''),
+        'image/class/label': tf.FixedLenFeature([], tf.int64, default_value=tf.zeros([], dtype=tf.int64)),
+    }
+
+
+def _examples(num_examples=6):
+    rng = np.random.RandomState(0)
+    encoder = TFRecords()
+    examples = []
+    for i in range(num_examples):
+        buf = io.BytesIO()
+        Image.fromarray(rng.randint(0, 256, IMAGE_SIZE).astype(np.uint8)).save(buf, format='JPEG')
+        example = encoder.convert_to_example('%d.jpg' % i, buf.getvalue(), i, str(i), 8, 8)
+        examples.append(example.SerializeToString())
+    return examples
+
+
+def _decode_one_by_one(examples):
+    with tf.Graph().as_default():
+        serialized = tf.placeholder(tf.string, [])
+        outputs = Decoder(_feature_keys()).decode(serialized, IMAGE_SIZE)
+        with tf.Session() as sess:
+            decoded = [sess.run([outputs['image'], outputs['label']], feed_dict={serialized: e}) for e in examples]
+    return np.stack([image for image, _ in decoded]), np.array([label for _, label in decoded])
+
+
+def test_decode_batch_matches_decode():
+    examples = _examples()
+    expected_images, expected_labels = _decode_one_by_one(examples)
+    with tf.Graph().as_default():
+        serialized = tf.placeholder(tf.string, [None])
+        outputs = Decoder(_feature_keys()).decode_batch(serialized, IMAGE_SIZE, num_parallel=2)
+        with tf.Session() as sess:
+            images, labels = sess.run([outputs['image'], outputs['label']], feed_dict={serialized: examples})
+    assert images.shape == (6, 8, 8, 3)
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_allclose(images, expected_images)
+
+
+def test_batched_inputs_matches_decode(tmpdir):
+    examples = _examples()
+    expected_images, expected_labels = _decode_one_by_one(examples)
+    shard_file = str(tmpdir.join(shard_index.shard_filename('train', 0, 1)))
+    with shard_index.IndexedTFRecordWriter(shard_file) as writer:
+        for label, example in enumerate(examples):
+            writer.write(example, label=label)
+
+    with tf.Graph().as_default():
+        dataset = Dataset('train', Decoder(_feature_keys()), data_dir=str(tmpdir), file_pattern='train-*')
+        # one reader, no shuffling and one batch thread keep the record order
+        dataflow = Dataflow(dataset, num_readers=1, shuffle=False, num_epochs=1, min_queue_examples=0, capacity=16)
+        images, labels = dataflow.batched_inputs(3, False, IMAGE_SIZE, 8, num_preprocess_threads=2,
+                                                 num_batch_threads=1)
+        assert images.get_shape().as_list() == [3, 8, 8, 3]
+        with tf.Session() as sess:
+            sess.run(tf.local_variables_initializer())
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+            try:
+                batches = [sess.run([images, labels]) for _ in range(2)]
+                with pytest.raises(tf.errors.OutOfRangeError):
+                    sess.run(images)
+            finally:
+                coord.request_stop()
+                coord.join(threads)
+    np.testing.assert_array_equal(np.concatenate([l for _, l in batches]), expected_labels)
+    np.testing.assert_allclose(np.concatenate([i for i, _ in batches]), expected_images)
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from tefla.da.importance import LossSampler
+
+
+def test_loss_sampler_probabilities():
+    sampler = LossSampler(4, power=1.0, floor=0.2)
+    assert sampler.probabilities() == pytest.approx([0.25] * 4)
+    sampler.update([0, 1, 2], [3.0, 1.0, 0.0])
+    p = sampler.probabilities()
+    # the unseen sample gets the largest seen loss
+    assert p == pytest.approx(0.8 * np.array([3., 1., 0., 3.]) / 7 + 0.05)
+    assert p.sum() == pytest.approx(1.0)
+    assert p.min() >= 0.05
+
+
+def test_loss_sampler_weights_are_unbiased():
+    np.random.seed(0)
+    losses = np.random.rand(50).astype(np.float32) ** 4
+    sampler = LossSampler(50, power=1.0, floor=0.1)
+    sampler.update(np.arange(50), losses)
+    ids, weights = sampler.sample(200000)
+    assert weights.max() <= 1 / 0.1 + 1e-5
+    assert np.mean(weights * losses[ids]) == pytest.approx(losses.mean(), rel=0.02)
+
+
+def test_loss_sampler_momentum():
+    sampler = LossSampler(2, momentum=0.5)
+    sampler.update([0], [2.0])
+    sampler.update([0, 1], [4.0, 1.0])
+    assert sampler.losses.tolist() == [3.0, 1.0]
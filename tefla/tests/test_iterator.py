@@ -28,6 +28,17 @@ def test_batch_iter_with_shuffle():
     assert_array_equal(data, np.sort(data2, axis=0))
 
 
+def test_batch_iter_last_batch():
+    data = np.arange(30).reshape(10, 3)
+    labels = np.arange(10)
+    bi = iterator.BatchIterator(4, False, last_batch='pad')
+    batches = list(bi(data, labels))
+    assert_equal([len(Xb) for Xb, _ in batches], [4, 4, 4])
+    assert_array_equal(batches[-1][1], [8, 9, 0, 1])
+    bi.set_last_batch('drop')
+    assert_equal([len(Xb) for Xb, _ in bi(data, labels)], [4, 4])
+
+
 def test_queued_iter():
     data = np.arange(36).reshape(12, 3)
     bi = iterator.QueuedIterator(4, False)
@@ -78,5 +89,14 @@ def test_balancing_da_iter():
     assert_array_equal(data.transpose(0, 2, 3, 1), data2)
 
 
+def test_importance_sampling_da_iter():
+    data = np.arange(12 * 3 * 4 * 4).reshape(12, 3, 4, 4)
+    dai = iterator.ImportanceSamplingDAIterator(4, False, no_op_preprocessor, (4, 4), False)
+    data2 = np.vstack([items[0] for items in dai(data, np.arange(12))])
+    assert_array_equal(data[dai.sample_ids].transpose(0, 2, 3, 1), data2)
+    dai.update_losses(0, np.ones(4))
+    assert not np.isnan(dai.sampler.losses[dai.batch_ids(0)]).any()
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
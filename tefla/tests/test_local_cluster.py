@@ -0,0 +1,38 @@
+import sys
+
+import pytest
+
+from tefla.core import local_cluster
+
+
+def test_local_cluster_spec():
+    spec = local_cluster.local_cluster_spec(3, num_ps=2)
+    assert len(spec['ps']) == 2 and len(spec['worker']) == 3
+    addresses = spec['ps'] + spec['worker']
+    assert len(set(addresses)) == 5
+    assert all(a.startswith('localhost:') for a in addresses)
+
+
+def test_scaling_efficiency():
+    rows = local_cluster.scaling_efficiency({1: 100.0, 2: 180.0, 4: 320.0})
+    assert [r['num_workers'] for r in rows] == [1, 2, 4]
+    assert [r['speedup'] for r in rows] == pytest.approx([1.0, 1.8, 3.2])
+    assert [r['efficiency'] for r in rows] == pytest.approx([1.0, 0.9, 0.8])
+    assert len(local_cluster.format_scaling_table(rows).splitlines()) == 4
+
+
+def _command(job_name, task_index, cluster_spec):
+    if job_name == 'ps':
+        return [sys.executable, '-c', 'import time; time.sleep(60)']
+    code = 'import sys; print(%r); sys.exit(%d)' % (cluster_spec[job_name][task_index], task_index)
+    return [sys.executable, '-c', code]
+
+
+def test_local_cluster_runs_tasks(tmpdir):
+    with local_cluster.LocalCluster(2, 1, _command, str(tmpdir)) as cluster:
+        cluster.wait('worker', task_index=0, timeout=30)
+        assert cluster.log_tail('worker', 0).strip() == cluster.cluster_spec['worker'][0]
+        with pytest.raises(RuntimeError):
+            cluster.wait('worker', timeout=30)
+        with pytest.raises(RuntimeError):
+            cluster.wait('ps', timeout=0.5)
@@ -0,0 +1,48 @@
+import types
+
+import pytest
+import tensorflow as tf
+
+from tefla.core import model_cost
+
+
+def _small_model(inputs, is_training, reuse, num_classes=10):
+    with tf.variable_scope('model/conv1', reuse=reuse):
+        w = tf.get_variable('weights', [3, 3, 3, 4])
+        net = tf.nn.conv2d(inputs, w, [1, 1, 1, 1], 'SAME')
+    with tf.variable_scope('model/fc', reuse=reuse):
+        w = tf.get_variable('weights', [8 * 8 * 4, num_classes])
+        logits = tf.matmul(tf.reshape(net, [-1, 8 * 8 * 4]), w)
+    return {'logits': logits, 'predictions': tf.nn.softmax(logits)}
+
+
+def _small_module():
+    # no module crop_size, as the resnets
+    module = types.ModuleType('small_model')
+    module.model = _small_model
+    return module
+
+
+def test_layer_costs():
+    module = _small_module()
+    with tf.Graph().as_default() as graph:
+        end_points = model_cost.build_model(module, 'model', batch_size=2, crop_size=(8, 8), num_classes=5)
+        assert end_points['logits'].get_shape().as_list() == [2, 5]
+    assert not hasattr(module, 'crop_size')
+    costs = dict((c['name'], c) for c in model_cost.layer_costs(graph, batch_size=2))
+    assert costs['model/conv1']['params'] == 3 * 3 * 3 * 4
+    assert costs['model/conv1']['macs'] == 2 * 8 * 8 * 4 * 3 * 3 * 3
+    assert costs['model/fc']['params'] == 256 * 5
+    assert costs['model/fc']['macs'] == 2 * 5 * 256
+    totals = model_cost.cost_totals(list(costs.values()))
+    assert totals['params'] == 108 + 1280
+    assert totals['macs'] == 13824 + 2560
+    assert totals['param_bytes'] == 4 * totals['params']
+    table = model_cost.format_cost_table(list(costs.values()))
+    assert table.splitlines()[1].startswith('model/conv1')
+
+
+def test_build_model_without_crop_size():
+    with tf.Graph().as_default():
+        with pytest.raises(ValueError):
+            model_cost.build_model(_small_module(), 'model')
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from tefla.core.prefetch import PrefetchQueue
+
+
+def _batches(num_batches, delay=0.0):
+    for i in range(num_batches):
+        time.sleep(delay)
+        yield np.full((2, 3), i, dtype=np.float32), np.array([i, -i], dtype=np.int32)
+
+
+def _consume(queue, sess, batches, delay=0.0):
+    dequeued = []
+    for batch in queue.iterate(sess, batches):
+        time.sleep(delay)
+        dequeued.append((batch, sess.run(queue.outputs)))
+    return dequeued
+
+
+@pytest.fixture
+def queue_and_session():
+    with tf.Graph().as_default():
+        queue = PrefetchQueue(2, [tf.float32, tf.int32], [[None, 3], [None]])
+        with tf.Session() as sess:
+            yield queue, sess
+
+
+def test_dequeue_order(queue_and_session):
+    queue, sess = queue_and_session
+    assert queue.outputs[0].get_shape().as_list() == [None, 3]
+    dequeued = _consume(queue, sess, _batches(5))
+    assert len(dequeued) == 5
+    for i, ((images, labels), (out_images, out_labels)) in enumerate(dequeued):
+        assert images[0, 0] == i
+        np.testing.assert_array_equal(out_images, images)
+        np.testing.assert_array_equal(out_labels, labels)
+
+
+def test_stats_full_queue(queue_and_session):
+    queue, sess = queue_and_session
+    # a slow consumer finds the queue full
+    _consume(queue, sess, _batches(6), delay=0.05)
+    stats = queue.stats()
+    assert stats['occupancy'] > 0.5
+    assert stats['empty'] < 0.5
+
+
+def test_stats_empty_queue(queue_and_session):
+    queue, sess = queue_and_session
+    # a slow producer leaves the queue empty, the steps are input bound
+    _consume(queue, sess, _batches(6, delay=0.05))
+    stats = queue.stats()
+    assert stats['empty'] > 0.5
+    assert stats['wait_seconds'] > 0.1
+
+
+def test_early_stop_closes_queue(queue_and_session):
+    queue, sess = queue_and_session
+    iterator = queue.iterate(sess, _batches(100))
+    for _ in range(2):
+        next(iterator)
+        sess.run(queue.outputs)
+    # the feeder is blocked on the full queue, closing the iterator unblocks and joins it
+    iterator.close()
+    assert not [t for t in threading.enumerate() if t.name == 'prefetch_feeder']
+
+
+def test_feeder_error_is_raised(queue_and_session):
+    queue, sess = queue_and_session
+
+    def batches():
+        for batch in _batches(2):
+            yield batch
+        raise ValueError('bad batch')
+
+    with pytest.raises(ValueError):
+        _consume(queue, sess, batches())
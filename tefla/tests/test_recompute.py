@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from numpy.testing import assert_array_almost_equal
+
+from tefla.core import recompute
+
+
+@pytest.fixture(autouse=True)
+def _reset_graph():
+    tf.reset_default_graph()
+
+
+def _residual_net(x, num_units):
+    weights = []
+    for i in range(num_units):
+        w = tf.Variable(np.random.rand(4, 4).astype(np.float32) * 0.5, name='w%d' % i)
+        weights.append(w)
+        x = recompute.mark_checkpoint(x + tf.nn.relu(tf.matmul(x, w)))
+    l2 = tf.add_n([tf.nn.l2_loss(w) for w in weights])
+    return tf.reduce_mean(tf.square(x)) + 0.1 * l2, weights
+
+
+def test_select_checkpoints():
+    loss, _ = _residual_net(tf.constant(np.random.rand(3, 4).astype(np.float32)), 9)
+    assert len(recompute.select_checkpoints('units', [loss])) == 9
+    assert len(recompute.select_checkpoints('sqrt', [loss])) == 3
+    assert len(recompute.select_checkpoints(4, [loss])) == 2
+    with pytest.raises(ValueError):
+        recompute.select_checkpoints('all', [loss])
+
+
+def test_gradients_match_the_default_backprop():
+    loss, weights = _residual_net(tf.constant(np.random.rand(3, 4).astype(np.float32)), 6)
+    expected = tf.gradients(loss, weights)
+    grads = recompute.gradients([loss], weights, recompute.select_checkpoints('sqrt', [loss]))
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        for g, e in zip(sess.run(grads), sess.run(expected)):
+            assert_array_almost_equal(g, e, decimal=5)
+
+
+def test_gradients_with_a_side_branch_and_a_duplicate_checkpoint():
+    x = tf.constant(np.random.rand(3, 4).astype(np.float32))
+    w_side = tf.Variable(np.random.rand(4, 4).astype(np.float32) * 0.5, name='w_side')
+    # a side branch from the input, joining the loss after the residual units
+    side = recompute.mark_checkpoint(tf.nn.relu(tf.matmul(x, w_side)))
+    units_loss, weights = _residual_net(x, 4)
+    recompute.mark_checkpoint(tf.get_collection(recompute.UNIT_CHECKPOINTS)[1])
+    loss = units_loss + tf.reduce_mean(side)
+    weights = [w_side] + weights
+    checkpoints = recompute.select_checkpoints('units', [loss])
+    assert len(checkpoints) == 5
+    expected = tf.gradients(loss, weights)
+    grads = recompute.gradients([loss], weights, checkpoints + checkpoints[2:3])
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        for g, e in zip(sess.run(grads), sess.run(expected)):
+            assert_array_almost_equal(g, e, decimal=5)
@@ -0,0 +1,26 @@
+from tefla.core.resolution_schedule import ResolutionSchedule
+
+
+class Iterator(object):
+    w, h = 224, 224
+
+    def set_crop_size(self, crop_size):
+        self.w, self.h = crop_size
+
+
+def test_resolution_schedule():
+    schedule = ResolutionSchedule([(10, 0.75), (1, 0.5), (20, 1.0)])
+    iterator = Iterator()
+    assert schedule.apply(iterator, 1) == (128, 128)
+    assert (iterator.w, iterator.h) == (128, 128)
+    assert schedule.apply(iterator, 9) == (128, 128)
+    assert schedule.apply(iterator, 10) == (160, 160)
+    assert schedule.apply(iterator, 25) == (224, 224)
+    assert schedule.crop_size(1, (448, 224)) == (224, 128)
+
+
+def test_resolution_schedule_sizes():
+    schedule = ResolutionSchedule([(1, (128, 112)), (5, 0.1)], multiple=16)
+    assert schedule.crop_size(3, (224, 224)) == (128, 112)
+    assert schedule.crop_size(5, (224, 224)) == (16, 16)
+    assert ResolutionSchedule.from_cnf({}) is None
@@ -0,0 +1,46 @@
+import struct
+
+import pytest
+
+from tefla.dataset import shard_index
+
+
+def _write_records(fname, records):
+    # TFRecord framing: uint64 length, length crc, data, data crc (crcs are not checked by the reader)
+    with open(fname, 'wb') as f:
+        for record in records:
+            f.write(struct.pack('<Q', len(record)) + b'\0' * 4 + record + b'\0' * 4)
+
+
+@pytest.fixture
+def shards(tmpdir):
+    files = []
+    for shard in range(2):
+        fname = str(tmpdir.join(shard_index.shard_filename('train', shard, 2)))
+        records = [('record-%d-%d' % (shard, i) * (i + 1)).encode() for i in range(5)]
+        _write_records(fname, records)
+        shard_index.write_index(fname, 'tfrecord', ['%d' % i for i in range(5)], [i % 2 for i in range(5)],
+                                record_lengths=[len(r) for r in records])
+        files.append(fname)
+    return files
+
+
+def test_record_reader_reads_by_offset(shards):
+    reader = shard_index.RecordReader(shards)
+    assert len(reader) == 10
+    assert reader.read(7) == ('record-1-2' * 3).encode()
+    assert reader.read_many([9, 0]) == [('record-1-4' * 5).encode(), b'record-0-0']
+    reader.close()
+
+
+def test_stratified_sample_and_histogram(shards):
+    reader = shard_index.RecordReader(shards)
+    sample = reader.stratified_sample(3, seed=1)
+    labels = [reader.labels[i] for i in sample]
+    assert labels.count(0) == 3 and labels.count(1) == 3
+    histogram = shard_index.label_histogram([shard_index.read_index(f) for f in shards])
+    assert histogram == {0: 6, 1: 4}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,47 @@
+from collections import namedtuple
+
+from tefla.core import step_profiler
+
+StepStats = namedtuple('StepStats', ['dev_stats'])
+DevStats = namedtuple('DevStats', ['device', 'node_stats'])
+NodeStats = namedtuple('NodeStats', ['node_name', 'all_end_rel_micros'])
+
+
+def test_split_op_name():
+    assert step_profiler.split_op_name('model/conv1/Conv2D') == ('forward', 'model/conv1/Conv2D')
+    assert step_profiler.split_op_name('gradients/model/conv1/Conv2D_grad/Conv2DBackpropFilter') == \
+        ('backward', 'model/conv1/Conv2D_grad/Conv2DBackpropFilter')
+    assert step_profiler.split_op_name('tower_0/gradients_1/pool1/MaxPool_grad/MaxPoolGrad') == \
+        ('backward', 'tower_0/pool1/MaxPool_grad/MaxPoolGrad')
+    assert step_profiler.split_op_name('Momentum/update_model/conv1/weights/ApplyMomentum') == \
+        ('update', 'model/conv1/weights/ApplyMomentum')
+
+
+def test_layer_times():
+    scopes = [('model/conv1', 'model/conv1'), ('model/pool1', 'pool1')]
+    scopes = sorted(scopes, key=lambda s: len(s[0]), reverse=True)
+    nodes = [NodeStats('_SOURCE', 1), NodeStats('model/conv1/Conv2D', 100), NodeStats('model/pool1/MaxPool', 30),
+             NodeStats('gradients/model/pool1/MaxPool_grad/MaxPoolGrad', 50),
+             NodeStats('gradients/model/conv1/Conv2D_grad/Conv2DBackpropFilter', 200),
+             NodeStats('Momentum/update_model/conv1/weights/ApplyMomentum', 5), NodeStats('loss/Mean', 7)]
+    step_stats = StepStats([DevStats('/job:localhost/replica:0/task:0/cpu:0', nodes),
+                            DevStats('/job:localhost/replica:0/task:0/gpu:0/stream:7', nodes)])
+    times = step_profiler.layer_times(step_stats, scopes)
+    assert list(times.keys()) == ['model/conv1', 'pool1', 'loss']
+    assert times['model/conv1'] == {'forward': 100, 'backward': 200, 'update': 5}
+    assert times['pool1'] == {'forward': 30, 'backward': 50, 'update': 0}
+    assert times['loss']['forward'] == 7
+
+    table = step_profiler.format_layer_times([dict(times[k], name=k, total=sum(times[k].values())) for k in times])
+    assert table.splitlines()[1].startswith('model/conv1')
+
+
+def test_close_reports_the_traced_steps(tmpdir):
+    profiler = step_profiler.StepProfiler(str(tmpdir), profile_steps=(2, 1000))
+    profiler.close()
+    assert not tmpdir.listdir()
+    # step 1000 is past the end of the loop
+    profiler._traced_steps.append(2)
+    profiler._times['model/conv1'] = {'forward': 100, 'backward': 200, 'update': 5}
+    profiler.close()
+    assert tmpdir.join('step-layer-times.json').check()
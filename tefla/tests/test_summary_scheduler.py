@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from tefla.core.summary_scheduler import SummaryScheduler, AsyncSummaryWriter
+
+
+class _RecordingWriter(object):
+
+    def __init__(self):
+        self.summaries = []
+        self.flushes = 0
+        self.closed = False
+        self.thread_names = set()
+
+    def add_summary(self, summary, global_step=None):
+        self.thread_names.add(threading.current_thread().name)
+        self.summaries.append((summary, global_step))
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closed = True
+
+
+def test_scheduler_samples_layers():
+    scheduler = SummaryScheduler(every_n_steps=10, max_layers=3)
+    assert [s for s in range(1, 31) if scheduler.should_run(s)] == [10, 20, 30]
+    assert scheduler.sample_layers(range(9)) == [0, 4, 8]
+    assert scheduler.sample_layers(range(2)) == [0, 1]
+    assert SummaryScheduler(max_layers=None).sample_layers(range(5)) == list(range(5))
+    with pytest.raises(ValueError):
+        SummaryScheduler(every_n_steps=0)
+
+
+def test_scheduler_overhead():
+    scheduler = SummaryScheduler()
+    scheduler.record_step(1.0, False)
+    assert scheduler.overhead() is None
+    for _ in range(3):
+        scheduler.record_step(1.0, False)
+    scheduler.record_step(3.0, True)
+    # 2 of the 7 seconds are summary overhead
+    assert scheduler.overhead() == pytest.approx(100.0 * 2 / 7)
+    scheduler.reset()
+    assert scheduler.overhead() is None
+
+
+def test_async_writer_writes_in_background():
+    writer = _RecordingWriter()
+    async_writer = AsyncSummaryWriter(writer, flush_every=2)
+    for step in range(5):
+        async_writer.add_summary('summary-%d' % step, step)
+    async_writer.flush()
+    assert writer.summaries == [('summary-%d' % step, step) for step in range(5)]
+    assert writer.thread_names == set(['summary_writer'])
+    assert writer.flushes >= 3
+    async_writer.close()
+    assert writer.closed
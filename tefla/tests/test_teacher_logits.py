@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from tefla.core.teacher_logits import TeacherLogits, write_teacher_logits
+
+
+def test_teacher_logits(tmpdir):
+    files = ['img/%d.jpg' % i for i in range(10)]
+    probs = np.random.dirichlet(np.ones(5), size=10).astype(np.float32)
+
+    def predict_fn(chunk):
+        return probs[[files.index(f) for f in chunk]]
+
+    path = str(tmpdir.join('teacher.npy'))
+    write_teacher_logits(path, files, predict_fn, chunk_size=4)
+    logits = TeacherLogits(path, files)
+    assert isinstance(logits.logits, np.memmap) and logits.num_classes == 5
+    batch = np.array(['img/7.jpg', 'img/2.jpg', 'img/7.jpg'])
+    assert np.allclose(logits.lookup(batch), np.log(probs[[7, 2, 7]]), atol=1e-6)
+    with pytest.raises(ValueError):
+        logits.check_files(files + ['img/missing.jpg'])
@@ -0,0 +1,20 @@
+import numpy as np
+
+from tefla.core import towers
+
+
+def test_tower_settings():
+    assert towers.tower_devices(2, 'cpu') == ['/cpu:0', '/cpu:1']
+    assert towers.tower_session_settings(4, 'gpu') == {}
+    settings = towers.tower_session_settings(4, 'cpu', threads_per_tower=3)
+    assert settings == {'num_cpu_devices': 4, 'intra_op_threads': 12, 'inter_op_threads': 8}
+
+
+def test_pad_batch():
+    X, y = np.arange(10).reshape(5, 2), np.arange(5)
+    Xp, yp, n = towers.pad_batch(X, y, 4)
+    assert n == 5 and len(Xp) == 8
+    assert np.array_equal(yp, [0, 1, 2, 3, 4, 0, 1, 2])
+    assert np.array_equal(Xp[5:], X[:3])
+    Xp, yp, n = towers.pad_batch(X, None, 5)
+    assert Xp is X and yp is None and n == 5
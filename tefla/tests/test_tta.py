@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from tefla.da import tta
+
+
+def test_running_tta_stats_matches_batch_moments():
+    predictions = np.random.rand(6, 10, 5)
+    stats = tta.RunningTTAStats(10, 5)
+    for p in predictions:
+        stats.update(np.arange(10), p)
+    assert_array_equal(stats.count, [6] * 10)
+    assert_array_almost_equal(stats.mean, predictions.mean(axis=0))
+    assert_array_almost_equal(stats.variance, predictions.var(axis=0, ddof=1))
+
+
+def test_running_tta_stats_subset_update():
+    predictions = np.random.rand(4, 8, 3)
+    stats = tta.RunningTTAStats(8, 3)
+    stats.update(np.arange(8), predictions[0])
+    stats.update(np.arange(8), predictions[1])
+    active = np.array([1, 4, 6])
+    stats.update(active, predictions[2][active])
+    stats.update(active, predictions[3][active])
+    assert_array_equal(stats.count, [2, 4, 2, 2, 4, 2, 4, 2])
+    assert_array_almost_equal(stats.mean[active], predictions[:, active].mean(axis=0))
+    assert_array_almost_equal(stats.mean[0], predictions[:2, 0].mean(axis=0))
+
+
+def test_running_tta_stats_standard_error():
+    predictions = np.random.rand(9, 4, 3)
+    stats = tta.RunningTTAStats(4, 3)
+    for p in predictions:
+        stats.update(np.arange(4), p)
+    assert_array_almost_equal(stats.standard_error, predictions.std(axis=0, ddof=1) / 3.0)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
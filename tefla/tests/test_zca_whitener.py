@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from tefla.da.data_normalization import ZCAWhitener
+
+
+def _images(n=600, seed=0):
+    # correlated pixels, [N, 2, 2, 3]
+    rng = np.random.RandomState(seed)
+    mixing = rng.rand(12, 12) + np.eye(12)
+    return (np.dot(rng.randn(n, 12), mixing) * 20 + 100).reshape(n, 2, 2, 3).astype(np.float32)
+
+
+def test_whitened_covariance_is_identity():
+    images = _images()
+    whitener = ZCAWhitener(epsilon=1e-8).fit([images])
+    whitened = whitener.apply(images).reshape(len(images), -1).astype(np.float64)
+    assert np.allclose(whitened.mean(axis=0), 0, atol=1e-3)
+    assert np.allclose(np.cov(whitened.T, bias=True), np.eye(12), atol=1e-3)
+
+
+def test_partial_fit_matches_one_shot_fit():
+    images = _images()
+    one_shot = ZCAWhitener().fit([images])
+    chunked = ZCAWhitener()
+    for chunk in np.array_split(images, 7):
+        chunked.partial_fit(chunk)
+    chunked.finalize()
+    assert np.allclose(chunked.mean, one_shot.mean, rtol=1e-5)
+    assert np.allclose(chunked.components, one_shot.components, rtol=1e-4, atol=1e-6)
+
+
+def test_batch_apply_matches_per_image_whitening():
+    images = _images()
+    whitener = ZCAWhitener().fit(np.array_split(images, 3))
+    batch = whitener.apply(images[:10])
+    for image, whitened in zip(images[:10], batch):
+        expected = np.dot(image.reshape(-1) - whitener.mean, whitener.components).reshape(image.shape)
+        assert np.allclose(whitened, expected, atol=1e-4)
+        assert np.allclose(whitener.apply(image[np.newaxis])[0], whitened, atol=1e-5)
+    assert batch.shape == (10, 2, 2, 3) and batch.dtype == np.float32
+
+
+def test_save_load_round_trip(tmpdir):
+    images = _images()
+    whitener = ZCAWhitener(epsilon=1e-3).fit([images])
+    fname = str(tmpdir.join('zca.npz'))
+    whitener.save(fname)
+    loaded = ZCAWhitener.load(fname)
+    assert loaded.epsilon == 1e-3
+    assert loaded.mean.dtype == np.float32 and loaded.components.dtype == np.float32
+    assert np.array_equal(loaded.mean, whitener.mean)
+    assert np.array_equal(loaded.components, whitener.components)
+    assert np.array_equal(loaded.apply(images[:5]), whitener.apply(images[:5]))
+
+
+def test_finalize_without_data():
+    with pytest.raises(ValueError):
+        ZCAWhitener().finalize()
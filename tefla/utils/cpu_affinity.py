@@ -0,0 +1,76 @@
+"""Cpu affinity helpers, without tensorflow so the numpy-only da workers can import them.
+
+The cpus of the process are recorded once, at import, before any pinning: the splits between
+the da workers and tf are always made from this full set, so creating several sessions (or
+pinning the process to the tf cpus before the da pool starts) gives the same split every time.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger('tefla')
+
+
+def available_cpus():
+    """Returns the sorted list of cpus the calling process may run on now"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        import psutil
+        return sorted(psutil.Process().cpu_affinity())
+    except (ImportError, AttributeError):
+        return list(range(multiprocessing.cpu_count()))
+
+
+_PROCESS_CPUS = available_cpus()
+
+
+def process_cpus():
+    """Returns the sorted list of cpus the process could run on at import, before any pinning"""
+    return list(_PROCESS_CPUS)
+
+
+def set_cpu_affinity(cpus):
+    """Pins the calling process (and the threads it starts later) to `cpus`
+
+    Args:
+        cpus: a list of cpu ids
+
+    Returns:
+        a bool, True if the affinity was set
+    """
+    if not cpus:
+        return False
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        return True
+    try:
+        import psutil
+        psutil.Process().cpu_affinity(list(cpus))
+        return True
+    except (ImportError, AttributeError):
+        logger.warn('Cpu pinning is not supported on this platform, install psutil')
+        return False
+
+
+def cpu_split(da_workers, cpus=None):
+    """Splits the cpus between data augmentation workers and tf threads
+
+    The da workers get the last `da_workers` cpus and tf keeps the rest, at
+    least one cpu is always left for tf.
+
+    Args:
+        da_workers: number of data augmentation worker processes
+        cpus: a list of cpu ids, defaults to `process_cpus`, the cpus of the
+            process before any pinning
+
+    Returns:
+        a tuple, (da_cpus, tf_cpus)
+    """
+    cpus = process_cpus() if cpus is None else list(cpus)
+    num_da = max(0, min(da_workers or 0, len(cpus) - 1))
+    if num_da == 0:
+        return [], cpus
+    return cpus[-num_da:], cpus[:-num_da]
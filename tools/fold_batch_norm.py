@@ -0,0 +1,92 @@
+# -------------------------------------------------------------------#
+# Tool to fold the batch norm layers of a frozen tefla graph into the
+# preceding conv2d / fully_connected weights and biases
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import sys
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.platform import gfile
+
+from tefla.core import bn_folding
+
+
+def fold(input_graph, output_graph, input_name, output_name, batch_size, tolerance, num_runs):
+    graph_def = tf.GraphDef()
+    with gfile.Open(input_graph, "rb") as f:
+        graph_def.ParseFromString(f.read())
+
+    output_node = output_name.split(':')[0]
+    folded_graph_def, folded = bn_folding.fold_batch_norms(graph_def, [output_node])
+    for layer, bn in folded:
+        print("Folded %s into %s" % (bn, layer))
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        input_shape = graph.get_tensor_by_name(input_name).get_shape().as_list()
+    input_shape[0] = batch_size
+    batch = np.random.rand(*input_shape).astype(np.float32)
+    max_diff, latency, folded_latency = bn_folding.compare_graphs(
+        graph_def, folded_graph_def, input_name, output_name, batch, num_runs)
+
+    print("Folded layers: %d" % len(folded))
+    print("Nodes: %d -> %d" % (len(graph_def.node), len(folded_graph_def.node)))
+    print("Latency (batch %d): %.2f ms -> %.2f ms" % (batch_size, latency * 1000, folded_latency * 1000))
+    print("Max abs output difference: %g" % max_diff)
+    if max_diff > tolerance:
+        print("Folded graph output differs more than %g, not saved" % tolerance)
+        return -1
+
+    with gfile.FastGFile(output_graph, "wb") as f:
+        f.write(folded_graph_def.SerializeToString())
+    print("Saved to %s" % output_graph)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input",
+        type=str,
+        default="",
+        help="Frozen binary GraphDef file to load.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="",
+        help="File to save the folded graph to.")
+    parser.add_argument(
+        "--input_name",
+        type=str,
+        default="inputs/input:0",
+        help="Input tensor name, used for the numeric check.")
+    parser.add_argument(
+        "--output_name",
+        type=str,
+        default="predictions/Softmax:0",
+        help="Output tensor name, its node and the nodes it depends on are kept.")
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=8,
+        help="Batch size of the numeric check and latency runs.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-4,
+        help="Max abs output difference allowed between the graphs.")
+    parser.add_argument(
+        "--num_runs",
+        type=int,
+        default=20,
+        help="Number of timed runs per graph.")
+    args, unparsed = parser.parse_known_args()
+    sys.exit(fold(args.input, args.output, args.input_name, args.output_name, args.batch_size, args.tolerance,
+                  args.num_runs))